@@ -1,13 +1,15 @@
 import streamlit as st
 import os
 from src.agent import Agent
-from src.ingestion import ingest_data
 
 st.set_page_config(page_title="AI консультант по госимуществу", layout="wide")
 
 @st.cache_resource
 def get_agent():
-    return Agent()
+    agent = Agent()
+    # Index and clients load while the page renders instead of on the first question
+    agent.start_warm_up()
+    return agent
 
 def main():
     st.title("🏛️ AI Консультант по госимуществу")
@@ -20,6 +22,8 @@ def main():
         if st.button("Обновить Базу Знаний"):
             with st.spinner("Идет индексация документов..."):
                 try:
+                    # docx/PyMuPDF are only needed here, so they aren't imported at startup
+                    from src.ingestion import ingest_data
                     ingest_data()
                     st.success("База знаний обновлена!")
                     # Clear cache to reload DB connection if needed
@@ -1,18 +1,40 @@
 import os
+import re
 import json
-from openai import OpenAI
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src import llm, tracing
 from src.database import get_db
-from src.config import GROK_API_KEY, GROK_MODEL
-
+from src.intent_classifier import CentroidIntentClassifier
+from src.lexical_index import LexicalIndex
+from src.reranker import get_reranker
+from src.answer_cache import SemanticAnswerCache, IndexVersion
+from src.context_packer import pack_context
+from src.config import (
+    GROK_MODEL,
+    RERANKER,
+    RERANKER_MODEL,
+    RERANK_SHORTLIST,
+    RERANK_BUDGET_MS,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    SELF_CORRECTION_MODE,
+    VERIFY_BATCH_CHARS,
+    VERIFY_BATCH_SECONDS,
+    CONTEXT_TOKEN_BUDGET,
+    LLM_FAST_TIMEOUT,
+    RETRIEVAL_INITIAL_K,
+    RETRIEVAL_TOP_N,
+    RETRIEVAL_PLANNER,
+    RETRIEVAL_NARROW_K,
+    RETRIEVAL_MIN_SPREAD,
+    RETRIEVAL_AGREEMENT_DEPTH,
+)
 
 
-from src.utils import get_compute_device
-
-# X.AI setup
-client = OpenAI(
-    api_key=GROK_API_KEY,
-    base_url="https://api.x.ai/v1",
-)
 
 CATEGORIES = [
     "Передача",
@@ -23,6 +45,11 @@ CATEGORIES = [
     "Эффективность управления (отчетность)"
 ]
 
+# Reciprocal rank fusion constant (Cormack et al.); dampens the weight of top ranks
+RRF_K = 60
+
+NO_CONTEXT_RESPONSE = "К сожалению, я не нашел информации по вашему запросу в базе знаний."
+
 SYSTEM_PROMPT = """Ты - эксперт-консультант по управлению государственным имуществом Республики Казахстан.
 Твоя задача - давать точные, пошаговые инструкции на основе предоставленного контекста из НПА (Нормативно-правовых актов).
 
@@ -39,16 +66,151 @@ SYSTEM_PROMPT = """Ты - эксперт-консультант по управ
 3. ИЗБЕГАЙ упоминания "Национального Банка" и "Военного имущества/Военного времени", если пользователь ПРЯМО не спросил об этом. Это специфические исключения, которые путают пользователей. Оперируй общими правилами для госимущества.
 """
 
+class _lazy:
+    """
+    Agent attribute loaded on first use, once even under concurrent requests. Assigning the
+    attribute (as the constructor does for anything passed in) replaces it without loading.
+    """
+    def __init__(self, load):
+        self.load = load
+        self.name = load.__name__
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return self
+        with agent._init_locks.setdefault(self.name, threading.Lock()):
+            if self.name not in agent.__dict__:
+                agent.__dict__[self.name] = self.load(agent)
+        # From now on the instance attribute shadows this (non-data) descriptor
+        return agent.__dict__[self.name]
+
 class Agent:
-    def __init__(self):
-        self.db = get_db()
-        self.npa_collection = self.db.get_or_create_collection("npa_collection")
-        self.instr_collection = self.db.get_or_create_collection("instructions_collection")
-        # Initialize Re-ranker
-        # Re-ranker disabled for performance
-        # self.reranker = None
-
-    def classify_intent(self, query):
+    def __init__(self, db=None, intent_classifier=None, lexical_index=None, reranker=None):
+        """
+        Everything not passed in is loaded from the configured index (CHROMA_PATH etc.) on
+        first use, so constructing an Agent is instant; warm_up() loads it all up front.
+        """
+        self._init_locks = {}
+        for name, value in (("db", db), ("intent_classifier", intent_classifier), ("lexical_index", lexical_index), ("reranker", reranker)):
+            if value is not None:
+                setattr(self, name, value)
+        # Answers to semantically identical questions, invalidated when the corpus changes
+        self.answer_cache = SemanticAnswerCache(
+            threshold=ANSWER_CACHE_THRESHOLD,
+            max_entries=ANSWER_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANSWER_CACHE_TTL
+        ) if ANSWER_CACHE_MAX_ENTRIES > 0 else None
+        # Collection queries for one request run side by side
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        # Event loop thread backing the sync API (run, classify_intent, ...)
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @_lazy
+    def db(self):
+        return get_db()
+
+    @_lazy
+    def npa_collection(self):
+        return self.db.get_or_create_collection("npa_collection")
+
+    @_lazy
+    def instr_collection(self):
+        return self.db.get_or_create_collection("instructions_collection")
+
+    @_lazy
+    def intent_classifier(self):
+        # Local classifier; classify_intent falls back to the LLM when missing or unsure
+        return CentroidIntentClassifier.load()
+
+    @_lazy
+    def lexical_index(self):
+        # BM25 side of hybrid retrieval; dense-only if ingestion hasn't built it yet
+        return LexicalIndex.load()
+
+    @_lazy
+    def reranker(self):
+        # Time-budgeted; falls back to retrieval order when over budget. A cross-encoder model
+        # loads in warm_up(), or else within the budget of the first queries.
+        return get_reranker(RERANKER, RERANKER_MODEL, shortlist=RERANK_SHORTLIST, budget_ms=RERANK_BUDGET_MS)
+
+    def warm_up(self):
+        """Loads the index, models and API clients now instead of on the first request; returns seconds per part."""
+        parts = {
+            "index": lambda: [c.count() for c in (self.npa_collection, self.instr_collection)],
+            "intent_classifier": lambda: self.intent_classifier,
+            "lexical_index": lambda: self.lexical_index,
+            "reranker": lambda: self.reranker is None or self.reranker.warm_up(),
+            "clients": self._warm_up_clients,
+        }
+        timings = {}
+        for name, load in parts.items():
+            start = time.perf_counter()
+            load()
+            timings[name] = time.perf_counter() - start
+        return timings
+
+    def _warm_up_clients(self):
+        # Builds the pooled API clients (and imports openai); an unusable key only fails the calls that need it
+        for upstream in (llm.get_chat_upstream(), llm.get_embedding_upstream()):
+            try:
+                upstream.client
+            except Exception as e:
+                print(f"Could not create the {upstream.name} client yet: {e}")
+
+    def start_warm_up(self):
+        """warm_up() on a background thread; requests arriving meanwhile wait only for the parts they use."""
+        thread = threading.Thread(target=self.warm_up, daemon=True, name="agent-warm-up")
+        thread.start()
+        return thread
+
+    def status(self):
+        """Index load state, for readiness checks."""
+        return {
+            "collections": {c.name: c.count() for c in (self.npa_collection, self.instr_collection)},
+            "index_version": IndexVersion().get(),
+            "lexical_index": self.lexical_index is not None,
+            "intent_classifier": self.intent_classifier is not None,
+            "answer_cache": self.answer_cache.stats() if self.answer_cache is not None else None,
+            "upstreams": {"chat": llm.get_chat_upstream().stats(), "embeddings": llm.get_embedding_upstream().stats()},
+        }
+
+    def _get_loop(self):
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, daemon=True, name="agent-loop").start()
+            return self._loop
+
+    def _run_sync(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def _iter_sync(self, agen):
+        # Drive an async generator from sync code (e.g. st.write_stream)
+        loop = self._get_loop()
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+
+    def classify_intent(self, query, query_embedding=None):
+        return self._run_sync(self.aclassify_intent(query, query_embedding))
+
+    async def aclassify_intent(self, query, query_embedding=None):
+        if self.intent_classifier is not None:
+            if query_embedding is None:
+                query_embedding = await asyncio.to_thread(self.embed_query, query)
+            with tracing.span("classify.local") as span:
+                category, margin = self.intent_classifier.predict(query_embedding, allowed=CATEGORIES)
+                span["margin"] = round(float(margin), 4)
+            if category and self.intent_classifier.is_confident(margin):
+                return category
+            print(f"Local classifier unsure ({category}, margin {margin:.3f}), asking LLM")
+        with tracing.span("classify.llm"):
+            return await self.aclassify_intent_llm(query)
+
+    async def aclassify_intent_llm(self, query):
         prompt = f"""
         Определи наиболее подходящую категорию запроса пользователя из следующего списка:
         {CATEGORIES}
@@ -62,8 +224,9 @@ class Agent:
         """
         
         try:
-            response = client.chat.completions.create(
+            response = await llm.achat(
                 model=GROK_MODEL,
+                deadline=LLM_FAST_TIMEOUT,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.1
             )
@@ -85,6 +248,7 @@ class Agent:
         if not chromadb_results['documents']:
             return []
             
+        ids = chromadb_results['ids'][0]
         docs = chromadb_results['documents'][0]
         metas = chromadb_results['metadatas'][0]
         # Distances are optional, handle if missing
@@ -94,34 +258,74 @@ class Agent:
         else:
             dists = [1.0] * len(docs) # Default high distance
         
-        for doc, meta, dist in zip(docs, metas, dists):
+        for chunk_id, doc, meta, dist in zip(ids, docs, metas, dists):
             formatted.append({
+                "id": chunk_id,
                 "content": doc,
                 "metadata": meta,
                 "distance": dist
             })
         return formatted
 
+    def _lexical_results(self, collection, hits, known):
+        # BM25 hits come back as ids only; fetch text/metadata for the ones dense search didn't return
+        missing = [chunk_id for chunk_id, _ in hits if chunk_id not in known]
+        if missing:
+            res = collection.get(ids=missing, include=["documents", "metadatas"])
+            for chunk_id, doc, meta in zip(res['ids'], res['documents'], res['metadatas']):
+                known[chunk_id] = {"id": chunk_id, "content": doc, "metadata": meta, "distance": None}
+        return [known[chunk_id] for chunk_id, _ in hits if chunk_id in known]
+
     def generate_response(self, query, context_items, stream=False):
+        if stream:
+            return self._iter_sync(self.astream_response(query, context_items))
+        return self._run_sync(self.agenerate_response(query, context_items))
+
+    async def agenerate_response(self, query, context_items):
         if not context_items:
-            if stream:
-                yield "К сожалению, я не нашел информации по вашему запросу в базе знаний."
-                return
-            return "К сожалению, я не нашел информации по вашему запросу в базе знаний."
-            
-        context_parts = []
-        for item in context_items:
-            source = item['metadata'].get('source', 'Unknown')
-            # Hierarchical context from ingestion (e.g., "Law > Chapter 2 > Article 5")
-            hierarchy = item['metadata'].get('full_context', 'No context path')
-            content = item['content']
-            
-            # Format: [Source: file.docx | Path: Chapter > Article]
-            # Content: ...
-            part = f"[[Источник: {source} | Структура: {hierarchy}]]\\nТекст: {content}"
-            context_parts.append(part)
-            
-        context_str = "\\n\\n".join(context_parts)
+            return NO_CONTEXT_RESPONSE
+        messages = self._generation_messages(query, context_items)
+        with tracing.span("generate"):
+            response = await llm.achat(
+                model=GROK_MODEL,
+                messages=messages,
+                temperature=0.3
+            )
+        return response.choices[0].message.content
+
+    async def astream_response(self, query, context_items):
+        if not context_items:
+            yield NO_CONTEXT_RESPONSE
+            return
+        response = llm.astream_chat(
+            model=GROK_MODEL,
+            messages=self._generation_messages(query, context_items),
+            temperature=0.3
+        )
+        trace = tracing.current()
+        start = time.perf_counter()
+        first = None
+        with tracing.span("generate.stream", trace):
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first is None and trace is not None:
+                        first = time.perf_counter()
+                        trace.add_span("generate.ttft", start, first)
+                    yield chunk.choices[0].delta.content
+
+    def _pack_context(self, query, context_items, report=False):
+        # Format per block: [[Источник: file.docx | Структура: Chapter > Article]]
+        # Текст: ...
+        with tracing.span("pack_context") as span:
+            context_str, stats = pack_context(query, context_items, CONTEXT_TOKEN_BUDGET)
+            span["tokens"] = stats["packed_tokens"]
+        if report:
+            print(f"Context packing: {stats['chunks']} chunks -> {stats['blocks']} blocks, "
+                  f"~{stats['raw_tokens']} -> ~{stats['packed_tokens']} tokens (saved ~{stats['saved_tokens']})")
+        return context_str
+
+    def _generation_messages(self, query, context_items):
+        context_str = self._pack_context(query, context_items, report=True)
         
         user_message = f"""
 Ты аналитик по нормативно-правовым актам (НПА).
@@ -154,25 +358,15 @@ class Agent:
    - НЕ упоминай названия файлов (source), используй только смысловые ссылки на пункты/статьи.
 """
 
-        
-        response = client.chat.completions.create(
-            model=GROK_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.3,
-            stream=stream
-        )
-        
-        if stream:
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-        else:
-            return response.choices[0].message.content
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ]
 
     def check_need_clarification(self, query, history):
+        return self._run_sync(self.acheck_need_clarification(query, history))
+
+    async def acheck_need_clarification(self, query, history):
         # Format history
         history_str = ""
         for msg in history[-5:]: # Last 5 messages
@@ -214,12 +408,14 @@ class Agent:
         """
         
         try:
-            response = client.chat.completions.create(
-                model=GROK_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1,
-                response_format={"type": "json_object"}
-            )
+            with tracing.span("router"):
+                response = await llm.achat(
+                    model=GROK_MODEL,
+                    deadline=LLM_FAST_TIMEOUT,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.1,
+                    response_format={"type": "json_object"}
+                )
             content = response.choices[0].message.content.strip()
             # Clean up json if needed
             if content.startswith("```json"):
@@ -231,6 +427,9 @@ class Agent:
             return {"needs_clarification": False, "rewritten_query": query}
 
     def generate_hyde_doc(self, query):
+        return self._run_sync(self.agenerate_hyde_doc(query))
+
+    async def agenerate_hyde_doc(self, query):
         prompt = f"""
         Ты - эксперт по госимуществу РК.
         Напиши ГИПОТЕТИЧЕСКИЙ (вымышленный), но юридически правдоподобный ответ на вопрос:
@@ -240,18 +439,23 @@ class Agent:
         Ответ должен быть на русском языке.
         """
         try:
-            response = client.chat.completions.create(
-                model=GROK_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7 
-            )
+            with tracing.span("hyde"):
+                response = await llm.achat(
+                    model=GROK_MODEL,
+                    deadline=LLM_FAST_TIMEOUT,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.7 
+                )
             return response.choices[0].message.content
         except Exception as e:
             print(f"HyDE error: {e}")
             return query
 
     def self_correct(self, query, response, context_items):
-        context_str = "\\n".join([item['content'] for item in context_items])
+        return self._run_sync(self.aself_correct(query, response, context_items))
+
+    async def aself_correct(self, query, response, context_items):
+        context_str = self._pack_context(query, context_items)
         
         prompt = f"""
         Ты - строгий критик (Auditor). Твоя задача проверить ответ ассистента на соответствие контексту.
@@ -259,7 +463,7 @@ class Agent:
         Вопрос: {query}
         
         Контекст:
-        {context_str[:15000]}
+        {context_str}
         
         Ответ ассистента:
         {response}
@@ -271,11 +475,12 @@ class Agent:
         """
         
         try:
-            res = client.chat.completions.create(
-                model=GROK_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1
-            )
+            with tracing.span("self_correct"):
+                res = await llm.achat(
+                    model=GROK_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.1
+                )
             content = res.choices[0].message.content
             if "OK" in content[:10]:
                 return response # Return original if OK
@@ -286,72 +491,342 @@ class Agent:
             print(f"Self-correction error: {e}")
             return response
 
-    def retrieve(self, query, category, use_hyde=False):
+    async def astream_verified(self, query, context_items, max_concurrency=4):
+        """
+        Streams the answer with self-correction applied per segment (line/bullet, or sentence
+        for long lines). The first segment is audited as soon as it is complete, so the answer
+        starts after one audit round trip. Later ones are audited in batches while generation
+        continues: one call per VERIFY_BATCH_CHARS of text, or sooner if the oldest waiting segment
+        is VERIFY_BATCH_SECONDS old. Batches are released in order once verified, and only failing
+        segments are replaced by their corrected version.
+        """
+        context_str = self._pack_context(query, context_items)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        pending = asyncio.Queue()
+
+        async def produce():
+            buffer = ""
+            generated = ""
+            batch = []
+            batch_start = 0.0
+
+            def flush():
+                nonlocal generated, batch
+                if batch:
+                    pending.put_nowait(asyncio.create_task(self._averify_segments(query, batch, generated, context_str, semaphore)))
+                    generated += "".join(batch)
+                    batch = []
+
+            try:
+                async for part in self.astream_response(query, context_items):
+                    buffer += part
+                    segments, buffer = _split_segments(buffer)
+                    if segments and not batch:
+                        batch_start = time.monotonic()
+                    batch.extend(segments)
+                    # Nothing has been shown until the first batch is out, so it doesn't wait to fill
+                    if batch and (not generated or sum(len(seg) for seg in batch) >= VERIFY_BATCH_CHARS
+                                  or time.monotonic() - batch_start >= VERIFY_BATCH_SECONDS):
+                        flush()
+                if buffer:
+                    batch.append(buffer)
+                flush()
+            finally:
+                # Also on failure, so the consumer stops waiting and re-raises below
+                pending.put_nowait(None)
+
+        producer = asyncio.create_task(produce())
+        tasks = []
+        try:
+            while True:
+                task = await pending.get()
+                if task is None:
+                    break
+                tasks.append(task)
+                yield await task
+            await producer # Surface generation errors
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+            while not pending.empty():
+                task = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+
+    async def _averify_segments(self, query, segments, previous, context_str, semaphore):
+        """Audits a batch of segments in one call; returns their text with failing ones fixed or dropped."""
+        checked = [i for i, segment in enumerate(segments) if _needs_verification(segment)]
+        if not checked:
+            return "".join(segments)
+        numbered = "\n".join(f"[{n}] {segments[i].strip()}" for n, i in enumerate(checked, 1))
+
+        prompt = f"""
+        Ты - строгий критик (Auditor). Твоя задача проверить ФРАГМЕНТЫ ответа ассистента на соответствие контексту.
+        
+        Вопрос: {query}
+        
+        Контекст:
+        {context_str}
+        
+        Предыдущая часть ответа (для понимания, НЕ проверяй её):
+        {previous[-1500:]}
+        
+        Фрагменты для проверки (каждый со своим номером):
+        {numbered}
+        
+        Задание:
+        1. Проверь каждый фрагмент: не содержит ли он галлюцинаций (фактов, которых нет в контексте).
+        2. Если все фрагменты верные -> верни только слово "OK" (без кавычек и пояснений).
+        3. Иначе верни по строке на каждый фрагмент, начиная её с его номера в квадратных скобках:
+           "[n] OK", если фрагмент верный;
+           "[n] DELETE", если фрагмент целиком выдуман и исправить его по контексту нельзя;
+           "[n] " и ИСПРАВЛЕННЫЙ фрагмент в том же формате (markdown), без пояснений.
+        """
+
+        try:
+            with tracing.span("verify.segment", segments=len(checked)):
+                async with semaphore:
+                    res = await llm.achat(
+                        model=GROK_MODEL,
+                        deadline=LLM_FAST_TIMEOUT,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.1
+                    )
+            content = res.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Self-correction error: {e}")
+            return "".join(segments)
+        if "OK" in content[:10] and not _VERDICT.search(content):
+            return "".join(segments)
+
+        verdicts = {int(n): text.strip() for n, text in _VERDICT.findall(content)}
+        result = list(segments)
+        for n, i in enumerate(checked, 1):
+            verdict = verdicts.get(n)
+            # A missing verdict keeps the segment: the audit is a filter, not a gate
+            if verdict is None or verdict.startswith("OK"):
+                continue
+            if verdict.startswith("DELETE"):
+                print("Self-Correction Triggered: Dropping segment.")
+                result[i] = ""
+            else:
+                print("Self-Correction Triggered: Rewriting segment.")
+                # Keep the original line break so the markdown layout survives
+                result[i] = verdict + segments[i][len(segments[i].rstrip()):]
+        return "".join(result)
+
+    async def _aclassify_embedded(self, query, embed_task):
+        return await self.aclassify_intent(query, await embed_task)
+
+    async def _aretrieve_speculative(self, query, use_hyde, embed_task, classify_task, hyde_task):
+        """
+        Retrieval on the raw query, started before the router has decided whether it is rewritten.
+        The stages it waits on are shared with _arun, so they are shielded: cancelling this task
+        must not cancel the classification or HyDE that _arun goes on to use.
+        """
+        category = await asyncio.shield(classify_task)
+        hyde_doc = await asyncio.shield(hyde_task) if hyde_task else None
+        query_embedding = None if use_hyde else await asyncio.shield(embed_task)
+        return await self.aretrieve(query, category, use_hyde=use_hyde, hyde_doc=hyde_doc, query_embedding=query_embedding)
+
+    def embed_query(self, text):
+        with tracing.span("embed"):
+            return self.db.embedding_fn.embed_query([text])[0]
+
+    async def aretrieve(self, query, category, use_hyde=False, hyde_doc=None, query_embedding=None, initial_k=None, top_n=None, planner=None):
+        if use_hyde and hyde_doc is None:
+            hyde_doc = await self.agenerate_hyde_doc(query)
+        return await asyncio.to_thread(
+            self.retrieve, query, category, use_hyde=use_hyde, hyde_doc=hyde_doc,
+            query_embedding=query_embedding, initial_k=initial_k, top_n=top_n, planner=planner
+        )
+
+    def retrieve(self, query, category, use_hyde=False, hyde_doc=None, query_embedding=None, initial_k=None, top_n=None, planner=None):
         search_text = query
         if use_hyde:
-            print("Generating HyDE document...")
-            hyde_doc = self.generate_hyde_doc(query)
+            if hyde_doc is None:
+                print("Generating HyDE document...")
+                hyde_doc = self.generate_hyde_doc(query)
             print(f"HyDE Doc: {hyde_doc[:100]}...")
             search_text = hyde_doc
 
-        # 1. Broad Retrieval (Get more candidates)
-        initial_k = 150
-        candidates = []
-        
+        # 1. Broad Retrieval: dense and lexical candidates for each search scope.
+        # BM25 catches exact terms ("Статья 15", form names) that dense search misses,
+        # so fewer dense candidates are needed than before (150).
+        initial_k = initial_k or RETRIEVAL_INITIAL_K
+        top_n = top_n or RETRIEVAL_TOP_N
+        planner = planner or RETRIEVAL_PLANNER
+        trace = tracing.current() # Chroma queries run on executor threads, which don't inherit it
+
+        # Embed once and reuse the vector for every collection query
+        if query_embedding is None:
+            query_embedding = self.embed_query(search_text)
+
+        scoped = []
         # Search Specific Category
         if category != "Общий":
-            res_cat = self.npa_collection.query(
-                query_texts=[search_text],
-                n_results=initial_k,
-                where={"category": category}
-            )
-            candidates.extend(self._format_results(res_cat))
-            
-            res_instr = self.instr_collection.query(
-                query_texts=[search_text],
-                n_results=initial_k,
-                where={"category": category}
-            )
-            candidates.extend(self._format_results(res_instr))
+            scoped.append((self.npa_collection, category))
+            scoped.append((self.instr_collection, category))
             
         # Search Global Fallback (catch-all for misclassified docs or cross-category info)
         # This is critical because some docs might be in specific folders but relevant to other queries.
-        res_global = self.npa_collection.query(
-            query_texts=[search_text],
-            n_results=initial_k,
-            # No 'where' clause -> search everything
-        )
-        candidates.extend(self._format_results(res_global))
-        
-        # Deduplicate candidates
-        # Deduplicate candidates (preserve best distance)
-        unique_candidates = {}
-        for c in candidates:
-            # If doc already exists, keep the one with lower distance (if available)
-            if c['content'] not in unique_candidates:
-                unique_candidates[c['content']] = c
+        everything = scoped + [(self.npa_collection, None)] # No category -> search everything
+
+        with tracing.span("retrieve.plan", trace) as plan:
+            if planner == "adaptive" and self.lexical_index is not None:
+                # Narrow pass first: a small k, and only the category scopes when there is a category.
+                # Widen to initial_k over every scope only if the narrow results look unreliable.
+                # (Dense-only retrieval has no second opinion to check against, so it always goes wide.)
+                narrow_k = min(RETRIEVAL_NARROW_K, initial_k)
+                dense, lexical = self._search(query, query_embedding, scoped or everything, narrow_k, trace)
+                candidates = self._fuse(dense + lexical, trace)
+                weak = self._weak_results(dense, lexical, candidates, top_n)
+                plan.update(path="narrow", k=narrow_k, queries=len(scoped or everything), candidates=_count(dense + lexical))
+                if weak:
+                    dense, lexical = self._search(query, query_embedding, everything, initial_k, trace)
+                    candidates = self._fuse(dense + lexical, trace)
+                    plan.update(
+                        path="wide", reason=weak, k=initial_k,
+                        queries=plan["queries"] + len(everything),
+                        candidates=plan["candidates"] + _count(dense + lexical)
+                    )
             else:
-                if c['distance'] and unique_candidates[c['content']]['distance']:
-                    if c['distance'] < unique_candidates[c['content']]['distance']:
-                         unique_candidates[c['content']] = c
-        
-        candidates = list(unique_candidates.values())
-        
-        # SORT by distance (Ascending: Lower is better for L2/Euclidean)
-        candidates.sort(key=lambda x: x.get('distance', 1.0) or 1.0)
+                dense, lexical = self._search(query, query_embedding, everything, initial_k, trace)
+                candidates = self._fuse(dense + lexical, trace)
+                plan.update(path="fixed", k=initial_k, queries=len(everything), candidates=_count(dense + lexical))
+        if trace is not None:
+            trace.set(retrieval_plan=plan["path"])
 
         if not candidates:
             return []
 
-        # 2. Re-ranking
-        # Return Top K without re-ranking
-        return candidates[:15]
+        # 2. Re-ranking of the fused shortlist
+        if self.reranker is not None:
+            with tracing.span("retrieve.rerank", trace) as span:
+                candidates, info = self.reranker.rerank(query, candidates, top_n=top_n)
+                span.update(scored=info["scored"], timed_out=info["timed_out"], error=info["error"])
+            if info["error"]:
+                print(f"Re-ranking failed ({info['error']}), kept retrieval order")
+            elif info["timed_out"]:
+                print(f"Re-ranking over budget after {info['scored']} passages, kept retrieval order")
+        else:
+            candidates = candidates[:top_n]
+
+        return candidates
+
+    def _search(self, query, query_embedding, scopes, k, trace):
+        """Dense and BM25 ranked lists, each `k` deep, for every (collection, category) scope."""
+        def run_query(scope):
+            collection, category = scope
+            # A chunk filed under several categories (the same law in two folders) is stored once and lists them all
+            kwargs = {"where": {"categories": {"$contains": category}}} if category else {}
+            with tracing.span(f"retrieve.chroma.{collection.name}{'.category' if category else ''}", trace, k=k):
+                return collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=k,
+                    **kwargs
+                )
+
+        with tracing.span("retrieve.dense", trace):
+            dense = [self._format_results(res) for res in self.executor.map(run_query, scopes)]
+
+        lexical = []
+        if self.lexical_index is not None:
+            with tracing.span("retrieve.lexical", trace):
+                known = {c['id']: c for ranked in dense for c in ranked}
+                for collection, category in scopes:
+                    # Exact terms come from the question itself, not from a HyDE document
+                    hits = self.lexical_index.search(
+                        query,
+                        k=k,
+                        collection=collection.name,
+                        category=category
+                    )
+                    lexical.append(self._lexical_results(collection, hits, known))
+        return dense, lexical
+
+    def _fuse(self, ranked_lists, trace):
+        with tracing.span("retrieve.fusion", trace):
+            # Reciprocal rank fusion, deduplicated by id: ids are content hashes, so copies of a
+            # passage share one (keep the best distance for display)
+            fused = {}
+            for ranked in ranked_lists:
+                for rank, c in enumerate(ranked):
+                    entry = fused.get(c['id'])
+                    if entry is None:
+                        entry = fused[c['id']] = dict(c, score=0.0)
+                    elif c['distance'] is not None and (entry['distance'] is None or c['distance'] < entry['distance']):
+                        entry.update(c, score=entry['score'])
+                    entry['score'] += 1.0 / (RRF_K + rank + 1)
+            
+            candidates = list(fused.values())
+            
+            # SORT by fused score (higher is better), then distance
+            candidates.sort(key=lambda x: (-x['score'], x.get('distance') or 1.0))
+        return candidates
+
+    def _weak_results(self, dense, lexical, candidates, top_n):
+        """Why a narrow pass can't be trusted (None if it can): too few results, flat scores, or dense and BM25 disagree."""
+        if len(candidates) < top_n:
+            return "underfilled"
+        for ranked in dense:
+            distances = [c['distance'] for c in ranked if c['distance'] is not None]
+            # The last result nearly as close as the first: relevant passages probably continue past k
+            if len(distances) > 1 and distances[-1] - distances[0] < RETRIEVAL_MIN_SPREAD * distances[-1]:
+                return "flat"
+        if lexical:
+            head = RETRIEVAL_AGREEMENT_DEPTH
+            dense_top = {c['id'] for ranked in dense for c in ranked[:head]}
+            lexical_top = {c['id'] for ranked in lexical for c in ranked[:head]}
+            if lexical_top and not dense_top & lexical_top:
+                return "disagree"
+        return None
 
     def run(self, query, history=[], use_hyde=False, use_self_correction=True, stream=False):
-        # 1. Router Check
-        router_result = self.check_need_clarification(query, history)
+        result = self._run_sync(self.arun(query, history, use_hyde, use_self_correction, stream))
+        if stream and not isinstance(result["response"], str):
+            result["response"] = self._iter_sync(result["response"])
+        return result
+
+    async def arun(self, query, history=[], use_hyde=False, use_self_correction=True, stream=False):
+        # One trace per request; with stream=True it ends when the stream does
+        trace = tracing.start("run", stream=stream, use_hyde=use_hyde, self_correction=use_self_correction)
+        try:
+            result = await self._arun(query, history, use_hyde, use_self_correction, stream)
+        except BaseException as e:
+            if trace is not None:
+                trace.finish(error=e.__class__.__name__)
+            raise
+        if trace is not None:
+            trace.set(category=result["category"], context_chunks=len(result["context"]))
+            if isinstance(result["response"], str):
+                trace.finish()
+            else:
+                result["response"] = _traced_stream(result["response"], trace)
+        return result
+
+    async def _arun(self, query, history, use_hyde, use_self_correction, stream):
+        # 1. Router, with the stages that don't depend on its verdict started alongside it:
+        # the query embedding, intent classification (local, on that embedding), HyDE and
+        # retrieval itself all work on the raw query.
+        router_task = asyncio.create_task(self.acheck_need_clarification(query, history))
+        embed_task = asyncio.create_task(asyncio.to_thread(self.embed_query, query))
+        classify_task = asyncio.create_task(self._aclassify_embedded(query, embed_task))
+        hyde_task = asyncio.create_task(self.agenerate_hyde_doc(query)) if use_hyde else None
+        retrieve_task = asyncio.create_task(self._aretrieve_speculative(query, use_hyde, embed_task, classify_task, hyde_task))
+        speculative = [t for t in (retrieve_task, classify_task, hyde_task, embed_task) if t]
+
+        try:
+            router_result = await router_task
+        except BaseException:
+            for task in speculative:
+                task.cancel()
+            raise
         
         if router_result.get("needs_clarification"):
+            for task in speculative:
+                task.cancel()
             return {
                 "response": router_result["clarification_question"],
                 "category": "Уточнение",
@@ -361,50 +836,162 @@ class Agent:
         # Use the rewritten query for search
         search_query = router_result.get("rewritten_query") or query
         print(f"Processing Query: {search_query}")
-        
-        category = self.classify_intent(search_query)
+        same_query = _normalize_query(search_query) == _normalize_query(query)
+
+        # The raw-query embedding and retrieval only serve if the text to search is unchanged
+        # (the embedding still feeds the classification already in flight). A cancelled
+        # retrieval finishes its current search on the executor thread; its result is dropped.
+        if not same_query:
+            retrieve_task.cancel()
+            retrieve_task = None
+            embed_task = asyncio.create_task(asyncio.to_thread(self.embed_query, search_query))
+
+        # With no history the raw query is already self-contained, so the router's rewrite
+        # is a paraphrase and the speculative topic/HyDE still apply. With history the rewrite
+        # may pull in context ("как его продать?"), so those stages are redone on it.
+        if not same_query and history:
+            classify_task.cancel()
+            classify_task = asyncio.create_task(self._aclassify_embedded(search_query, embed_task))
+            if hyde_task:
+                hyde_task.cancel()
+                hyde_task = asyncio.create_task(self.agenerate_hyde_doc(search_query))
+
+        search_embedding = await embed_task
+        category = await classify_task
         print(f"Classified as: {category}")
-        
-        # 2. Retrieval (with optional HyDE)
-        context = self.retrieve(search_query, category, use_hyde=use_hyde)
+
+        # Semantic answer cache: same category, near-identical rewritten question
+        if self.answer_cache is not None:
+            cached = self.answer_cache.lookup(category, search_embedding)
+            tracing.annotate(answer_cache_hit=cached is not None)
+            if cached is not None:
+                print(f"Answer cache hit (similarity {cached['similarity']:.3f})")
+                for task in (hyde_task, retrieve_task):
+                    if task:
+                        task.cancel()
+                return {
+                    "response": _stream_text(cached["response"]) if stream else cached["response"],
+                    "category": category,
+                    "context": cached["context"]
+                }
+
+        # 2. Retrieval (with optional HyDE): the speculative one if the router kept the query
+        if retrieve_task:
+            context = await retrieve_task
+        else:
+            hyde_doc = await hyde_task if hyde_task else None
+            # With HyDE the hypothetical document is what gets embedded for search
+            query_embedding = None if use_hyde else search_embedding
+            context = await self.aretrieve(search_query, category, use_hyde=use_hyde, hyde_doc=hyde_doc, query_embedding=query_embedding)
         
         # 3. Generation & Self-Correction Logic
         # If Self-Correction is ON, we cannot stream the initial generation to the user,
         # because we need to validate it first.
-        if use_self_correction and context:
+        if use_self_correction and context and stream and SELF_CORRECTION_MODE == "incremental":
+            # Verify segment by segment while the answer is still being generated
+            response = self._stream_and_remember(
+                self.astream_verified(search_query, context), category, search_embedding, context
+            )
+        elif use_self_correction and context:
             print("Self-Correction Enabled: Buffering initial response...")
-            # Generate FULL response (no stream)
-            initial_response_gen = self.generate_response(search_query, context, stream=True)
-            initial_response = "".join([chunk for chunk in initial_response_gen])
+            initial_response = await self.agenerate_response(search_query, context)
             
             print("Running Self-Correction...")
-            final_response = self.self_correct(search_query, initial_response, context)
+            final_response = await self.aself_correct(search_query, initial_response, context)
+            self._remember_answer(category, search_embedding, final_response, context)
             
             # If the user wants a stream, we fake-stream the final corrected response
-            if stream:
-                def fake_stream(text):
-                    # Yield words or small chunks
-                    words = text.split(' ')
-                    for word in words:
-                        yield word + " "
-                
-                return {
-                    "response": fake_stream(final_response),
-                    "category": category,
-                    "context": context
-                }
-            else:
-                return {
-                    "response": final_response,
-                    "category": category,
-                    "context": context
-                }
+            response = _stream_text(final_response) if stream else final_response
+        elif stream:
+            # Normal streaming
+            response = self._stream_and_remember(
+                self.astream_response(search_query, context), category, search_embedding, context
+            )
         else:
-            # Normal streaming (or not)
-            response = self.generate_response(search_query, context, stream=stream)
+            response = await self.agenerate_response(search_query, context)
+            self._remember_answer(category, search_embedding, response, context)
             
-            return {
-                "response": response,
-                "category": category,
-                "context": context
-            }
+        return {
+            "response": response,
+            "category": category,
+            "context": context
+        }
+
+    def _remember_answer(self, category, query_embedding, response, context):
+        # "Nothing found" answers are not worth replaying
+        if self.answer_cache is not None and context and response:
+            self.answer_cache.store(category, query_embedding, response, context)
+
+    async def _stream_and_remember(self, agen, category, query_embedding, context):
+        parts = []
+        async for part in agen:
+            parts.append(part)
+            yield part
+        self._remember_answer(category, query_embedding, "".join(parts), context)
+
+def _count(ranked_lists):
+    return sum(len(ranked) for ranked in ranked_lists)
+
+async def _traced_stream(agen, trace):
+    # Each step of a stream may run in a different task (e.g. Agent._iter_sync), so the
+    # trace is made current again before resuming the underlying generator
+    error = None
+    try:
+        while True:
+            tracing.activate(trace)
+            try:
+                part = await agen.__anext__()
+            except StopAsyncIteration:
+                break
+            trace.mark_first_output()
+            yield part
+    except BaseException as e:
+        error = e.__class__.__name__
+        raise
+    finally:
+        await agen.aclose()
+        trace.finish(**({"error": error} if error else {}))
+
+async def _stream_text(text):
+    # Yield words or small chunks
+    words = text.split(' ')
+    for word in words:
+        yield word + " "
+
+# A line longer than this is split after its last complete sentence
+MAX_SEGMENT_CHARS = 400
+_SENTENCE_END = re.compile(r"[.!?;](?=\s)")
+
+def _split_segments(buffer):
+    """Cuts complete segments (lines, or sentences of very long lines) off the front of `buffer`."""
+    segments = []
+    while True:
+        newline = buffer.find("\n")
+        if newline != -1:
+            segments.append(buffer[:newline + 1])
+            buffer = buffer[newline + 1:]
+            continue
+        if len(buffer) > MAX_SEGMENT_CHARS:
+            ends = list(_SENTENCE_END.finditer(buffer))
+            if ends:
+                cut = ends[-1].end() + 1
+                segments.append(buffer[:cut])
+                buffer = buffer[cut:]
+        return segments, buffer
+
+# "[n] verdict" blocks of a batched audit, each running until the next one
+_VERDICT = re.compile(r"^\[(\d+)\][ \t]*(.*?)(?=^\[\d+\]|\Z)", re.M | re.S)
+
+def _needs_verification(segment):
+    # Blank lines, headings and short bold titles carry no checkable facts
+    text = segment.strip()
+    if len(text) < 25:
+        return False
+    if text.startswith("#"):
+        return False
+    if text.startswith("**") and text.endswith("**") and len(text) < 120:
+        return False
+    return True
+
+def _normalize_query(text):
+    return " ".join(re.findall(r"\w+", text.lower()))
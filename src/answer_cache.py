@@ -0,0 +1,105 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.config import INGEST_MANIFEST_PATH
+
+class IndexVersion:
+    """Reads the corpus version that ingestion bumps in the manifest; re-parses only when the file changes."""
+    def __init__(self, manifest_path=INGEST_MANIFEST_PATH):
+        self.manifest_path = manifest_path
+        self._mtime = None
+        self._version = 0
+
+    def get(self):
+        try:
+            mtime = os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+        if mtime != self._mtime:
+            try:
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    self._version = json.load(f).get("index_version", 0)
+                self._mtime = mtime
+            except (OSError, ValueError):
+                pass # Being rewritten; keep the last known version
+        return self._version
+
+class SemanticAnswerCache:
+    """
+    In-process cache of final answers, matched by cosine similarity of the (rewritten) query
+    embedding within the same category. Entries expire after `ttl_seconds`, the least recently
+    used ones are evicted past `max_entries`, and everything is dropped when the index version
+    changes (i.e. ingestion touched the corpus).
+    """
+    def __init__(self, threshold=0.95, max_entries=1000, ttl_seconds=86400, manifest_path=INGEST_MANIFEST_PATH):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.index_version = IndexVersion(manifest_path)
+        self.entries = OrderedDict() # key -> entry dict
+        self.version = None
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_version(self):
+        version = self.index_version.get()
+        if version != self.version:
+            if self.entries:
+                print(f"Answer cache: index version {self.version} -> {version}, dropping {len(self.entries)} entries")
+            self.entries.clear()
+            self.version = version
+
+    def lookup(self, category, query_embedding):
+        """Returns the best cached {"response", "context", "category", "similarity"} or None."""
+        vec = np.asarray(query_embedding, dtype=np.float32)
+        vec /= np.linalg.norm(vec) or 1.0
+        now = time.time()
+        with self.lock:
+            self._check_version()
+            expired = [k for k, e in self.entries.items() if now - e["created"] > self.ttl_seconds]
+            for k in expired:
+                del self.entries[k]
+
+            keys = [k for k, e in self.entries.items() if e["category"] == category and e["vector"].shape == vec.shape]
+            if not keys:
+                self.misses += 1
+                return None
+            sims = np.stack([self.entries[k]["vector"] for k in keys]) @ vec
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(keys[best])
+            entry = self.entries[keys[best]]
+            return {
+                "response": entry["response"],
+                "context": entry["context"],
+                "category": entry["category"],
+                "similarity": float(sims[best]),
+            }
+
+    def store(self, category, query_embedding, response, context):
+        vec = np.asarray(query_embedding, dtype=np.float32)
+        vec = vec / (np.linalg.norm(vec) or 1.0)
+        with self.lock:
+            self._check_version()
+            self.entries[self.next_key] = {
+                "category": category,
+                "vector": vec,
+                "response": response,
+                "context": context,
+                "created": time.time(),
+            }
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -0,0 +1,186 @@
+"""
+Deduplication benchmark: what storing chunks by content saves on a corpus with copies.
+
+The shipped corpus has almost no duplicate files, so a copy of it is made with the kinds of
+duplicates real folders collect (DUPLICATES): the same law filed under other categories, a
+re-download whose text differs only in whitespace, and a later edition whose dates were
+re-stamped. That corpus is indexed three times with the hashing embeddings: with per-file
+chunk ids (dedupe=False, as before), content-addressed, and content-addressed with dates
+masked (DEDUPE_MASK_DATES). For each it reports:
+
+    stored      rows in the collections (= vectors embedded and kept)
+    tokens      estimated embedding tokens, i.e. API spend
+    index MiB   the index directory on disk (vectors, documents, BM25, manifest)
+    dup@N       passages per question that repeat an earlier one in the top N
+                (same normalized text, or within NEAR_DISTANCE SimHash bits)
+
+plus source recall and latency over the eval datasets, so the savings can be checked not to
+cost recall. Fusion merges candidates by id, so with per-file ids every copy is a separate
+candidate (the earlier merge by exact text would have caught the plain copies, not the others).
+
+    python -m src.bench_dedupe
+    python -m src.bench_dedupe --backend chroma --output dedupe.json
+"""
+import os
+import re
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import statistics
+import tempfile
+from src import tracing
+from src.agent import Agent
+from src.bench_retrieval import build_index, load_dataset, query_category, first_relevant, retrieval_metrics
+from src.dedupe import NearDuplicateIndex, content_id, simhash
+from src.embeddings import HashingEmbeddingFunction
+from src.ingestion import IngestManifest, DOCX_CHUNK_SIZE
+from src.reranker import get_reranker
+from src.stats import latency_summary
+from src.tokens import estimate_tokens
+from src.config import VECTOR_BACKEND, RERANKER, RERANKER_MODEL, RERANK_SHORTLIST, RETRIEVAL_TOP_N
+
+# (source, copy, kind) relative to the corpus root
+DUPLICATES = (
+    ("data_npa/Общий/z1100000413.25-08-2025.rus (1).docx", "data_npa/Аренда/z1100000413.25-08-2025.rus.docx", "copy"),
+    ("data_npa/Общий/z1100000413.25-08-2025.rus (1).docx", "data_npa/Приватизация/z1100000413.25-08-2025.rus.docx", "whitespace"),
+    ("data_npa/Аренда/v1500010467.02-10-2025.rus.docx", "data_npa/Передача/v1500010467.14-11-2025.rus.docx", "edition"),
+    ("data_instructions/Аренда/JALGA - аренда.pdf", "data_instructions/Общий/JALGA - аренда (1).pdf", "copy"),
+)
+
+DATE_RE = re.compile(rb"(\d{2}\.\d{2}\.)(\d{4})")
+
+# SimHash bits within which two retrieved passages count as the same for dup@N
+NEAR_DISTANCE = 3
+
+# (ids, dedupe, mask_dates) per run
+RUNS = (("per-file", False, False), ("content", True, False), ("+dates", True, True))
+
+def _rewrite_docx(source, target, rewrite):
+    """Copies a .docx, passing word/document.xml through `rewrite(bytes) -> bytes`."""
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            data = src.read(item.filename)
+            dst.writestr(item, rewrite(data) if item.filename == "word/document.xml" else data)
+
+def make_corpus(root):
+    """The corpus plus DUPLICATES under `root`; returns the NPA and instruction directories."""
+    for directory in ("data_npa", "data_instructions"):
+        shutil.copytree(directory, os.path.join(root, directory))
+    for source, copy, kind in DUPLICATES:
+        target = os.path.join(root, copy)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if kind == "copy":
+            shutil.copyfile(source, target)
+        elif kind == "whitespace":
+            # Sentence breaks doubled inside the text runs, as some converters do
+            _rewrite_docx(source, target, lambda xml: xml.replace(b". ", b".  "))
+        else:
+            # Every dd.mm.yyyy date a year later: the edition stamp of a re-published copy
+            _rewrite_docx(source, target, lambda xml: DATE_RE.sub(lambda m: m.group(1) + str(int(m.group(2)) + 1).encode(), xml))
+    return os.path.join(root, "data_npa"), os.path.join(root, "data_instructions")
+
+class CountingEmbeddingFunction(HashingEmbeddingFunction):
+    """Hashing embeddings that tally what would have been sent to the API."""
+    def __init__(self):
+        super().__init__()
+        self.texts = 0
+        self.tokens = 0
+
+    def __call__(self, input):
+        self.texts += len(input)
+        self.tokens += sum(estimate_tokens(t) for t in input)
+        return super().__call__(input)
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+def duplicates(ranked):
+    """Passages in `ranked` that repeat an earlier one, exactly (normalized) or as a near-duplicate."""
+    seen = set()
+    near = NearDuplicateIndex(NEAR_DISTANCE)
+    repeats = 0
+    for c in ranked:
+        chunk_id, fingerprint = content_id(c["content"]), simhash(c["content"])
+        if chunk_id in seen or near.find(fingerprint) is not None:
+            repeats += 1
+        seen.add(chunk_id)
+        near.add(chunk_id, fingerprint)
+    return repeats
+
+def run_questions(agent, items, top_n):
+    agent.retrieve(items[0]["question"], "Общий", top_n=top_n) # Warm-up
+    ranks, latencies, repeats, candidates = [], [], [], []
+    for item in items:
+        category = query_category(agent, item, "dataset")
+        trace = tracing.Trace("bench")
+        tracing.activate(trace)
+        start = time.perf_counter()
+        try:
+            ranked = agent.retrieve(item["question"], category, top_n=top_n)
+        finally:
+            latencies.append((time.perf_counter() - start) * 1000)
+            tracing.activate(None)
+        ranks.append(first_relevant(ranked, item, threshold=0.5).get("source"))
+        repeats.append(duplicates(ranked))
+        candidates.append(next(attrs for name, _, _, attrs in trace.spans if name == "retrieve.plan")["candidates"])
+    return {
+        "source": retrieval_metrics(ranks, (1, 5)),
+        "latency_ms": latency_summary(latencies),
+        "candidates": statistics.mean(candidates),
+        "duplicates": statistics.mean(repeats),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Index size, embedding spend and duplicate results with and without chunk deduplication")
+    parser.add_argument("--backend", default=VECTOR_BACKEND, choices=["chroma", "numpy"])
+    parser.add_argument("--chunk-size", type=int, default=DOCX_CHUNK_SIZE)
+    parser.add_argument("--datasets", default="eval_dataset.json,eval_dataset_converted.json", help="Comma-separated eval dataset paths")
+    parser.add_argument("--top-n", type=int, default=RETRIEVAL_TOP_N, help="Passages retrieved per question")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    items = [item for path in args.datasets.split(",") if path.strip() for item in load_dataset(path) if item["source"]]
+    reranker = get_reranker(RERANKER, RERANKER_MODEL, shortlist=RERANK_SHORTLIST, budget_ms=float("inf"))
+    root = tempfile.mkdtemp(prefix="bench_dedupe_")
+    rows = []
+    try:
+        data_dirs = make_corpus(os.path.join(root, "corpus"))
+        files = sum(1 for d in data_dirs for _, _, names in os.walk(d) for n in names if n.endswith((".docx", ".pdf")))
+        print(f"Corpus: {files} files, {len(DUPLICATES)} of them duplicates ({', '.join(kind for _, _, kind in DUPLICATES)})")
+        for name, dedupe, mask_dates in RUNS:
+            index_dir = os.path.join(root, name.strip("+").replace("-", "_"))
+            embedding_fn = CountingEmbeddingFunction()
+            db, intent_classifier, lexical_index, build = build_index(
+                index_dir, embedding_fn, args.chunk_size, backend=args.backend, data_dirs=data_dirs, dedupe=dedupe, mask_dates=mask_dates
+            )
+            manifest = IngestManifest(os.path.join(index_dir, "ingest_manifest.json"))
+            agent = Agent(db=db, intent_classifier=intent_classifier, lexical_index=lexical_index, reranker=reranker)
+            rows.append({
+                "ids": name,
+                "chunks": sum(len(e["chunk_ids"]) for c in manifest.data["collections"].values() for e in c.values()),
+                "stored": build["chunks"],
+                "embedded": embedding_fn.texts,
+                "tokens": embedding_fn.tokens,
+                "index_mib": directory_bytes(index_dir) / 2**20,
+                "ingest_s": build["ingest_s"],
+                **run_questions(agent, items, args.top_n),
+            })
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    print(f"\n{'ids':<9} {'chunks':>6} {'stored':>6} {'embedded':>8} {'tokens':>8} {'index MiB':>9} {'ingest s':>8} "
+          f"{'R@1':>6} {'R@5':>6} {'MRR':>6} {'p50 ms':>7} {'cands':>6} {f'dup@{args.top_n}':>6}")
+    for r in rows:
+        m = r["source"]
+        print(f"{r['ids']:<9} {r['chunks']:>6} {r['stored']:>6} {r['embedded']:>8} {r['tokens']:>8} {r['index_mib']:>9.2f} {r['ingest_s']:>8.1f} "
+              f"{m['recall@1']:>6.3f} {m['recall@5']:>6.3f} {m['mrr']:>6.3f} {r['latency_ms']['p50']:>7.1f} {r['candidates']:>6.0f} {r['duplicates']:>6.2f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"backend": args.backend, "duplicates": DUPLICATES, "runs": rows}, f, ensure_ascii=False, indent=1)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Chunking benchmark: how many chunks each parser produces from the corpus and what they
+cost to embed, without touching the index or the API.
+
+For every .docx/.pdf under data_npa/ and data_instructions/ it reports chunk count, size
+distribution, estimated embedding tokens and requests (packed as EmbeddingFunction packs
+them) and parse time. PDFs are also cut with the previous page/blank-line splitter, so the
+effect of the structure-aware chunker stays measurable.
+
+DOCX files are then read with each DOCX reader (python-docx and the lxml stream parser):
+parse time per file, whether the chunks are identical, and the peak RSS of a fresh process
+parsing them all.
+
+    python -m src.bench_parsing
+    python -m src.bench_parsing --chunk-size 1000,2000 --output parsing.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import fitz
+from src.embeddings import pack_batches
+from src.ingestion import parse_file, clean_text, DOCX_CHUNK_SIZE, DOCX_PARSERS
+from src.tokens import estimate_tokens
+
+DEFAULT_DIRS = "data_npa,data_instructions"
+
+# Chunks shorter than this carry too little text to be worth an embedding of their own
+SMALL_CHUNK_CHARS = 300
+
+def legacy_pdf_chunks(filepath):
+    """The pre-HierarchyChunker PdfParser: each page split on blank lines, fragments over 20 characters kept."""
+    chunks = []
+    with fitz.open(filepath) as doc:
+        for page_num, page in enumerate(doc):
+            for p in page.get_text().split("\n\n"):
+                p = clean_text(p)
+                if len(p) > 20:
+                    chunks.append({"text": p, "metadata": {"source": os.path.basename(filepath), "page": page_num + 1}})
+    return chunks
+
+def find_files(directories):
+    files = []
+    for directory in directories:
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith((".docx", ".pdf")))
+    return files
+
+def measure(files, chunker):
+    """Chunk statistics over `files` for one chunker(filepath) -> chunks."""
+    texts = []
+    seconds = 0.0
+    for filepath in files:
+        start = time.perf_counter()
+        chunks = chunker(filepath)
+        seconds += time.perf_counter() - start
+        texts.extend(c["text"] for c in chunks)
+    sizes = sorted(len(t) for t in texts)
+    return {
+        "files": len(files),
+        "chunks": len(texts),
+        "chars": sum(sizes),
+        "tokens": sum(estimate_tokens(t) for t in texts),
+        "requests": len(pack_batches(texts)) if texts else 0,
+        "p50_chars": statistics.median(sizes) if sizes else 0,
+        "small_chunks": sum(1 for n in sizes if n < SMALL_CHUNK_CHARS),
+        "parse_s": seconds,
+    }
+
+# Peak RSS growth of a fresh interpreter parsing argv[3:] with DOCX reader argv[1] (libxml2
+# allocations don't show in tracemalloc, so this is measured from outside)
+RSS_PROBE = """
+import sys, json, resource
+from src.ingestion import parse_file
+parse_file(sys.argv[3], chunk_size=int(sys.argv[2]), docx_parser=sys.argv[1])  # imports and caches warmed
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+for path in sys.argv[3:]:
+    parse_file(path, chunk_size=int(sys.argv[2]), docx_parser=sys.argv[1])
+print(json.dumps({"peak_mib": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024}))
+"""
+
+def peak_rss_mib(docx_parser, files, chunk_size):
+    out = subprocess.run([sys.executable, "-c", RSS_PROBE, docx_parser, str(chunk_size), *files], capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"Probe failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])["peak_mib"]
+
+def compare_docx_parsers(files, chunk_size):
+    """Per-file parse time of every DOCX reader, and whether their chunks match python-docx's."""
+    per_file = []
+    for filepath in files:
+        row = {"file": filepath, "mib": os.path.getsize(filepath) / 2**20, "seconds": {}}
+        chunks = {}
+        for name in DOCX_PARSERS:
+            start = time.perf_counter()
+            chunks[name] = parse_file(filepath, chunk_size=chunk_size, docx_parser=name)
+            row["seconds"][name] = time.perf_counter() - start
+        row["identical"] = all(c == chunks["python-docx"] for c in chunks.values())
+        per_file.append(row)
+    peak = {name: peak_rss_mib(name, files, chunk_size) for name in DOCX_PARSERS}
+    return {"chunk_size": chunk_size, "files": per_file, "peak_rss_mib": peak}
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk counts and embedding cost per parser")
+    parser.add_argument("--dirs", default=DEFAULT_DIRS, help="Comma-separated corpus directories")
+    parser.add_argument("--chunk-size", default=str(DOCX_CHUNK_SIZE), help="Comma-separated chunk sizes")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    files = find_files([d for d in args.dirs.split(",") if d.strip()])
+    by_type = {ext: [f for f in files if f.endswith(ext)] for ext in (".pdf", ".docx")}
+
+    rows = []
+    if by_type[".pdf"]:
+        rows.append(("pdf", "legacy", measure(by_type[".pdf"], legacy_pdf_chunks)))
+    for chunk_size in [int(v) for v in args.chunk_size.split(",") if v.strip()]:
+        for kind, paths in (("pdf", by_type[".pdf"]), ("docx", by_type[".docx"])):
+            if paths:
+                rows.append((kind, f"c{chunk_size}", measure(paths, lambda f: parse_file(f, chunk_size=chunk_size))))
+
+    print(f"{'type':<5} {'chunker':<8} {'files':>5} {'chunks':>6} {'p50 chars':>9} {f'<{SMALL_CHUNK_CHARS}':>5} {'tokens':>8} {'requests':>8} {'parse s':>8}")
+    for kind, name, r in rows:
+        print(f"{kind:<5} {name:<8} {r['files']:>5} {r['chunks']:>6} {r['p50_chars']:>9.0f} {r['small_chunks']:>5} "
+              f"{r['tokens']:>8} {r['requests']:>8} {r['parse_s']:>8.2f}")
+
+    docx = None
+    if by_type[".docx"]:
+        chunk_size = int(args.chunk_size.split(",")[0])
+        docx = compare_docx_parsers(by_type[".docx"], chunk_size)
+        names = list(DOCX_PARSERS)
+        print(f"\nDOCX readers, c{chunk_size} (seconds per file)")
+        print(f"{'file':<40} {'MiB':>5} " + " ".join(f"{n:>11}" for n in names) + f" {'speedup':>7} identical")
+        for row in docx["files"]:
+            seconds = row["seconds"]
+            print(f"{os.path.basename(row['file'])[:40]:<40} {row['mib']:>5.2f} " + " ".join(f"{seconds[n]:>11.3f}" for n in names) +
+                  f" {seconds['python-docx'] / max(seconds['stream'], 1e-9):>6.1f}x {'yes' if row['identical'] else 'NO'}")
+        totals = {n: sum(row["seconds"][n] for row in docx["files"]) for n in names}
+        print(f"{'total':<40} {sum(row['mib'] for row in docx['files']):>5.2f} " + " ".join(f"{totals[n]:>11.3f}" for n in names) +
+              f" {totals['python-docx'] / max(totals['stream'], 1e-9):>6.1f}x")
+        print(f"{'peak RSS growth, MiB':<46} " + " ".join(f"{docx['peak_rss_mib'][n]:>11.1f}" for n in names))
+        if not all(row["identical"] for row in docx["files"]):
+            print("Warning: the DOCX readers disagree on some files")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunking": [{"type": kind, "chunker": name, **r} for kind, name, r in rows], "docx_readers": docx},
+                      f, ensure_ascii=False, indent=1)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
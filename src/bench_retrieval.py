@@ -0,0 +1,391 @@
+"""
+Retrieval-only benchmark: recall@k and MRR over the eval datasets, without the LLM.
+
+Each configuration gets a throwaway index built from data_npa/ and data_instructions/
+(timed), then every question is retrieved once at the deepest k and all the recall@k
+values are read off that single ranked list. Embeddings default to the deterministic
+hashing stand-in, so runs are offline, need no API key and are comparable between machines.
+
+    python -m src.bench_retrieval
+    python -m src.bench_retrieval --initial-k 20,50,100 --chunk-size 1000,2000 --modes hybrid,dense
+    python -m src.bench_retrieval --embeddings openai --output bench.json
+    python -m src.bench_retrieval --backend numpy --storage none,float16,int8,int8:256 --rescore 4,0
+
+A passage counts as relevant at two levels:
+    source  it comes from the item's source file (what evaluate.py calls a retrieval hit)
+    chunk   it overlaps the item's source_chunk (word 3-gram overlap >= --match-threshold);
+            only eval_dataset.json has source chunks
+"""
+import io
+import os
+import re
+import json
+import time
+import sys
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+import contextlib
+from src import tracing
+from src.agent import Agent, CATEGORIES
+from src.database import VectorDB
+from src.embeddings import make_embedding_function
+from src.ingestion import (
+    IngestManifest,
+    process_directory,
+    DATABASE_NPA_COLLECTION,
+    DATABASE_INSTRUCTIONS_COLLECTION,
+    DOCX_CHUNK_SIZE,
+)
+from src.intent_classifier import build_intent_classifier
+from src.lexical_index import build_lexical_index
+from src.reranker import get_reranker
+from src.stats import latency_summary
+from src.config import (
+    INGEST_WORKERS,
+    RERANKER,
+    RERANKER_MODEL,
+    RERANK_SHORTLIST,
+    RETRIEVAL_INITIAL_K,
+    RETRIEVAL_TOP_N,
+    RETRIEVAL_PLANNER,
+    VECTOR_BACKEND,
+    VECTOR_RESCORE_FACTOR,
+)
+from src.vector_store import QUANTIZATIONS
+
+DEFAULT_DATASETS = "eval_dataset.json,eval_dataset_converted.json"
+DEFAULT_KS = ",".join(str(k) for k in (1, 3, 5, 10, 15, 20, 30, 50) if k <= RETRIEVAL_TOP_N)
+
+# Run in a fresh interpreter: open the index and answer one filtered and one global query
+STARTUP_PROBE = """
+import sys, time
+from src.database import VectorDB
+from src.embeddings import HashingEmbeddingFunction
+path, backend, dims = sys.argv[1], sys.argv[2], int(sys.argv[3])
+embedding_fn = HashingEmbeddingFunction(dims)
+vector = embedding_fn(["probe"])[0]
+start = time.perf_counter()
+db = VectorDB(path=path, embedding_fn=embedding_fn, backend=backend)
+collection = db.get_or_create_collection("npa_collection")
+collection.query(query_embeddings=[vector], n_results=20, where={"categories": {"$contains": "Аренда"}})
+collection.query(query_embeddings=[vector], n_results=20)
+print(time.perf_counter() - start)
+"""
+
+def _ints(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+def _names(value, allowed, parser, what):
+    names = [v.strip() for v in value.split(",") if v.strip()]
+    for name in names:
+        if name not in allowed:
+            parser.error(f"Unknown {what}: {name}")
+    return names
+
+def storage_variants(storage, rescore, parser):
+    """(quantization, search dimensions, rescore factor) per --storage entry ("int8", "int8:256") and --rescore factor."""
+    variants = []
+    for spec in storage.split(","):
+        if not spec.strip():
+            continue
+        quantization, _, dims = spec.strip().partition(":")
+        if quantization not in QUANTIZATIONS:
+            parser.error(f"Unknown storage: {spec}")
+        for factor in _ints(rescore):
+            # Plain float32 at full dimension has nothing to re-score
+            variant = (quantization, int(dims or 0), factor if quantization != "none" or dims else 0)
+            if variant not in variants:
+                variants.append(variant)
+    return variants
+
+def variant_label(variant):
+    quantization, dims, factor = variant
+    label = quantization if not dims else f"{quantization}:{dims}"
+    return label if quantization == "none" and not dims else f"{label} r{factor}"
+
+def apply_storage(index_dir, collections, variant):
+    """Re-encodes the numpy collections from the float32 copy kept in vectors.float32; returns summed storage stats."""
+    vectors_dir = os.path.join(index_dir, "vectors")
+    baseline = os.path.join(index_dir, "vectors.float32")
+    if not os.path.exists(baseline):
+        shutil.copytree(vectors_dir, baseline)
+    else:
+        # rescore 0 drops the float32 matrix, so every variant starts again from the baseline
+        shutil.rmtree(vectors_dir)
+        shutil.copytree(baseline, vectors_dir)
+    stats = {"search_bytes": 0, "rescore_bytes": 0, "float32_bytes": 0}
+    for collection in collections:
+        collection.quantization, collection.search_dimensions, collection.rescore_factor = variant
+        collection.reencode()
+        for key in stats:
+            stats[key] += collection.storage_stats()[key]
+    return stats
+
+def _words(text):
+    # Chunks start with an injected "Контекст: ..." line that the dataset's source_chunk doesn't have
+    if text.startswith("Контекст:"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    return re.findall(r"\w+", text.lower())
+
+def shingles(text, n=3):
+    words = _words(text)
+    if len(words) < n:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def source_key(name):
+    # "z1100000413.25-08-2025.rus (1).docx" and "z1100000413.25-08-2025.rus.docx" are the same act
+    return re.sub(r"\s*\(\d+\)(?=\.\w+$)", "", name or "").strip().lower()
+
+def load_dataset(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    items = []
+    for item in data:
+        meta = item.get("source_metadata") or {}
+        items.append({
+            "question": item["question"],
+            "category": meta.get("category"),
+            "source": source_key(meta.get("source")) or None,
+            "chunk_shingles": shingles(item["source_chunk"]) if item.get("source_chunk") else None,
+        })
+    return items
+
+def first_relevant(ranked, item, threshold):
+    """1-based rank of the first relevant passage per judgeable level (None when it wasn't retrieved)."""
+    ranks = {}
+    if item["source"]:
+        ranks["source"] = None
+    if item["chunk_shingles"]:
+        ranks["chunk"] = None
+    for rank, c in enumerate(ranked, 1):
+        if "source" in ranks and ranks["source"] is None:
+            # A chunk shared by several files counts for each of them
+            if item["source"] in {source_key(s) for s in c["metadata"].get("sources") or [c["metadata"].get("source")]}:
+                ranks["source"] = rank
+        if "chunk" in ranks and ranks["chunk"] is None:
+            passage = shingles(c["content"])
+            overlap = len(passage & item["chunk_shingles"])
+            # Normalized by the smaller side, so both finer and coarser chunkings can match
+            if passage and overlap / min(len(passage), len(item["chunk_shingles"])) >= threshold:
+                ranks["chunk"] = rank
+    return ranks
+
+def retrieval_metrics(ranks, ks):
+    """recall@k for every k and MRR from the first-relevant ranks of the judgeable items."""
+    n = len(ranks)
+    if not n:
+        return None
+    return {
+        "queries": n,
+        **{f"recall@{k}": sum(1 for r in ranks if r is not None and r <= k) / n for k in ks},
+        "mrr": sum(1.0 / r for r in ranks if r is not None) / n,
+    }
+
+def build_index(index_dir, embedding_fn, chunk_size, workers=INGEST_WORKERS, verbose=False, backend=VECTOR_BACKEND,
+                data_dirs=("data_npa", "data_instructions"), dedupe=True, mask_dates=False):
+    """Ingests the corpus (NPA and instruction directories) into `index_dir`; returns (db, intent_classifier, lexical_index, build stats)."""
+    db = VectorDB(path=index_dir, embedding_fn=embedding_fn, backend=backend)
+    npa_collection = db.get_or_create_collection(DATABASE_NPA_COLLECTION)
+    instructions_collection = db.get_or_create_collection(DATABASE_INSTRUCTIONS_COLLECTION)
+    collections = [npa_collection, instructions_collection]
+    manifest = IngestManifest(os.path.join(index_dir, "ingest_manifest.json"))
+
+    timings = {}
+    log = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with log:
+        start = time.perf_counter()
+        process_directory(data_dirs[0], npa_collection, is_npa=True, manifest=manifest, workers=workers, chunk_size=chunk_size,
+                          embedding_fn=embedding_fn, dedupe=dedupe, mask_dates=mask_dates)
+        process_directory(data_dirs[1], instructions_collection, is_npa=False, manifest=manifest, workers=workers, chunk_size=chunk_size,
+                          embedding_fn=embedding_fn, dedupe=dedupe, mask_dates=mask_dates)
+        timings["ingest_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        intent_classifier = build_intent_classifier(collections, path=os.path.join(index_dir, "intent_centroids.npz"), embedding_fn=embedding_fn)
+        timings["intent_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lexical_index = build_lexical_index(collections, path=os.path.join(index_dir, "lexical_index"))
+        timings["lexical_s"] = time.perf_counter() - start
+
+    timings["total_s"] = sum(timings.values())
+    timings["chunks"] = sum(c.count() for c in collections)
+    return db, intent_classifier, lexical_index, timings
+
+def measure_startup(index_dir, backend, dims, runs=3):
+    """Median seconds from a cold process to the first answered queries (interpreter start and shared imports excluded)."""
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, index_dir, backend, str(dims)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(out.strip().splitlines()[-1]))
+    return statistics.median(timings)
+
+def query_category(agent, item, category_mode):
+    if category_mode == "global":
+        return "Общий"
+    if category_mode == "dataset" and item["category"]:
+        return item["category"] if item["category"] in CATEGORIES else "Общий"
+    # No label (or --category classifier): local centroids only, never the LLM
+    if agent.intent_classifier is None:
+        return "Общий"
+    category, _ = agent.intent_classifier.predict(agent.embed_query(item["question"]), allowed=CATEGORIES)
+    return category or "Общий"
+
+def run_queries(agent, items, initial_k, depth, threshold, category_mode, planner):
+    """One retrieval per question at `depth`; returns per-item ranks, latency (ms) and the planner's path."""
+    # Warm-up: first queries pay for lazy loads (HNSW segments, thread pool)
+    agent.retrieve(items[0]["question"], "Общий", initial_k=initial_k, top_n=depth, planner=planner)
+    results = []
+    for item in items:
+        category = query_category(agent, item, category_mode)
+        # An in-memory trace (never finished, so never written) to read the planner's decision back
+        trace = tracing.Trace("bench")
+        tracing.activate(trace)
+        start = time.perf_counter()
+        try:
+            ranked = agent.retrieve(item["question"], category, initial_k=initial_k, top_n=depth, planner=planner)
+        finally:
+            latency_ms = (time.perf_counter() - start) * 1000
+            tracing.activate(None)
+        plan = next(attrs for name, _, _, attrs in trace.spans if name == "retrieve.plan")
+        results.append({
+            **first_relevant(ranked, item, threshold),
+            "latency_ms": latency_ms,
+            "path": plan["path"],
+            "candidates": plan["candidates"],
+        })
+    return results
+
+def summarize_run(results, ks):
+    summary = {level: retrieval_metrics([r[level] for r in results if level in r], ks) for level in ("source", "chunk")}
+    summary["latency_ms"] = latency_summary([r["latency_ms"] for r in results])
+    summary["candidates"] = sum(r["candidates"] for r in results) / len(results)
+    paths = [r["path"] for r in results]
+    summary["paths"] = {path: paths.count(path) / len(paths) for path in sorted(set(paths))}
+    return summary
+
+def print_table(rows, ks):
+    width = max(len(row["config"]) for row in rows)
+    header = f"{'config':<{width}} {'level':<6} {'n':>3} " + " ".join(f"{'R@' + str(k):>6}" for k in ks) + f" {'MRR':>6} {'p50 ms':>7} {'p95 ms':>7} {'cands':>6} {'scan MiB':>8}  paths"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        for level in ("source", "chunk"):
+            m = row[level]
+            if m is None:
+                continue
+            paths = " ".join(f"{path} {share:.0%}" for path, share in row["paths"].items())
+            recalls = " ".join(f"{m[f'recall@{k}']:>6.3f}" for k in ks)
+            lat = row["latency_ms"]
+            scan = f"{row['search_bytes'] / 2**20:>8.2f}" if row.get("search_bytes") is not None else f"{'-':>8}"
+            print(f"{row['config']:<{width}} {level:<6} {m['queries']:>3} {recalls} {m['mrr']:>6.3f} {lat['p50']:>7.1f} {lat['p95']:>7.1f} {row['candidates']:>6.0f} {scan}  {paths}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark (recall@k, MRR, latency, build time)")
+    parser.add_argument("--datasets", default=DEFAULT_DATASETS, help="Comma-separated eval dataset paths")
+    parser.add_argument("--embeddings", default="hashing", choices=["hashing", "openai"], help="hashing = deterministic, offline")
+    parser.add_argument("--backend", default=VECTOR_BACKEND, help="Comma-separated vector backends: chroma, numpy")
+    parser.add_argument("--storage", default="none",
+                        help="numpy only, comma-separated first-pass storage: none, float16, int8, optionally :dims (e.g. int8:256)")
+    parser.add_argument("--rescore", default=str(VECTOR_RESCORE_FACTOR),
+                        help="numpy only, comma-separated rescore factors for the quantized/truncated variants (0 = no float32 copy)")
+    parser.add_argument("--chunk-size", default=str(DOCX_CHUNK_SIZE), help="Comma-separated DOCX chunk sizes; one index is built per size")
+    parser.add_argument("--initial-k", default=str(RETRIEVAL_INITIAL_K), help="Comma-separated candidate depths per dense/lexical query")
+    parser.add_argument("--modes", default="hybrid", help="Comma-separated: hybrid (dense + BM25), dense")
+    parser.add_argument("--planner", default=RETRIEVAL_PLANNER, help="Comma-separated retrieval planners: adaptive, fixed")
+    parser.add_argument("--reranker", default=RERANKER, choices=["lexical", "cross-encoder", "none"])
+    parser.add_argument("--rerank-budget-ms", type=float, default=float("inf"),
+                        help="Re-ranking time budget (default unlimited, so results don't depend on machine speed)")
+    parser.add_argument("--k", default=DEFAULT_KS, help="Comma-separated k values for recall@k")
+    parser.add_argument("--category", default="dataset", choices=["dataset", "classifier", "global"],
+                        help="Category filter: the dataset label, the local intent classifier, or none")
+    parser.add_argument("--match-threshold", type=float, default=0.5, help="Word 3-gram overlap for a chunk-level match")
+    parser.add_argument("--index-dir", default=None, help="Keep the built indexes here (default: a temp dir, removed afterwards)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Parser processes for the index build")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show ingestion output")
+    args = parser.parse_args()
+
+    ks = sorted(set(_ints(args.k)))
+    depth = ks[-1]
+    backends = _names(args.backend, ("chroma", "numpy"), parser, "backend")
+    modes = _names(args.modes, ("hybrid", "dense"), parser, "mode")
+    planners = _names(args.planner, ("adaptive", "fixed"), parser, "planner")
+    variants = storage_variants(args.storage, args.rescore, parser)
+    if any(variant != ("none", 0, 0) for variant in variants) and backends != ["numpy"]:
+        parser.error("--storage variants other than none need --backend numpy")
+    datasets = {path: load_dataset(path) for path in args.datasets.split(",") if path.strip()}
+    for path, items in datasets.items():
+        print(f"{path}: {len(items)} questions ({sum(1 for i in items if i['chunk_shingles'])} with source chunks)")
+
+    embedding_fn = make_embedding_function(args.embeddings)
+    reranker = get_reranker(args.reranker, RERANKER_MODEL, shortlist=RERANK_SHORTLIST, budget_ms=args.rerank_budget_ms)
+    root = args.index_dir or tempfile.mkdtemp(prefix="bench_retrieval_")
+    report = {"embeddings": embedding_fn.name(), "reranker": args.reranker, "ks": ks, "builds": [], "runs": []}
+    rows = []
+    try:
+        for backend in backends:
+            for chunk_size in _ints(args.chunk_size):
+                index_dir = os.path.join(root, f"{backend}_chunk{chunk_size}")
+                shutil.rmtree(index_dir, ignore_errors=True)
+                print(f"\nBuilding {backend} index (chunk size {chunk_size}, {embedding_fn.name()})...")
+                db, intent_classifier, lexical_index, build = build_index(
+                    index_dir, embedding_fn, chunk_size, args.workers, args.verbose, backend=backend
+                )
+                dims = len(embedding_fn.embed_query(["probe"])[0])
+                build["startup_s"] = measure_startup(index_dir, backend, dims)
+                print(f"  {build['chunks']} chunks in {build['total_s']:.1f}s "
+                      f"(ingest {build['ingest_s']:.1f}s, centroids {build['intent_s']:.2f}s, BM25 {build['lexical_s']:.2f}s); "
+                      f"cold open + first queries {build['startup_s'] * 1000:.0f} ms")
+                report["builds"].append({"backend": backend, "chunk_size": chunk_size, **build})
+
+                agent = Agent(db=db, intent_classifier=intent_classifier, lexical_index=lexical_index, reranker=reranker)
+                # None means "load the default" to the constructor; here it means "none"
+                agent.intent_classifier = intent_classifier
+                agent.reranker = reranker
+                collections = [db.get_or_create_collection(DATABASE_NPA_COLLECTION), db.get_or_create_collection(DATABASE_INSTRUCTIONS_COLLECTION)]
+                for variant in variants:
+                    storage = {}
+                    if backend == "numpy":
+                        storage = apply_storage(index_dir, collections, variant)
+                        print(f"  {variant_label(variant)}: first pass {storage['search_bytes'] / 2**20:.2f} MiB "
+                              f"({storage['search_bytes'] / storage['float32_bytes']:.0%} of float32), "
+                              f"rescoring {storage['rescore_bytes'] / 2**20:.2f} MiB")
+                    label = f"{backend} {variant_label(variant)}" if backend == "numpy" and len(variants) > 1 else backend
+                    for mode in modes:
+                        agent.lexical_index = lexical_index if mode == "hybrid" else None
+                        for initial_k in _ints(args.initial_k):
+                            for planner in planners:
+                                for path, items in datasets.items():
+                                    results = run_queries(agent, items, initial_k, depth, args.match_threshold, args.category, planner)
+                                    summary = summarize_run(results, ks)
+                                    config = {
+                                        "backend": backend, "storage": variant_label(variant), "chunk_size": chunk_size, "mode": mode,
+                                        "initial_k": initial_k, "planner": planner, "dataset": path,
+                                    }
+                                    report["runs"].append({**config, **storage, **summary})
+                                    rows.append({
+                                        "config": f"{os.path.basename(path).replace('.json', '')} {label} c{chunk_size} {mode} k{initial_k} {planner}",
+                                        **storage,
+                                        **summary,
+                                    })
+    finally:
+        if args.index_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    print()
+    print_table(rows, ks)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Cold-start benchmark: import time, Agent construction and time to the first answer.
+
+Every measurement runs in a fresh interpreter against a throwaway index (hashing embeddings)
+and the local stub upstream (src/stub_upstream.py, no delay), so it is offline and what it
+measures is our own startup cost, not the network. Two ways to start are timed:
+    lazy  Agent() and answer straight away; the first request loads what it needs
+    warm  Agent().warm_up() first, as the server does before reporting ready
+
+    python -m src.bench_startup
+    python -m src.bench_startup --runs 5 --max-import-ms 400 --max-first-answer-ms 3000   # exits 1 if over budget
+"""
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+from src.config import VECTOR_BACKEND
+
+# Modules that cost hundreds of ms or more to import; none should load with `import src.agent`
+HEAVY_MODULES = ("openai", "httpx", "chromadb", "torch", "sentence_transformers", "docx", "fitz")
+IMPORTED_MODULES = ("src.agent", "src.server", "src.ingestion")
+
+IMPORT_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000, "heavy": [m for m in sys.argv[2].split(",") if m in sys.modules]}))
+"""
+
+ANSWER_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+from src.agent import Agent
+imported = time.perf_counter()
+agent = Agent()
+constructed = time.perf_counter()
+parts = agent.warm_up() if sys.argv[1] == "warm" else {}
+warmed = time.perf_counter()
+result = agent.run(sys.argv[2])
+answered = time.perf_counter()
+agent.run(sys.argv[3])
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "init_ms": (constructed - imported) * 1000,
+    "warm_up_ms": (warmed - constructed) * 1000,
+    "first_answer_ms": (answered - warmed) * 1000,
+    "total_ms": (answered - start) * 1000,
+    "second_answer_ms": (time.perf_counter() - answered) * 1000,
+    "warm_up_parts_ms": {name: seconds * 1000 for name, seconds in parts.items()},
+    "answered": bool(result["response"]),
+}))
+"""
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_stub(port, timeout=30):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "src.stub_upstream", "--port", str(port), "--latency-ms", "0"],
+        env={**os.environ, "STUB_TOKEN_DELAY_MS": "0"}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"Stub upstream didn't start on port {port}")
+
+def probe(script, args, env):
+    out = subprocess.run([sys.executable, "-c", script, *args], env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"Probe failed:\n{out.stderr[-2000:]}")
+    # config prints warnings to stdout; the result is the last line
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def _median(values):
+    return statistics.median(values) if values else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: import time and time to first answer")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per measurement (the median is reported)")
+    parser.add_argument("--backend", default=VECTOR_BACKEND, choices=["chroma", "numpy"])
+    parser.add_argument("--dataset", default="eval_dataset.json", help="The first two questions are asked")
+    parser.add_argument("--index-dir", default=None, help="Use (or build) the index here instead of a temp dir")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="Fail if `import src.agent` takes longer")
+    parser.add_argument("--max-first-answer-ms", type=float, default=None, help="Fail if the lazy start to first answer takes longer")
+    parser.add_argument("--output", default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        questions = [item["question"] for item in json.load(f)[:2]]
+
+    root = args.index_dir or tempfile.mkdtemp(prefix="bench_startup_")
+    stub = None
+    try:
+        if not os.path.exists(os.path.join(root, "ingest_manifest.json")):
+            from src.bench_retrieval import build_index
+            from src.embeddings import HashingEmbeddingFunction
+            from src.ingestion import DOCX_CHUNK_SIZE
+            print(f"Building {args.backend} index in {root}...")
+            build_index(root, HashingEmbeddingFunction(), DOCX_CHUNK_SIZE, backend=args.backend)
+
+        port = _free_port()
+        stub = start_stub(port)
+        env = {
+            **os.environ,
+            "CHROMA_PATH": root,
+            "VECTOR_BACKEND": args.backend,
+            "EMBEDDING_PROVIDER": "hashing",
+            "EMBEDDING_CACHE_PATH": "",
+            "TRACE_PATH": "",
+            "GROK_BASE_URL": f"http://127.0.0.1:{port}/v1",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{port}/v1",
+            "GROK_API_KEY": "stub",
+            "OPENAI_API_KEY": "stub",
+        }
+
+        report = {"backend": args.backend, "runs": args.runs, "imports": {}, "starts": {}}
+        print(f"\n{'import':<16} {'ms':>8}  heavy modules loaded")
+        for module in IMPORTED_MODULES:
+            results = [probe(IMPORT_PROBE, [module, ",".join(HEAVY_MODULES)], env) for _ in range(args.runs)]
+            heavy = sorted({m for r in results for m in r["heavy"]})
+            report["imports"][module] = {"ms": _median([r["ms"] for r in results]), "heavy": heavy}
+            print(f"{module:<16} {report['imports'][module]['ms']:>8.0f}  {', '.join(heavy) or '-'}")
+
+        columns = ("import_ms", "init_ms", "warm_up_ms", "first_answer_ms", "total_ms", "second_answer_ms")
+        print(f"\n{'start':<6} " + " ".join(f"{c.replace('_ms', ''):>13}" for c in columns) + "   (ms)")
+        for mode in ("lazy", "warm"):
+            results = [probe(ANSWER_PROBE, [mode, *questions], env) for _ in range(args.runs)]
+            if not all(r["answered"] for r in results):
+                print(f"Warning: an empty answer in {mode} mode")
+            summary = {c: _median([r[c] for r in results]) for c in columns}
+            parts = results[0]["warm_up_parts_ms"]
+            summary["warm_up_parts_ms"] = {name: _median([r["warm_up_parts_ms"][name] for r in results]) for name in parts}
+            report["starts"][mode] = summary
+            print(f"{mode:<6} " + " ".join(f"{summary[c]:>13.0f}" for c in columns))
+        parts = report["starts"]["warm"]["warm_up_parts_ms"]
+        print("\nwarm_up: " + ", ".join(f"{name} {ms:.0f} ms" for name, ms in parts.items()))
+    finally:
+        if stub is not None:
+            stub.kill()
+        if args.index_dir is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+        print(f"\nResults saved to {args.output}")
+
+    over = []
+    if args.max_import_ms is not None and report["imports"]["src.agent"]["ms"] > args.max_import_ms:
+        over.append(f"import src.agent {report['imports']['src.agent']['ms']:.0f} ms > {args.max_import_ms:.0f} ms")
+    if args.max_first_answer_ms is not None and report["starts"]["lazy"]["total_ms"] > args.max_first_answer_ms:
+        over.append(f"first answer {report['starts']['lazy']['total_ms']:.0f} ms > {args.max_first_answer_ms:.0f} ms")
+    if over:
+        print("\nOver budget: " + "; ".join(over))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
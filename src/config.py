@@ -6,8 +6,111 @@ load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 GROK_API_KEY = os.getenv("GROK_API_KEY")
 GROK_MODEL = os.getenv("GROK_MODEL", "grok-4-fast-non-reasoning")
+GROK_BASE_URL = os.getenv("GROK_BASE_URL", "https://api.x.ai/v1")
+# None -> OpenAI's default endpoint; point both at src.stub_upstream for offline/load testing
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 CHROMA_PATH = os.getenv("CHROMA_PATH", "./chroma_db")
+# Vector index: "chroma", or "numpy" (memory-mapped exact search, src/vector_store.py); re-ingest after switching
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# NumPy backend storage: the first pass scans "float16"/"int8" codes ("none" = float32) of the leading
+# VECTOR_SEARCH_DIMENSIONS components (0 = all), then re-scores the top n * VECTOR_RESCORE_FACTOR with
+# float32 vectors. VECTOR_RESCORE_FACTOR=0 drops the float32 copy entirely (smallest on disk).
+# Apply to an existing index with `python -m src.vector_store --reencode`.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_SEARCH_DIMENSIONS = int(os.getenv("VECTOR_SEARCH_DIMENSIONS", "0"))
+VECTOR_RESCORE_FACTOR = int(os.getenv("VECTOR_RESCORE_FACTOR", "4"))
+# "openai", or "hashing" for deterministic offline vectors (benchmarks, CI); re-ingest after switching
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
 EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+# Optional output size for text-embedding-3 models (None = model default)
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0")) or None
+# Persistent embedding cache; set EMBEDDING_CACHE_PATH="" to disable
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./.cache/embeddings.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "50000"))
+# Request packing for the embeddings API (limit is 2048 inputs / 300k tokens per request)
+EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_ITEMS = int(os.getenv("EMBEDDING_BATCH_MAX_ITEMS", "2048"))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", "4"))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", "6"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+# New chunks per embedding/write batch (batches span file boundaries), and how many
+# files/batches may wait between the parse, embed and write stages before upstream stages block
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "4"))
+# Backends that rewrite a snapshot per write (numpy) buffer ingestion writes; they are flushed, and
+# the manifest saved, at most this often (and at the end), which bounds the work an interruption loses
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "30"))
+# DOCX reader: "stream" (lxml iterparse, fast, flat memory) or "python-docx"; both give identical chunks
+DOCX_PARSER = os.getenv("DOCX_PARSER", "stream")
+# Chunks are stored once per distinct (whitespace-normalized) text. With 1, text that differs
+# from a stored chunk only in dates and years (a re-stamped copy) is stored once too. Off by
+# default: a changed date can be a real amendment, and the new text would not be indexed.
+DEDUPE_MASK_DATES = os.getenv("DEDUPE_MASK_DATES", "0") == "1"
+INGEST_MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", os.path.join(CHROMA_PATH, "ingest_manifest.json"))
+# Candidates per dense/lexical query and passages returned by Agent.retrieve
+RETRIEVAL_INITIAL_K = int(os.getenv("RETRIEVAL_INITIAL_K", "50"))
+RETRIEVAL_TOP_N = int(os.getenv("RETRIEVAL_TOP_N", "15"))
+# "adaptive": try RETRIEVAL_NARROW_K candidates in the category scopes first and widen to
+# RETRIEVAL_INITIAL_K over every scope only when the results look weak; "fixed": always wide
+RETRIEVAL_PLANNER = os.getenv("RETRIEVAL_PLANNER", "adaptive")
+RETRIEVAL_NARROW_K = int(os.getenv("RETRIEVAL_NARROW_K", "20"))
+# Weak = the k-th dense distance within this fraction of the best one, or no overlap between
+# the top RETRIEVAL_AGREEMENT_DEPTH dense and BM25 results
+RETRIEVAL_MIN_SPREAD = float(os.getenv("RETRIEVAL_MIN_SPREAD", "0.05"))
+RETRIEVAL_AGREEMENT_DEPTH = int(os.getenv("RETRIEVAL_AGREEMENT_DEPTH", "5"))
+# BM25 index fused with vector search in Agent.retrieve
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", os.path.join(CHROMA_PATH, "lexical_index"))
+# Re-ranking of the fused shortlist: "lexical" (cheap CPU), "cross-encoder" or "none"
+RERANKER = os.getenv("RERANKER", "lexical")
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_SHORTLIST = int(os.getenv("RERANK_SHORTLIST", "30"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+# Semantic answer cache (ANSWER_CACHE_MAX_ENTRIES=0 disables it)
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+# Token budget for the retrieved context in generation and self-correction prompts
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# "incremental": verify streamed answers segment by segment; "buffered": audit the whole answer first
+SELF_CORRECTION_MODE = os.getenv("SELF_CORRECTION_MODE", "incremental")
+# Incremental mode audits completed segments in batches: one call once this many characters
+# are waiting, or once the oldest has waited this many seconds (each call re-sends the context)
+VERIFY_BATCH_CHARS = int(os.getenv("VERIFY_BATCH_CHARS", "1200"))
+VERIFY_BATCH_SECONDS = float(os.getenv("VERIFY_BATCH_SECONDS", "2.0"))
+# Local intent classifier (category centroids built at ingestion time)
+INTENT_CENTROIDS_PATH = os.getenv("INTENT_CENTROIDS_PATH", os.path.join(CHROMA_PATH, "intent_centroids.npz"))
+# The local answer is trusted only above a margin (best minus second-best cosine) measured at
+# ingestion: the smallest one whose answers reach INTENT_TARGET_ACCURACY on the calibration
+# questions. Those are generated from the indexed chunks and kept apart from the eval datasets,
+# which report accuracy. Below it, or with no measurement (or hashing embeddings), the LLM is asked.
+INTENT_TARGET_ACCURACY = float(os.getenv("INTENT_TARGET_ACCURACY", "0.95"))
+INTENT_CALIBRATION_DATASETS = os.getenv("INTENT_CALIBRATION_DATASETS", "intent_calibration.json")
+# Overrides the measured margin when set
+INTENT_MIN_MARGIN = float(os.getenv("INTENT_MIN_MARGIN")) if os.getenv("INTENT_MIN_MARGIN") else None
+# HTTP service (src/server.py)
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "2"))
+# Requests processed at once per worker process; the rest wait up to SERVER_QUEUE_TIMEOUT seconds
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "16"))
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "30"))
+# LLM gateway (src/llm.py). Chat calls must finish within LLM_TIMEOUT seconds including retries;
+# router/classifier/HyDE/audit calls use the shorter LLM_FAST_TIMEOUT. Embedding attempts time out
+# after EMBEDDING_TIMEOUT and are retried up to EMBEDDING_MAX_RETRIES times.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_FAST_TIMEOUT = float(os.getenv("LLM_FAST_TIMEOUT", "15"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Concurrent chat requests per process (embeddings use EMBEDDING_MAX_CONCURRENCY)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "64"))
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", "30"))
+# Consecutive upstream failures (5xx, timeouts, connection errors) before calls fail fast for CIRCUIT_RESET_SECONDS
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+# Per-request stage timings (src/tracing.py), one JSON line per request; empty disables tracing
+TRACE_PATH = os.getenv("TRACE_PATH", "traces/requests.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
 
 if not GROK_API_KEY:
     print("WARNING: GROK_API_KEY is not set.")
@@ -0,0 +1,126 @@
+import re
+from src.tokens import estimate_tokens
+from src.lexical_index import tokenize
+
+CONTEXT_HEADER_RE = re.compile(r"^Контекст:[^\n]*\n")
+SENTENCE_RE = re.compile(r"[^.!?;\n]+(?:[.!?;]+|$)")
+WORD_RE = re.compile(r"\w+")
+
+def _strip_header(text):
+    # DOCX chunks repeat their hierarchy as a "Контекст: ..." first line; it goes into the block header instead
+    return CONTEXT_HEADER_RE.sub("", text, count=1)
+
+def _shingles(line, n=3):
+    words = WORD_RE.findall(line.lower())
+    if len(words) < n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+def _dedupe_lines(blocks, threshold=0.85):
+    """Drops lines that exactly or nearly (word 3-shingle Jaccard) repeat a line kept earlier."""
+    seen_exact = set()
+    kept_shingles = []
+    dropped = 0
+    for block in blocks:
+        lines = []
+        for line in block["lines"]:
+            key = " ".join(WORD_RE.findall(line.lower()))
+            if not key:
+                continue
+            if key in seen_exact:
+                dropped += 1
+                continue
+            if len(key) > 40:
+                sh = _shingles(line)
+                if any(len(sh & other) / len(sh | other) >= threshold for other in kept_shingles):
+                    dropped += 1
+                    continue
+                kept_shingles.append(sh)
+            seen_exact.add(key)
+            lines.append(line)
+        block["lines"] = lines
+    return dropped
+
+def _trim_to_budget(query, blocks, budget):
+    """Keeps the most query-relevant sentences (in original order) until the block texts fit `budget` tokens."""
+    q_terms = set(tokenize(query))
+    sentences = [] # (score, block index, line index, sentence index, text)
+    for b, block in enumerate(blocks):
+        budget -= estimate_tokens(block["header"])
+        for l, line in enumerate(block["lines"]):
+            for s, match in enumerate(SENTENCE_RE.finditer(line)):
+                text = match.group(0).strip()
+                if not text:
+                    continue
+                terms = set(tokenize(text))
+                score = len(terms & q_terms) / (len(q_terms) or 1)
+                # Earlier blocks are better ranked by retrieval; use that as the tie-breaker
+                sentences.append((score, -b, b, l, s, text))
+
+    keep = set()
+    for score, _, b, l, s, text in sorted(sentences, reverse=True):
+        cost = estimate_tokens(text)
+        if cost > budget:
+            continue
+        budget -= cost
+        keep.add((b, l, s))
+
+    for b, block in enumerate(blocks):
+        lines = {}
+        for score, _, bb, l, s, text in sentences:
+            if bb == b and (b, l, s) in keep:
+                lines.setdefault(l, []).append((s, text))
+        block["lines"] = [" ".join(t for _, t in sorted(parts)) for _, parts in sorted(lines.items())]
+    return [block for block in blocks if block["lines"]]
+
+def format_blocks(blocks):
+    return "\n\n".join(f"{block['header']}\nТекст: " + "\n".join(block["lines"]) for block in blocks)
+
+def pack_context(query, context_items, token_budget):
+    """
+    Builds the КОНТЕКСТ string for generation/audit prompts from retrieved chunks:
+    chunks from the same source and article are merged under a single header, in the block
+    where that article first appears, so blocks keep the rank of their best chunk; repeated
+    "Контекст:" hierarchy lines are collapsed, near-duplicate passages are dropped, and if the
+    result is still over `token_budget` only the sentences most relevant to the query are kept.
+    Returns (context_str, stats).
+    """
+    raw_tokens = sum(
+        estimate_tokens(f"[[Источник: {item['metadata'].get('source', 'Unknown')} | Структура: {item['metadata'].get('full_context', 'No context path')}]]\nТекст: {item['content']}")
+        for item in context_items
+    )
+
+    blocks = []
+    by_key = {}
+    for item in context_items:
+        source = item['metadata'].get('source', 'Unknown')
+        # Hierarchical context from ingestion (e.g., "Law > Chapter 2 > Article 5")
+        hierarchy = item['metadata'].get('full_context', 'No context path')
+        # The hierarchy ends with the article, so one key per article. A lower-ranked chunk joins
+        # the block of its article's best one, after its text; the block order stays the ranking.
+        key = (source, hierarchy)
+        if key not in by_key:
+            by_key[key] = {"header": f"[[Источник: {source} | Структура: {hierarchy}]]", "lines": []}
+            blocks.append(by_key[key])
+        by_key[key]["lines"].extend(line.strip() for line in _strip_header(item['content']).split("\n"))
+
+    dropped_lines = _dedupe_lines(blocks)
+    blocks = [block for block in blocks if block["lines"]]
+
+    context_str = format_blocks(blocks)
+    trimmed = False
+    if estimate_tokens(context_str) > token_budget:
+        blocks = _trim_to_budget(query, blocks, token_budget)
+        context_str = format_blocks(blocks)
+        trimmed = True
+
+    packed_tokens = estimate_tokens(context_str)
+    return context_str, {
+        "chunks": len(context_items),
+        "blocks": len(blocks),
+        "dropped_lines": dropped_lines,
+        "trimmed": trimmed,
+        "raw_tokens": raw_tokens,
+        "packed_tokens": packed_tokens,
+        "saved_tokens": raw_tokens - packed_tokens,
+    }
@@ -42,6 +42,7 @@ def convert_csv_to_json(csv_path, json_path):
             # Let's check keys just in case
             ground_truth = row.get('Релевантный кусок НПА')
             target_npa_raw = row.get('Целевой НПА')
+            category = row.get('Категория')
             
             if not question:
                 continue
@@ -53,6 +54,7 @@ def convert_csv_to_json(csv_path, json_path):
                 "ground_truth": ground_truth,
                 "source_metadata": {
                     "source": source_filename,
+                    "category": category,
                     "target_npa_raw": target_npa_raw # Keep raw for debugging
                 }
             }
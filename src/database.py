@@ -1,12 +1,22 @@
-import chromadb
-from chromadb.config import Settings
-from src.config import CHROMA_PATH
+import os
+from src.config import CHROMA_PATH, VECTOR_BACKEND, VECTOR_QUANTIZATION, VECTOR_SEARCH_DIMENSIONS
 from src.embeddings import get_embedding_function
 
 class VectorDB:
-    def __init__(self):
-        self.client = chromadb.PersistentClient(path=CHROMA_PATH, settings=Settings(allow_reset=True))
-        self.embedding_fn = get_embedding_function()
+    def __init__(self, path=CHROMA_PATH, embedding_fn=None, backend=VECTOR_BACKEND):
+        self.backend = backend
+        if backend == "chroma":
+            if VECTOR_QUANTIZATION != "none" or VECTOR_SEARCH_DIMENSIONS:
+                raise ValueError("VECTOR_QUANTIZATION / VECTOR_SEARCH_DIMENSIONS need VECTOR_BACKEND=numpy")
+            import chromadb
+            from chromadb.config import Settings
+            self.client = chromadb.PersistentClient(path=path, settings=Settings(allow_reset=True))
+        elif backend == "numpy":
+            from src.vector_store import NumpyVectorStore
+            self.client = NumpyVectorStore(os.path.join(path, "vectors"))
+        else:
+            raise ValueError(f"Unknown vector backend: {backend}")
+        self.embedding_fn = embedding_fn or get_embedding_function()
 
     def get_or_create_collection(self, name):
         return self.client.get_or_create_collection(
@@ -0,0 +1,123 @@
+"""
+Content addressing and duplicate detection for chunks.
+
+A chunk's id is the hash of its whitespace-normalized text, so the same passage in several
+files (a law filed under more than one category, a "(1)" download) is stored and embedded
+once. Optionally (DEDUPE_MASK_DATES), text that differs from a stored chunk only in its dates
+(and years written as such), e.g. a re-stamped copy of an edition, takes that chunk's id too:
+variant_key() masks them, and only identical keys match. Anything else, a changed article number, amount,
+deadline or a "не", is a different rule and keeps a chunk of its own.
+
+SimHash (word 3-grams, dates masked) finds passages that are merely close, e.g. to count
+near-repeats among retrieved results. Within a few bits it cannot tell "в течение 10 дней"
+from "в течение 30 дней", so it is never used to merge chunks.
+"""
+import re
+import hashlib
+import numpy as np
+
+WORD_RE = re.compile(r"\w+")
+MONTHS = "января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря"
+# A four-digit number is a year only in a date context ("2015 года", "2015 г."): "1950 МРП" is an amount
+DATE_RE = re.compile(
+    r"\b\d{1,2}\.\d{1,2}\.\d{2,4}\b"
+    rf"|\b\d{{1,2}}\s+(?:{MONTHS})\s+\d{{4}}\b"
+    r"|\b\d{4}\s*(?:год[ау]?\b|г\.)",
+    re.IGNORECASE
+)
+
+# Below this many word 3-grams (signature blocks, table headers) a fingerprint says little,
+# and two different short passages can land within a few bits of each other
+MIN_SHINGLES = 20
+
+def normalize(text):
+    return " ".join(text.split())
+
+def content_id(text):
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()[:16]
+
+def variant_key(text):
+    """Hash of the text with whitespace normalized and dates and years masked."""
+    return content_id(DATE_RE.sub("0", text))
+
+class VariantIndex:
+    """Chunk ids by variant_key, for reusing a stored chunk's id for a copy that differs only in dates."""
+    def __init__(self):
+        self.ids = {}
+        self.keys = {}
+
+    def add(self, chunk_id, key):
+        if key is None or chunk_id in self.keys:
+            return
+        self.keys[chunk_id] = key
+        self.ids.setdefault(key, chunk_id)
+
+    def remove(self, chunk_id):
+        key = self.keys.pop(chunk_id, None)
+        if key is not None and self.ids.get(key) == chunk_id:
+            del self.ids[key]
+
+    def find(self, key, skip=()):
+        match = self.ids.get(key)
+        return None if match in skip else match
+
+def simhash(text):
+    """64-bit SimHash of the text's word 3-grams, or None for passages too short to fingerprint."""
+    words = WORD_RE.findall(DATE_RE.sub(" 0 ", text.lower().replace("ё", "е")))
+    shingles = {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    # Each bit of the fingerprint is the majority vote of that bit over the shingle hashes
+    majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(hashes)
+    return int(np.packbits(majority, bitorder="little").view("<u8")[0])
+
+class NearDuplicateIndex:
+    """
+    SimHash fingerprints by chunk id, with lookup of the closest one within `max_distance` bits.
+    The 64 bits are cut into max_distance + 1 bands; two fingerprints that close agree on at
+    least one whole band, so only chunks sharing a band value are compared.
+    """
+    def __init__(self, max_distance=3):
+        self.max_distance = max_distance
+        self.width = 64 // (max_distance + 1)
+        self.bands = [{} for _ in range(max_distance + 1)] if max_distance > 0 else []
+        self.fingerprints = {}
+
+    def _keys(self, fingerprint):
+        mask = (1 << self.width) - 1
+        return [(fingerprint >> (b * self.width)) & mask for b in range(len(self.bands))]
+
+    def add(self, chunk_id, fingerprint):
+        if fingerprint is None or chunk_id in self.fingerprints:
+            return
+        self.fingerprints[chunk_id] = fingerprint
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            band.setdefault(key, []).append(chunk_id)
+
+    def remove(self, chunk_id):
+        fingerprint = self.fingerprints.pop(chunk_id, None)
+        if fingerprint is None:
+            return
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            band[key].remove(chunk_id)
+            if not band[key]:
+                del band[key]
+
+    def find(self, fingerprint, skip=()):
+        """Id of the closest indexed chunk within max_distance bits (the earliest added on ties), or None."""
+        if fingerprint is None or not self.bands:
+            return None
+        best, best_distance = None, self.max_distance + 1
+        for band, key in zip(self.bands, self._keys(fingerprint)):
+            for chunk_id in band.get(key, ()):
+                if chunk_id in skip:
+                    continue
+                distance = bin(self.fingerprints[chunk_id] ^ fingerprint).count("1")
+                if distance < best_distance:
+                    best, best_distance = chunk_id, distance
+        return best
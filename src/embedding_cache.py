@@ -0,0 +1,99 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+class EmbeddingCache:
+    """
+    On-disk embedding cache backed by SQLite.
+    Keyed by (model name, dimensions, text hash); vectors are stored as float32 blobs.
+    When the cache grows past `max_entries`, the least recently used entries are evicted.
+    Reads don't write: hits are recorded in memory and their `last_used` is flushed on the
+    next put, or once `touch_flush_seconds` have passed, so eviction order stays close to LRU.
+    """
+    def __init__(self, path, max_entries=50000, touch_flush_seconds=60.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_flush_seconds = touch_flush_seconds
+        self.touched = {} # key -> last read time, not yet written
+        self.last_flush = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, dimensions, text):
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{dimensions or 0}:{text_hash}"
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys that are cached."""
+        found = {}
+        if not keys:
+            return found
+        now = time.time()
+        with self.lock:
+            # SQLite limits the number of bound parameters per statement
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            self.touched.update(dict.fromkeys(found, now))
+            if self.touched and time.monotonic() - self.last_flush > self.touch_flush_seconds:
+                self._flush_touched()
+                self.conn.commit()
+        return found
+
+    def _flush_touched(self):
+        """Writes the pending last_used updates; the caller holds the lock and commits."""
+        if self.touched:
+            self.conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(t, key) for key, t in self.touched.items()]
+            )
+            self.touched.clear()
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush_touched()
+            self.conn.commit()
+
+    def put_many(self, items):
+        """Stores {key: vector}."""
+        if not items:
+            return
+        now = time.time()
+        with self.lock:
+            # Pending reads first, so eviction below sees them as recently used
+            self._flush_touched()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            self.size = self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            if self.size > self.max_entries:
+                # Evict down to 90% so we don't pay for an eviction on every insert
+                excess = self.size - int(self.max_entries * 0.9)
+                self.conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self.size -= excess
+            self.conn.commit()
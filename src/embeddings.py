@@ -1,47 +1,173 @@
-from openai import OpenAI
-from src.config import EMBEDDING_MODEL_NAME, OPENAI_API_KEY
+import zlib
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from src import llm
+from src.config import (
+    EMBEDDING_PROVIDER,
+    EMBEDDING_MODEL_NAME,
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_BATCH_TOKENS,
+    EMBEDDING_BATCH_MAX_ITEMS,
+    EMBEDDING_MAX_CONCURRENCY,
+)
+from src.embedding_cache import EmbeddingCache
+from src.tokens import estimate_tokens
+
+def hash_embedding(text, dimensions=1536):
+    """
+    Deterministic, local stand-in for a real embedding model: character trigrams
+    hashed into `dimensions` buckets with a sign bit, L2-normalized. Texts sharing wording
+    land close together, which is enough for offline tests and benchmarks.
+    """
+    text = " " + " ".join(text.lower().split()) + " "
+    hashes = np.fromiter(
+        (zlib.crc32(text[i:i + 3].encode("utf-8")) for i in range(len(text) - 2)),
+        dtype=np.uint32, count=max(len(text) - 2, 0)
+    )
+    vec = np.bincount(hashes % dimensions, weights=np.where(hashes >> 31, 1.0, -1.0), minlength=dimensions)
+    norm = np.linalg.norm(vec) or 1.0
+    return (vec / norm).tolist()
+
+def pack_batches(texts, max_tokens=EMBEDDING_BATCH_TOKENS, max_items=EMBEDDING_BATCH_MAX_ITEMS):
+    """
+    Greedily groups text indices into requests that stay under both the token budget
+    and the per-request input limit. Returns a list of index lists, in input order.
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 class EmbeddingFunction:
     def __init__(self):
         print(f"Initializing OpenAI Embedding Model: {EMBEDDING_MODEL_NAME}")
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
         self.model_name = EMBEDDING_MODEL_NAME
-        
+        self.dimensions = EMBEDDING_DIMENSIONS
+        self.cache = EmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES) if EMBEDDING_CACHE_PATH else None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
     def __call__(self, input):
         if isinstance(input, str):
             input = [input]
-        
-        # OpenAI API supports batch processing up to 2048 texts
-        # We'll process in batches to avoid rate limits
-        batch_size = 100
-        all_embeddings = []
-        
-        for i in range(0, len(input), batch_size):
-            batch = input[i:i + batch_size]
-            response = self.client.embeddings.create(
-                input=batch,
-                model=self.model_name
-            )
-            batch_embeddings = [item.embedding for item in response.data]
-            all_embeddings.extend(batch_embeddings)
-        
+
+        if self.cache is None:
+            return self._embed(input)
+
+        keys = [EmbeddingCache.make_key(self.model_name, self.dimensions, text) for text in input]
+        cached = self.cache.get_many(list(set(keys)))
+
+        # Only texts we have never seen go to the API (once, even if repeated in `input`)
+        missing = {}
+        for key, text in zip(keys, input):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.cache_hits += len(input) - len(missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            fresh = dict(zip(missing.keys(), self._embed(list(missing.values()))))
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+
+        return [cached[key] for key in keys]
+
+    def _embed(self, input):
+        # Requests are packed by estimated tokens (long table chunks vs short PDF
+        # paragraphs) and run concurrently; the gateway caps how many are in flight.
+        batches = pack_batches(input)
+        all_embeddings = [None] * len(input)
+
+        if len(batches) == 1:
+            results = [self._embed_batch([input[i] for i in batches[0]])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(EMBEDDING_MAX_CONCURRENCY, len(batches))) as executor:
+                results = list(executor.map(lambda batch: self._embed_batch([input[i] for i in batch]), batches))
+
+        for batch, embeddings in zip(batches, results):
+            for i, embedding in zip(batch, embeddings):
+                all_embeddings[i] = embedding
+
         return all_embeddings
 
+    def _embed_batch(self, texts):
+        extra = {"dimensions": self.dimensions} if self.dimensions else {}
+        # Retries (honouring Retry-After), timeouts and the circuit breaker live in the gateway
+        response = llm.embed(input=texts, model=self.model_name, **extra)
+        # The API returns items with an explicit index; don't rely on ordering
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def cache_stats(self):
+        total = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_rate": self.cache_hits / total if total else 0.0,
+            "entries": self.cache.size if self.cache else 0
+        }
+
     def embed_query(self, input):
         return self.__call__(input)
-        
+
     def embed_documents(self, input):
         return self.__call__(input)
-    
+
     def name(self):
         """Return the name of the embedding model for ChromaDB"""
         return self.model_name
 
+class HashingEmbeddingFunction:
+    """
+    Offline stand-in for EmbeddingFunction built on hash_embedding: no API key, no network,
+    and the same vectors on every run, so retrieval benchmarks are reproducible.
+    """
+    def __init__(self, dimensions=None):
+        self.dimensions = dimensions or EMBEDDING_DIMENSIONS or 1536
+        self.model_name = f"hashing-trigram-{self.dimensions}"
+        self.calls = 0
+
+    def __call__(self, input):
+        if isinstance(input, str):
+            input = [input]
+        self.calls += len(input)
+        return [hash_embedding(text, self.dimensions) for text in input]
+
+    def cache_stats(self):
+        return {"hits": 0, "misses": self.calls, "hit_rate": 0.0, "entries": 0}
+
+    def embed_query(self, input):
+        return self.__call__(input)
+
+    def embed_documents(self, input):
+        return self.__call__(input)
+
+    def name(self):
+        return self.model_name
+
+def make_embedding_function(provider=EMBEDDING_PROVIDER):
+    if provider == "openai":
+        return EmbeddingFunction()
+    if provider == "hashing":
+        return HashingEmbeddingFunction()
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
 # Singleton instance
 _embedding_function = None
 
 def get_embedding_function():
     global _embedding_function
     if _embedding_function is None:
-        _embedding_function = EmbeddingFunction()
+        _embedding_function = make_embedding_function()
     return _embedding_function
@@ -1,14 +1,29 @@
 import json
 import time
 import os
-from openai import OpenAI
+import hashlib
+import asyncio
+from src import llm
 from src.agent import Agent
-from src.config import GROK_API_KEY, GROK_MODEL
+from src.config import GROK_MODEL
+from src.stats import latency_summary
 
-client = OpenAI(api_key=GROK_API_KEY, base_url="https://api.x.ai/v1")
+JUDGE_INSTRUCTIONS = """
+    Rate the Agent Answer on a scale of 1 to 5 based on how well it matches the Ground Truth in terms of factual correctness.
+    1 = Completely wrong
+    5 = Completely correct and accurate
+    
+    Also provide a brief explanation.
+    """
 
-def evaluate_response(question, agent_answer, ground_truth):
-    prompt = f"""
+def _parse_json(content):
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content.replace("```json", "").replace("```", "")
+    return json.loads(content)
+
+def _judge_prompt(question, agent_answer, ground_truth):
+    return f"""
     You are an impartial judge evaluating an AI assistant's answer.
     
     Question: {question}
@@ -16,34 +31,260 @@ def evaluate_response(question, agent_answer, ground_truth):
     Ground Truth Answer: {ground_truth}
     
     Agent Answer: {agent_answer}
-    
-    Rate the Agent Answer on a scale of 1 to 5 based on how well it matches the Ground Truth in terms of factual correctness.
-    1 = Completely wrong
-    5 = Completely correct and accurate
-    
-    Also provide a brief explanation.
-    
+    {JUDGE_INSTRUCTIONS}
     Format: JSON with keys "score" (int) and "explanation" (string).
     """
+
+def _batch_judge_prompt(records):
+    cases = "".join(
+        f"""
+    ### Case {i}
+    Question: {r['question']}
+    
+    Ground Truth Answer: {r['ground_truth']}
     
+    Agent Answer: {r['agent_answer']}
+    """
+        for i, r in enumerate(records)
+    )
+    return f"""
+    You are an impartial judge evaluating an AI assistant's answers. Judge each case independently.
+    {cases}
+    {JUDGE_INSTRUCTIONS}
+    Format: JSON object {{"verdicts": [{{"case": int, "score": int, "explanation": string}}, ...]}} with one verdict per case.
+    """
+
+def _verdict(parsed):
+    """{"score", "explanation"} from a judge reply, or None if it has no 1-5 score."""
+    score = parsed.get("score") if isinstance(parsed, dict) else None
+    if not isinstance(score, int) or not 1 <= score <= 5:
+        return None
+    return {"score": score, "explanation": parsed.get("explanation", "")}
+
+def evaluate_response(question, agent_answer, ground_truth):
+    """The judge's verdict, or None if it failed (so it isn't scored as a 0)."""
+    try:
+        response = llm.chat(
+            model=GROK_MODEL,
+            messages=[{"role": "user", "content": _judge_prompt(question, agent_answer, ground_truth)}],
+            temperature=0.1
+        )
+        return _verdict(_parse_json(response.choices[0].message.content))
+    except Exception as e:
+        print(f"Error evaluating: {e}")
+        return None
+
+async def aevaluate_response(question, agent_answer, ground_truth):
     try:
-        response = client.chat.completions.create(
+        response = await llm.achat(
             model=GROK_MODEL,
-            messages=[{"role": "user", "content": prompt}],
+            messages=[{"role": "user", "content": _judge_prompt(question, agent_answer, ground_truth)}],
             temperature=0.1
         )
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content.replace("```json", "").replace("```", "")
-        return json.loads(content)
+        return _verdict(_parse_json(response.choices[0].message.content))
     except Exception as e:
         print(f"Error evaluating: {e}")
-        return {"score": 0, "explanation": "Error"}
+        return None
+
+async def aevaluate_batch(records):
+    """
+    Judges several answers in one LLM call. Cases the judge skipped or mangled (or the whole
+    batch, if the reply isn't valid JSON) are re-judged one by one; None where that fails too.
+    """
+    verdicts = {}
+    if len(records) > 1:
+        try:
+            response = await llm.achat(
+                model=GROK_MODEL,
+                messages=[{"role": "user", "content": _batch_judge_prompt(records)}],
+                temperature=0.1,
+                response_format={"type": "json_object"}
+            )
+            for verdict in _parse_json(response.choices[0].message.content).get("verdicts", []):
+                case = verdict.get("case")
+                if isinstance(case, int) and 0 <= case < len(records) and _verdict(verdict):
+                    verdicts[case] = _verdict(verdict)
+        except Exception as e:
+            print(f"Batch judge failed ({e}), judging {len(records)} answers one by one")
+
+    missing = [i for i in range(len(records)) if i not in verdicts]
+    singles = await asyncio.gather(*[
+        aevaluate_response(records[i]["question"], records[i]["agent_answer"], records[i]["ground_truth"])
+        for i in missing
+    ])
+    verdicts.update(zip(missing, singles))
+    return [verdicts[i] for i in range(len(records))]
+
+def item_key(item):
+    return hashlib.sha1(f"{item['question']}\n{item['ground_truth']}".encode("utf-8")).hexdigest()[:16]
+
+def retrieval_hit(target_source, retrieved_context):
+    # Simple strict check on source filename
+    # Ideally we check if the exact chunk was retrieved, but checking source file is a good proxy for category/file retrieval
+    if not target_source:
+        return False
+    for ctx in retrieved_context:
+        # Flexible check: contains or exact match, against every file that shares the chunk
+        for source in ctx['metadata'].get('sources') or [ctx['metadata'].get('source')]:
+            if source and target_source in source:
+                return True
+    return False
+
+class Checkpoint:
+    """
+    Append-only JSONL log of finished work, so an interrupted run resumes where it stopped.
+    Each item gets an "answer" record once the agent has replied and a "judged" record once
+    scored; on resume, judged items are skipped and answered ones go straight to the judge.
+    A failed judgment writes nothing, so the item stays answered and is judged again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.answers = {}
+        self.judged = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except ValueError:
+                        pass # Torn last line from an interrupted run
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _add(self, record):
+        if record["stage"] == "answer":
+            self.answers[record["key"]] = record
+        elif record.get("correctness_score", 0) > 0: # Older runs logged judge errors as a 0
+            self.judged[record["key"]] = record
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self._add(record)
+
+    def close(self):
+        self.file.close()
+
+async def run_evaluation(agent, dataset, checkpoint, workers=4, judge_batch=5):
+    """Answers with `workers` concurrent agent runs while finished answers are judged in batches."""
+    pending = {}
+    for item in dataset:
+        key = item_key(item)
+        if key not in checkpoint.judged:
+            pending.setdefault(key, item)
+    to_answer = asyncio.Queue()
+    to_judge = asyncio.Queue()
+    for key, item in pending.items():
+        if key in checkpoint.answers:
+            to_judge.put_nowait(checkpoint.answers[key])
+        else:
+            to_answer.put_nowait(item)
+    print(f"Resuming: {len(checkpoint.judged)} judged, {to_judge.qsize()} answered, {to_answer.qsize()} to run")
+
+    done = 0
+    failed = 0
+
+    async def answer_worker():
+        while not to_answer.empty():
+            item = to_answer.get_nowait()
+            q = item["question"]
+            source_meta = item.get("source_metadata", {}) # Handle missing metadata safely
+            start_time = time.time()
+            try:
+                agent_result = await agent.arun(q)
+            except Exception as e:
+                # Not checkpointed, so the next run retries it
+                print(f"Agent failed on '{q}': {e}")
+                continue
+            record = {
+                "stage": "answer",
+                "key": item_key(item),
+                "question": q,
+                "ground_truth": item["ground_truth"],
+                "agent_answer": agent_result["response"],
+                "retrieval_hit": retrieval_hit(source_meta.get("source"), agent_result["context"]),
+                "latency": time.time() - start_time,
+                "target_source": source_meta.get("source"),
+            }
+            checkpoint.write(record)
+            to_judge.put_nowait(record)
+
+    async def judge(batch):
+        nonlocal done, failed
+        verdicts = await aevaluate_batch(batch)
+        for record, verdict in zip(batch, verdicts):
+            done += 1
+            if verdict is None:
+                failed += 1
+                print(f"[{done}/{len(pending)}] Judge failed, left for the next run | {record['question']}")
+                continue
+            checkpoint.write({
+                **record,
+                "stage": "judged",
+                "correctness_score": verdict["score"],
+                "explanation": verdict["explanation"],
+            })
+            print(f"[{done}/{len(pending)}] Score: {verdict['score']}/5 | Hit: {record['retrieval_hit']} | {record['question']}")
+
+    async def judge_loop(answering):
+        # Batches of `judge_batch` answers; whatever is left is sent once answering is over
+        judging = []
+        batch = []
+        while True:
+            try:
+                batch.append(await asyncio.wait_for(to_judge.get(), timeout=0.5))
+            except asyncio.TimeoutError:
+                pass
+            finished = answering.done() and to_judge.empty()
+            if len(batch) >= judge_batch or (batch and finished):
+                judging.append(asyncio.create_task(judge(batch)))
+                batch = []
+            if finished:
+                break
+        await asyncio.gather(*judging)
+
+    answering = asyncio.gather(*[answer_worker() for _ in range(workers)])
+    await asyncio.gather(answering, judge_loop(answering))
+    if failed:
+        print(f"{failed} judgments failed; run again to retry them")
+
+def build_report(dataset_path, dataset, results, workers, embedding_stats, unjudged=()):
+    """`results` are the judged records; `unjudged` the answered ones whose judgment failed, left out of the scores."""
+    avg_score = sum(r["correctness_score"] for r in results) / len(results) if results else 0
+    hit_rate = sum(1 for r in results if r["retrieval_hit"]) / len(results) if results else 0
+    latency = latency_summary([r["latency"] for r in results])
+
+    report = f"""# RAG Evaluation Report
+    
+**Dataset:** {dataset_path}
+**Total Samples:** {len(dataset)} ({len(results)} evaluated, {len(unjudged)} answered but not judged: judge errors, retried on the next run)
+**Average Correctness Score (1-5):** {avg_score:.2f}
+**Retrieval Hit Rate:** {hit_rate:.2%}
+**Latency ({workers} concurrent workers):** p50 {latency['p50']:.2f}s, p95 {latency['p95']:.2f}s, p99 {latency['p99']:.2f}s, max {latency['max']:.2f}s
+**Embedding Cache:** {embedding_stats}\n\n"""
+
+    for r in results:
+        report += f"## Q: {r['question']}\n"
+        report += f"- **Score:** {r['correctness_score']}/5\n"
+        report += f"- **Retrieval Hit:** {r['retrieval_hit']} (Target: {r.get('target_source')})\n"
+        report += f"- **Explanation:** {r['explanation']}\n"
+        report += f"- **Latency:** {r['latency']:.2f}s\n"
+        report += "---\n"
+    for r in unjudged:
+        report += f"## Q: {r['question']}\n"
+        report += "- **Score:** not judged (judge error)\n"
+        report += f"- **Retrieval Hit:** {r['retrieval_hit']} (Target: {r.get('target_source')})\n"
+        report += f"- **Latency:** {r['latency']:.2f}s\n"
+        report += "---\n"
+    return report, avg_score, hit_rate
 
 def main():
     import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--dataset", default="eval_dataset.json", help="Path to evaluation dataset JSON")
+    parser.add_argument("--workers", type=int, default=4, help="Questions answered concurrently")
+    parser.add_argument("--judge-batch", type=int, default=5, help="Answers scored per judge call (1 disables batching)")
+    parser.add_argument("--checkpoint", default=None, help="Progress file (default: evaluation_checkpoint_<dataset>.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="Discard the checkpoint and start over")
     args = parser.parse_args()
 
     dataset_path = args.dataset
@@ -56,86 +297,32 @@ def main():
         print(f"Error: Dataset {dataset_path} not found.")
         return
 
+    dataset_name = os.path.basename(dataset_path).replace('.json', '')
+    checkpoint_path = args.checkpoint or f"evaluation_checkpoint_{dataset_name}.jsonl"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = Checkpoint(checkpoint_path)
+
     agent = Agent()
-    results = []
-    
-    total_score = 0
-    retrieval_hits = 0
-    
-    print(f"Starting evaluation of {len(dataset)} items...")
-    
-    for item in dataset:
-        q = item["question"]
-        gt = item["ground_truth"]
-        source_meta = item.get("source_metadata", {}) # Handle missing metadata safely
-        
-        print(f"\nProcessing: {q}")
-        start_time = time.time()
-        
-        # Run Agent
-        agent_result = agent.run(q)
-        agent_answer = agent_result["response"]
-        retrieved_context = agent_result["context"]
-        duration = time.time() - start_time
-        
-        # 1. Check Retrieval (Hit Rate) - Simple strict check on source filename
-        # Ideally we check if the exact chunk was retrieved, but checking source file is a good proxy for category/file retrieval
-        hit = False
-        target_source = source_meta.get("source")
-        
-        # If we don't have a target source defined, we can't measure retrieval hit 
-        # (or we consider it a hit if we don't require specific retrieval? No, better to skip or fail)
-        if target_source:
-             for ctx in retrieved_context:
-                # Flexible check: contains or exact match
-                if ctx['metadata'].get('source') and target_source in ctx['metadata'].get('source'):
-                    hit = True
-                    break
-        else:
-            # If no source target known, maybe we just assume False or ignore?
-            # For now let's assume False
-            pass
-        
-        if hit:
-            retrieval_hits += 1
-            
-        # 2. Check Correctness (LLM Judge)
-        eval_res = evaluate_response(q, agent_answer, gt)
-        score = eval_res["score"]
-        total_score += score
-        
-        results.append({
-            "question": q,
-            "ground_truth": gt,
-            "agent_answer": agent_answer,
-            "retrieval_hit": hit,
-            "correctness_score": score,
-            "explanation": eval_res["explanation"],
-            "latency": duration,
-            "target_source": target_source
-        })
-        print(f"Score: {score}/5 | Hit: {hit}")
-
-    # Calculate Aggregates
-    avg_score = total_score / len(dataset) if dataset else 0
-    hit_rate = retrieval_hits / len(dataset) if dataset else 0
-    
-    report = f"""# RAG Evaluation Report
-    
-**Dataset:** {dataset_path}
-**Total Samples:** {len(dataset)}
-**Average Correctness Score (1-5):** {avg_score:.2f}
-**Retrieval Hit Rate:** {hit_rate:.2%}\n\n"""
+    # Every question must be answered by the pipeline, not replayed from a similar one
+    agent.answer_cache = None
+    print(f"Starting evaluation of {len(dataset)} items with {args.workers} workers (checkpoint: {checkpoint_path})...")
+    start_time = time.time()
+    try:
+        asyncio.run(run_evaluation(agent, dataset, checkpoint, workers=args.workers, judge_batch=args.judge_batch))
+    finally:
+        checkpoint.close()
+    print(f"Run took {time.time() - start_time:.1f}s")
 
-    for r in results:
-        report += f"## Q: {r['question']}\n"
-        report += f"- **Score:** {r['correctness_score']}/5\n"
-        report += f"- **Retrieval Hit:** {r['retrieval_hit']} (Target: {r.get('target_source')})\n"
-        report += f"- **Explanation:** {r['explanation']}\n"
-        report += f"- **Latency:** {r['latency']:.2f}s\n"
-        report += "---\n"
+    # Report in dataset order
+    results = [checkpoint.judged[item_key(item)] for item in dataset if item_key(item) in checkpoint.judged]
+    unjudged = [
+        checkpoint.answers[key] for key in dict.fromkeys(item_key(item) for item in dataset)
+        if key in checkpoint.answers and key not in checkpoint.judged
+    ]
+    report, avg_score, hit_rate = build_report(dataset_path, dataset, results, args.workers, agent.db.embedding_fn.cache_stats(), unjudged)
         
-    report_filename = f"evaluation_report_{os.path.basename(dataset_path).replace('.json', '')}.md"
+    report_filename = f"evaluation_report_{dataset_name}.md"
     with open(report_filename, "w", encoding="utf-8") as f:
         f.write(report)
         
@@ -1,10 +1,13 @@
+import os
 import json
 import random
-from openai import OpenAI
+import argparse
+from src import llm
 from src.database import get_db
-from src.config import GROK_API_KEY, GROK_MODEL
+from src.config import GROK_MODEL, INTENT_CALIBRATION_DATASETS
+
+EVAL_DATASETS = ("eval_dataset.json", "eval_dataset_converted.json")
 
-client = OpenAI(api_key=GROK_API_KEY, base_url="https://api.x.ai/v1")
 
 def generate_qa_pair(chunk_text, metadata):
     prompt = f"""
@@ -25,7 +28,7 @@ def generate_qa_pair(chunk_text, metadata):
     """
     
     try:
-        response = client.chat.completions.create(
+        response = llm.chat(
             model=GROK_MODEL,
             messages=[{"role": "user", "content": prompt}],
             temperature=0.3
@@ -42,31 +45,68 @@ def generate_qa_pair(chunk_text, metadata):
         print(f"Error generating QA: {e}")
         return None
 
+def eval_source_chunks(paths=EVAL_DATASETS):
+    """Chunk texts the eval questions were generated from."""
+    texts = set()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                texts.update(item["source_chunk"] for item in json.load(f) if item.get("source_chunk"))
+    return texts
+
+def calibration_sample(documents, metadatas, per_category, exclude):
+    """Up to `per_category` chunk indices per agent category, skipping the texts in `exclude`."""
+    from src.agent import CATEGORIES
+    by_category = {}
+    for i, (doc, meta) in enumerate(zip(documents, metadatas)):
+        if len(doc) > 300 and doc not in exclude and meta.get("category") in CATEGORIES:
+            by_category.setdefault(meta["category"], []).append(i)
+    return [i for indices in by_category.values() for i in random.sample(indices, min(per_category, len(indices)))]
+
 def main():
+    parser = argparse.ArgumentParser(description="Generates question/answer pairs from indexed chunks")
+    parser.add_argument("--calibration", action="store_true",
+                        help=f"Questions for calibrating the intent classifier, from chunks of both collections the eval "
+                             f"datasets were not generated from, written to {INTENT_CALIBRATION_DATASETS}")
+    parser.add_argument("--per-category", type=int, default=25, help="Chunks sampled per category with --calibration")
+    args = parser.parse_args()
+
     db = get_db()
-    npa_col = db.get_or_create_collection("npa_collection")
-    
-    # Get all documents (limit to a manageable number for this demo)
-    results = npa_col.get(limit=200) # Increased limit to find better chunks
-    
-    ids = results['ids']
-    documents = results['documents']
-    metadatas = results['metadatas']
+    if args.calibration:
+        documents, metadatas = [], []
+        for name in ("npa_collection", "instructions_collection"):
+            results = db.get_or_create_collection(name).get(include=["documents", "metadatas"])
+            documents += results["documents"]
+            metadatas += results["metadatas"]
+    else:
+        npa_col = db.get_or_create_collection("npa_collection")
+
+        # Get all documents (limit to a manageable number for this demo)
+        results = npa_col.get(limit=200) # Increased limit to find better chunks
+
+        documents = results['documents']
+        metadatas = results['metadatas']
     
-    if not ids:
+    if not documents:
         print("No documents found in DB. Run ingestion first.")
         return
 
-    # Filter for meaningful chunks (len > 300) - Stricter filter
-    indices = [i for i, doc in enumerate(documents) if len(doc) > 300]
-    
-    # Sample 20 random chunks
-    sample_indices = random.sample(indices, min(20, len(indices)))
+    if args.calibration:
+        # Held apart from the eval datasets, which report the accuracy the margin gives
+        sample_indices = calibration_sample(documents, metadatas, args.per_category, eval_source_chunks())
+        output = INTENT_CALIBRATION_DATASETS.split(",")[0].strip()
+        print(f"Generating calibration dataset from {len(sample_indices)} chunks (up to {args.per_category} per category)...")
+    else:
+        # Filter for meaningful chunks (len > 300) - Stricter filter
+        indices = [i for i, doc in enumerate(documents) if len(doc) > 300]
+
+        # Sample 20 random chunks
+        sample_indices = random.sample(indices, min(20, len(indices)))
+        output = "eval_dataset.json"
+        print(f"Generating evaluation dataset from {len(sample_indices)} chunks (filtered from {len(indices)})...")
     
     dataset = []
     
-    print(f"Generating evaluation dataset from {len(sample_indices)} chunks (filtered from {len(indices)})...")
-    
     for i in sample_indices:
         text = documents[i]
         meta = metadatas[i]
@@ -81,10 +121,10 @@ def main():
             })
             print(f"Generated Q: {qa['question']}")
 
-    with open("eval_dataset.json", "w", encoding="utf-8") as f:
+    with open(output, "w", encoding="utf-8") as f:
         json.dump(dataset, f, ensure_ascii=False, indent=2)
     
-    print(f"Saved {len(dataset)} items to eval_dataset.json")
+    print(f"Saved {len(dataset)} items to {output}")
 
 if __name__ == "__main__":
     main()
@@ -1,58 +1,148 @@
 import os
 import re
+import json
+import time
+import queue
+import hashlib
+import functools
+import zipfile
+import itertools
+import contextlib
+import threading
+import collections
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
 import docx
 import fitz  # PyMuPDF
+from lxml import etree
 from src.database import get_db
+from src.intent_classifier import build_intent_classifier
+from src.lexical_index import build_lexical_index
+from src.dedupe import VariantIndex, content_id, variant_key
+from src.config import INGEST_MANIFEST_PATH, INGEST_WORKERS, INGEST_BATCH_SIZE, INGEST_QUEUE_DEPTH, INGEST_FLUSH_SECONDS, DOCX_PARSER, DEDUPE_MASK_DATES
 
 DATABASE_NPA_COLLECTION = "npa_collection"
 DATABASE_INSTRUCTIONS_COLLECTION = "instructions_collection"
 
+# Bump whenever DocxParser/PdfParser output (or the chunk id scheme) changes, so every
+# file is re-chunked on the next ingestion even if its bytes did not change.
+CHUNKER_VERSION = 5
+
+# Target characters per chunk (DOCX and PDF)
+DOCX_CHUNK_SIZE = 2000
+
 def clean_text(text):
     return text.strip().replace('\xa0', ' ')
 
+class HierarchyChunker:
+    """
+    Legal-structure chunking shared by the DOCX and PDF parsers. Paragraphs are fed in
+    reading order; РАЗДЕЛ/Глава/Параграф/Статья headings close the current chunk and update
+    the context, and other paragraphs are merged up to `chunk_size` characters. Every chunk
+    carries the heading hierarchy in its metadata and as a "Контекст:" line in its text.
+    """
+    re_section = re.compile(r'^РАЗДЕЛ\s+\d+\.', re.IGNORECASE)
+    re_chapter = re.compile(r'^Глава\s+\d+\.', re.IGNORECASE)
+    re_paragraph_header = re.compile(r'^Параграф\s+\d+\.', re.IGNORECASE) # Hierarchy paragraph
+    re_article = re.compile(r'^Статья\s+[\d\-]+\.', re.IGNORECASE)
+
+    def __init__(self, source, chunk_size=DOCX_CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.chunks = []
+        # Context trackers
+        self.section = ""
+        self.chapter = ""
+        self.paragraph_header = "" # as in hierarchy paragraph
+        self.article = ""
+        # Buffer for merging small paragraphs, and the page it starts on (PDF only)
+        self.buffer = []
+        self.buffer_size = 0
+        self.buffer_page = None
+
+    @classmethod
+    def is_heading(cls, text):
+        return any(p.match(text) for p in (cls.re_section, cls.re_chapter, cls.re_paragraph_header, cls.re_article))
+
+    def _metadata(self, suffix=""):
+        return {
+            "source": self.source,
+            "section": self.section,
+            "chapter": self.chapter,
+            "paragraph_header": self.paragraph_header,
+            "article": self.article,
+            "full_context": f"{self.section} > {self.chapter} > {self.paragraph_header} > {self.article}{suffix}".strip(" >"),
+        }
+
+    def _commit(self, text_list, metadata):
+        if not text_list:
+            return
+        # Inject context into the text for better embeddings
+        context_header = f"Контекст: {metadata.get('full_context', '')}\n"
+        self.chunks.append({
+            "text": context_header + "\n".join(text_list),
+            "metadata": metadata.copy()
+        })
+
+    def flush(self):
+        """Commits the buffer with the context it was collected under."""
+        if self.buffer:
+            metadata = self._metadata()
+            if self.buffer_page is not None:
+                metadata["page"] = self.buffer_page
+            self._commit(self.buffer, metadata)
+        self.buffer = []
+        self.buffer_size = 0
+        self.buffer_page = None
+
+    def _append(self, text, page):
+        if not self.buffer:
+            self.buffer_page = page
+        self.buffer.append(text)
+        self.buffer_size += len(text)
+
+    def add_paragraph(self, text, page=None):
+        if self.re_section.match(text):
+            self.flush()
+            self.section, self.chapter, self.paragraph_header, self.article = text, "", "", ""
+        elif self.re_chapter.match(text):
+            self.flush()
+            self.chapter, self.paragraph_header, self.article = text, "", ""
+        elif self.re_paragraph_header.match(text):
+            self.flush()
+            self.paragraph_header, self.article = text, ""
+        elif self.re_article.match(text):
+            self.flush()
+            self.article = text
+        elif self.buffer_size + len(text) > self.chunk_size and self.buffer:
+            self.flush()
+        # A heading opens the new buffer
+        self._append(text, page)
+
+    def add_table(self, rows, page=None):
+        """A table is its own chunk, inheriting the current context."""
+        if not rows:
+            return
+        self.flush()
+        metadata = self._metadata(" > Table Content")
+        metadata["type"] = "table"
+        if page is not None:
+            metadata["page"] = page
+        self._commit(rows, metadata)
+
+    def finish(self):
+        self.flush()
+        return self.chunks
+
 class DocxParser:
-    def __init__(self, filepath):
+    def __init__(self, filepath, chunk_size=DOCX_CHUNK_SIZE):
         self.filepath = filepath
+        self.chunk_size = chunk_size
         self.doc = docx.Document(filepath)
     
     def parse(self):
-        chunks = []
-        
-        # Context trackers
-        current_section = ""
-        current_chapter = ""
-        current_paragraph_header = "" # as in hierarchy paragraph
-        current_article = ""
-        
-        # Regex patterns
-        re_section = re.compile(r'^РАЗДЕЛ\s+\d+\.', re.IGNORECASE) 
-        re_chapter = re.compile(r'^Глава\s+\d+\.', re.IGNORECASE)
-        re_paragraph_header = re.compile(r'^Параграф\s+\d+\.', re.IGNORECASE) # Hierarchy paragraph
-        re_article = re.compile(r'^Статья\s+[\d\-]+\.', re.IGNORECASE)
-        
-        # Buffer for merging small paragraphs
-        current_chunk_text = []
-        current_chunk_size = 0
-        CHUNK_SIZE_LIMIT = 2000  # Target characters per chunk
-        
-        def commit_chunk(text_list, metadata):
-             if not text_list:
-                 return
-             full_text = "\n".join(text_list)
-             # Inject context into the text for better embeddings
-             context_header = f"Контекст: {metadata.get('full_context', '')}\n"
-             final_text = context_header + full_text
-             
-             chunks.append({
-                "text": final_text,
-                "metadata": metadata.copy()
-             })
-        
-        # Base metadata for the current buffer
-        # We need to capture the context at the START of the chunk or dominant context.
-        # Simplification: Use current context at commit time? 
-        # Better: Update context immediately when header found, commit previous buffer, start new buffer with new context.
-        
+        chunker = HierarchyChunker(os.path.basename(self.filepath), self.chunk_size)
+
         from docx.oxml.text.paragraph import CT_P
         from docx.oxml.table import CT_Tbl
         from docx.text.paragraph import Paragraph
@@ -61,77 +151,9 @@ class DocxParser:
         # Iterate over all block items in order (interleaved paragraphs and tables)
         for child in self.doc.element.body.iterchildren():
             if isinstance(child, CT_P):
-                para = Paragraph(child, self.doc)
-                text = clean_text(para.text)
-                if not text:
-                    continue
-
-                # Identify hierarchy
-                is_header = False
-                match_section = re_section.match(text)
-                match_chapter = re_chapter.match(text)
-                match_paragraph_header = re_paragraph_header.match(text)
-                match_article = re_article.match(text)
-                
-                if match_section:
-                    is_header = True
-                elif match_chapter:
-                    is_header = True
-                elif match_paragraph_header:
-                    is_header = True
-                elif match_article:
-                    is_header = True
-                
-                if is_header:
-                    # 1. Commit previous buffer with OLD context
-                    if current_chunk_text:
-                        commit_chunk(current_chunk_text, {
-                            "source": os.path.basename(self.filepath),
-                            "section": current_section,
-                            "chapter": current_chapter,
-                            "paragraph_header": current_paragraph_header,
-                            "article": current_article,
-                            "full_context": f"{current_section} > {current_chapter} > {current_paragraph_header} > {current_article}".strip(" >")
-                        })
-                        current_chunk_text = []
-                        current_chunk_size = 0
-                    
-                    # 2. Update Context
-                    if match_section:
-                        current_section = text
-                        current_chapter = ""
-                        current_paragraph_header = ""
-                        current_article = ""
-                    elif match_chapter:
-                        current_chapter = text
-                        current_paragraph_header = ""
-                        current_article = ""
-                    elif match_paragraph_header:
-                        current_paragraph_header = text
-                        current_article = ""
-                    elif match_article:
-                        current_article = text
-                    
-                    # 3. Add Header to NEW buffer
-                    current_chunk_text.append(text)
-                    current_chunk_size += len(text)
-                    
-                else:
-                    # Normal paragraph
-                    if current_chunk_size + len(text) > CHUNK_SIZE_LIMIT and current_chunk_text:
-                        commit_chunk(current_chunk_text, {
-                            "source": os.path.basename(self.filepath),
-                            "section": current_section,
-                            "chapter": current_chapter,
-                            "paragraph_header": current_paragraph_header,
-                            "article": current_article,
-                            "full_context": f"{current_section} > {current_chapter} > {current_paragraph_header} > {current_article}".strip(" >")
-                        })
-                        current_chunk_text = []
-                        current_chunk_size = 0
-                    
-                    current_chunk_text.append(text)
-                    current_chunk_size += len(text)
+                text = clean_text(Paragraph(child, self.doc).text)
+                if text:
+                    chunker.add_paragraph(text)
 
             elif isinstance(child, CT_Tbl):
                 table = Table(child, self.doc)
@@ -140,74 +162,286 @@ class DocxParser:
                     row_data = [clean_text(cell.text) for cell in row.cells if clean_text(cell.text)]
                     if row_data:
                         table_text.append(" | ".join(row_data))
-                
-                if table_text:
-                    # Commit any pending text before the table
-                    if current_chunk_text:
-                         commit_chunk(current_chunk_text, {
-                            "source": os.path.basename(self.filepath),
-                            "section": current_section,
-                            "chapter": current_chapter,
-                            "paragraph_header": current_paragraph_header,
-                            "article": current_article,
-                            "full_context": f"{current_section} > {current_chapter} > {current_paragraph_header} > {current_article}".strip(" >")
-                        })
-                         current_chunk_text = []
-                         current_chunk_size = 0
-
-                    # Commit table as its own chunk, inheriting CURRENT context
-                    commit_chunk(table_text, {
-                        "source": os.path.basename(self.filepath),
-                        "section": current_section,
-                        "chapter": current_chapter,
-                        "paragraph_header": current_paragraph_header,
-                        "article": current_article,
-                        "full_context": f"{current_section} > {current_chapter} > {current_paragraph_header} > {current_article} > Table Content".strip(" >"),
-                        "type": "table"
-                    })
-        
-        # Final commit for text
-        if current_chunk_text:
-             commit_chunk(current_chunk_text, {
-                "source": os.path.basename(self.filepath),
-                "section": current_section,
-                "chapter": current_chapter,
-                "paragraph_header": current_paragraph_header,
-                "article": current_article,
-                "full_context": f"{current_section} > {current_chapter} > {current_paragraph_header} > {current_article}".strip(" >")
-            })
-
-        return chunks
+                chunker.add_table(table_text)
+
+        return chunker.finish()
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+
+class StreamingDocxParser:
+    """
+    DocxParser without python-docx: streams the main document part with lxml iterparse and
+    frees each top-level paragraph or table once it is chunked, so memory stays flat on the
+    largest codes. Text follows python-docx's rules exactly (runs and hyperlinks only; tabs,
+    breaks and no-break hyphens mapped the same way; merged table cells repeated per grid
+    column as `row.cells` does), so the chunks are byte-identical to DocxParser's.
+    """
+    def __init__(self, filepath, chunk_size=DOCX_CHUNK_SIZE):
+        self.filepath = filepath
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def _document_part(archive):
+        """Name of the main document part, as _rels/.rels points to it (normally word/document.xml)."""
+        try:
+            rels = etree.fromstring(archive.read("_rels/.rels"))
+        except KeyError:
+            return "word/document.xml"
+        for rel in rels:
+            if rel.get("Type") == _OFFICE_DOCUMENT:
+                return posixpath.normpath(rel.get("Target").lstrip("/"))
+        return "word/document.xml"
+
+    @staticmethod
+    def _run_text(r):
+        parts = []
+        for e in r:
+            tag = e.tag
+            if tag == _W + "t":
+                parts.append(e.text or "")
+            elif tag == _W + "tab" or tag == _W + "ptab":
+                parts.append("\t")
+            elif tag == _W + "br":
+                parts.append("\n" if e.get(_W + "type", "textWrapping") == "textWrapping" else "")
+            elif tag == _W + "cr":
+                parts.append("\n")
+            elif tag == _W + "noBreakHyphen":
+                parts.append("-")
+        return "".join(parts)
+
+    @classmethod
+    def _paragraph_text(cls, p):
+        parts = []
+        for child in p:
+            if child.tag == _W + "r":
+                parts.append(cls._run_text(child))
+            elif child.tag == _W + "hyperlink":
+                parts.extend(cls._run_text(r) for r in child if r.tag == _W + "r")
+        return "".join(parts)
+
+    @staticmethod
+    def _property(element, container, name, default, unset=None):
+        """w:val of element/container/name: `default` without the property, `unset` if it has no w:val."""
+        props = element.find(_W + container)
+        prop = props.find(_W + name) if props is not None else None
+        return default if prop is None else prop.get(_W + "val", unset)
+
+    @classmethod
+    def _grid_span(cls, tc):
+        return int(cls._property(tc, "tcPr", "gridSpan", 1))
+
+    @classmethod
+    def _row_cells(cls, rows, i):
+        """The cells of row i, one per grid column they cover (vertically merged cells resolve to the cell above)."""
+        cells = []
+        offset = int(cls._property(rows[i], "trPr", "gridBefore", 0))
+        for tc in rows[i].iterchildren(_W + "tc"):
+            cells.extend(cls._resolve_cell(rows, i, tc, offset))
+            offset += cls._grid_span(tc)
+        return cells
+
+    @classmethod
+    def _resolve_cell(cls, rows, i, tc, offset):
+        # A bare <w:vMerge/> continues the merge from the row above
+        if cls._property(tc, "tcPr", "vMerge", None, unset="continue") == "continue":
+            if i == 0:
+                raise ValueError("no tr above topmost tr in w:tbl")
+            # The cell starting at the same grid offset in the row above
+            remaining = offset - int(cls._property(rows[i - 1], "trPr", "gridBefore", 0))
+            for above in rows[i - 1].iterchildren(_W + "tc"):
+                if remaining < 0:
+                    break
+                if remaining == 0:
+                    return cls._resolve_cell(rows, i - 1, above, offset)
+                remaining -= cls._grid_span(above)
+            raise ValueError(f"no `tc` element at grid_offset={offset}")
+        return [tc] * cls._grid_span(tc)
+
+    def _table_rows(self, tbl):
+        rows = list(tbl.iterchildren(_W + "tr"))
+        cell_text = {}
+        table_text = []
+        for i in range(len(rows)):
+            row_data = []
+            for tc in self._row_cells(rows, i):
+                if tc not in cell_text:
+                    cell_text[tc] = clean_text("\n".join(self._paragraph_text(p) for p in tc.iterchildren(_W + "p")))
+                if cell_text[tc]:
+                    row_data.append(cell_text[tc])
+            if row_data:
+                table_text.append(" | ".join(row_data))
+        return table_text
+
+    def parse(self):
+        chunker = HierarchyChunker(os.path.basename(self.filepath), self.chunk_size)
+        with zipfile.ZipFile(self.filepath) as archive, archive.open(self._document_part(archive)) as part:
+            # Same parser options as python-docx, so whitespace-only text nodes are treated alike
+            for _, element in etree.iterparse(part, events=("end",), tag=(_W + "p", _W + "tbl"),
+                                              remove_blank_text=True, resolve_entities=False):
+                body = element.getparent()
+                if body is None or body.tag != _W + "body":
+                    continue # Paragraphs inside tables are read with their table
+                if element.tag == _W + "p":
+                    text = clean_text(self._paragraph_text(element))
+                    if text:
+                        chunker.add_paragraph(text)
+                else:
+                    chunker.add_table(self._table_rows(element))
+                # Drop what has been chunked (and anything before it, e.g. bookmarks)
+                element.clear()
+                while element.getprevious() is not None:
+                    del body[0]
+        return chunker.finish()
 
 class PdfParser:
-    def __init__(self, filepath):
+    """
+    Rebuilds paragraphs from PyMuPDF text blocks (joining wrapped lines, splitting off
+    headings that share a block with body text, dropping bare page numbers) and feeds them
+    to the same HierarchyChunker as DOCX, so chunks merge across page breaks and carry the
+    РАЗДЕЛ/Глава/Статья context plus the page they start on.
+    """
+    def __init__(self, filepath, chunk_size=DOCX_CHUNK_SIZE):
         self.filepath = filepath
-    
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def paragraphs(block_text):
+        lines = [clean_text(line) for line in block_text.split("\n")]
+        paragraph = []
+        for line in lines:
+            if not line:
+                continue
+            if HierarchyChunker.is_heading(line) and paragraph:
+                yield " ".join(paragraph)
+                paragraph = []
+            if paragraph and paragraph[-1].endswith("-") and line[:1].islower():
+                # Word hyphenated across a line break
+                paragraph[-1] = paragraph[-1][:-1] + line
+            else:
+                paragraph.append(line)
+        if paragraph:
+            yield " ".join(paragraph)
+
     def parse(self):
-        chunks = []
-        doc = fitz.open(self.filepath)
-        for page_num, page in enumerate(doc):
-            text = page.get_text()
-            # Simple chunking by paragraph for now for PDFs
-            # PDFs are notoriously hard to retain hierarchy without visual analysis
-            # We will split by double newlines or similar
-            paragraphs = text.split('\n\n')
-            for p in paragraphs:
-                p = clean_text(p)
-                if len(p) > 20: # Filter tiny chunks
-                    chunks.append({
-                        "text": p,
-                        "metadata": {
-                            "source": os.path.basename(self.filepath),
-                            "page": page_num + 1
-                        }
-                    })
-        return chunks
+        chunker = HierarchyChunker(os.path.basename(self.filepath), self.chunk_size)
+        with fitz.open(self.filepath) as doc:
+            for page_num, page in enumerate(doc):
+                # (x0, y0, x1, y1, text, block_no, block_type); type 1 is an image
+                for block in page.get_text("blocks", sort=True):
+                    if block[6] != 0:
+                        continue
+                    for text in self.paragraphs(block[4]):
+                        text = re.sub(r"\s+", " ", text).strip()
+                        if text and not text.isdigit(): # Page numbers
+                            chunker.add_paragraph(text, page=page_num + 1)
+        return chunker.finish()
+
+class IngestManifest:
+    """
+    Persisted record of what is already in the index, per collection and file:
+    {"index_version": n, "collections": {name: {rel_path: {"hash", "chunker_version", "category", "chunk_ids", "variants"}}}}
+    index_version is bumped on every change to the corpus, so caches can tell when they are stale.
+    Chunks are content-addressed and can be shared between files: a chunk's reference count is
+    the number of entries listing it, and it is deleted when that drops to zero.
+    """
+    def __init__(self, path=INGEST_MANIFEST_PATH):
+        self.path = path
+        self.data = {"collections": {}}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+
+    def entries(self, collection_name):
+        return self.data["collections"].setdefault(collection_name, {})
+
+    def bump_version(self):
+        self.data["index_version"] = self.data.get("index_version", 0) + 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+def file_hash(filepath):
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def make_chunk_ids(category, file, chunks):
+    # Per-file ids (process_directory(dedupe=False)): content-derived, so an unchanged chunk
+    # keeps its id when text is inserted or removed before it, but copies in other files don't share it
+    ids = []
+    seen = {}
+    for c in chunks:
+        digest = hashlib.sha1(c["text"].encode("utf-8")).hexdigest()[:16]
+        n = seen.get(digest, 0)
+        seen[digest] = n + 1
+        ids.append(f"{category}_{file}_{digest}" + (f"_{n}" if n else ""))
+    return ids
+
+def assign_chunk_ids(chunks, refs, variants, rel_path, old_ids=()):
+    """
+    Content-addressed ids for the chunks of `rel_path` (which listed `old_ids` so far), with their
+    variant keys. A chunk whose text is already referenced keeps that id. With a VariantIndex,
+    one that differs from a stored chunk only in dates takes that chunk's id, and a new passage
+    is added so later files (and later chunks of this one) can match it. Chunks only this file's
+    previous version lists are not matched: an edited passage is stored with its new text.
+    """
+    own = {chunk_id for chunk_id in old_ids if refs[chunk_id] == {rel_path}}
+    ids, keys = [], []
+    for c in chunks:
+        chunk_id = content_id(c["text"])
+        if variants is not None and chunk_id not in refs and chunk_id not in variants.keys:
+            key = variant_key(c["text"])
+            match = variants.find(key, skip=own)
+            if match is not None:
+                chunk_id = match
+            else:
+                variants.add(chunk_id, key)
+        ids.append(chunk_id)
+        keys.append(variants.keys.get(chunk_id) if variants is not None else None)
+    return ids, keys
+
+def link_chunk_owners(collection, entries):
+    """
+    Sets every chunk's "categories"/"sources" to all files that reference it, and its scalar
+    "category"/"source" to one of them. Writes only touch the chunks of changed files, while a
+    chunk can also be listed by files that didn't change, so this runs after each ingestion.
+    """
+    owners = {}
+    for rel_path in sorted(entries):
+        entry = entries[rel_path]
+        for chunk_id in entry["chunk_ids"]:
+            owners.setdefault(chunk_id, []).append((entry["category"], os.path.basename(rel_path)))
+    if not owners:
+        return
+    res = collection.get(ids=list(owners), include=["metadatas"])
+    ids, metadatas = [], []
+    for chunk_id, meta in zip(res["ids"], res["metadatas"]):
+        pairs = owners[chunk_id]
+        linked = dict(meta)
+        linked["categories"] = list(dict.fromkeys(category for category, _ in pairs))
+        linked["sources"] = list(dict.fromkeys(source for _, source in pairs))
+        if (meta.get("category"), meta.get("source")) not in pairs:
+            # The file it was written from no longer lists it
+            linked["category"], linked["source"] = pairs[0]
+        if linked != meta:
+            ids.append(chunk_id)
+            metadatas.append(linked)
+    if ids:
+        collection.update(ids=ids, metadatas=metadatas)
+        print(f"Linked {len(ids)} chunks to the files that share them.")
 
 def ingest_data():
     db = get_db()
     npa_collection = db.get_or_create_collection(DATABASE_NPA_COLLECTION)
     instructions_collection = db.get_or_create_collection(DATABASE_INSTRUCTIONS_COLLECTION)
+    manifest = IngestManifest()
 
     base_path = os.getcwd()
     npa_path = os.path.join(base_path, "data_npa")
@@ -215,66 +449,365 @@ def ingest_data():
 
     # Ingest NPA
     print("Ingesting NPA...")
-    process_directory(npa_path, npa_collection, is_npa=True)
+    process_directory(npa_path, npa_collection, is_npa=True, manifest=manifest, embedding_fn=db.embedding_fn)
 
     # Ingest Instructions
     print("Ingesting Instructions...")
-    process_directory(instructions_path, instructions_collection, is_npa=False)
+    process_directory(instructions_path, instructions_collection, is_npa=False, manifest=manifest, embedding_fn=db.embedding_fn)
     
+    # Category centroids for the local intent classifier
+    build_intent_classifier([npa_collection, instructions_collection], embedding_fn=db.embedding_fn)
+    # BM25 index over the whole corpus (rebuilt from the collections, since unchanged files are skipped above)
+    build_lexical_index([npa_collection, instructions_collection])
+
     print("Ingestion Complete.")
+    print(f"Embedding cache: {db.embedding_fn.cache_stats()}")
+
+DOCX_PARSERS = {"python-docx": DocxParser, "stream": StreamingDocxParser}
+
+def parse_file(filepath, chunk_size=DOCX_CHUNK_SIZE, docx_parser=DOCX_PARSER):
+    # Module-level so it can be shipped to worker processes
+    if filepath.endswith(".docx"):
+        return DOCX_PARSERS[docx_parser](filepath, chunk_size=chunk_size).parse()
+    return PdfParser(filepath, chunk_size=chunk_size).parse()
+
+def parse_files(filepaths, workers=INGEST_WORKERS, chunk_size=DOCX_CHUNK_SIZE):
+    """
+    Yields parsed chunks for each file, in the same order as `filepaths`.
+    Parsing is CPU-bound, so files are spread over a process pool; at most two files
+    per worker are in flight, so a slow consumer holds back parsing instead of memory.
+    """
+    parse = functools.partial(parse_file, chunk_size=chunk_size)
+    workers = min(workers, len(filepaths))
+    if workers <= 1:
+        for filepath in filepaths:
+            yield parse(filepath)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        remaining = iter(filepaths)
+        in_flight = collections.deque(executor.submit(parse, f) for f in itertools.islice(remaining, 2 * workers))
+        while in_flight:
+            chunks = in_flight.popleft().result()
+            for filepath in itertools.islice(remaining, 1):
+                in_flight.append(executor.submit(parse, filepath))
+            yield chunks
+
+class _Stopped(Exception):
+    """Another stage failed (or the consumer gave up); unwinds this one."""
+
+class _Stage:
+    """
+    One stage of the ingestion pipeline: its bounded input queue, a stop flag shared by all
+    stages, and where its time went (working, waiting for input, blocked on a full output).
+    """
+    def __init__(self, name, stop, depth=INGEST_QUEUE_DEPTH):
+        self.name = name
+        self.stop = stop
+        self.inbox = queue.Queue(maxsize=depth)
+        self.items = 0
+        self.chunks = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+    def get(self):
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self.inbox.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self.stop.is_set():
+                    raise _Stopped()
+        self.starved += time.perf_counter() - start
+        return item
+
+    def send(self, stage, item):
+        """Puts `item` on the next stage's queue, waiting while it is full (backpressure)."""
+        start = time.perf_counter()
+        while True:
+            try:
+                stage.inbox.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if self.stop.is_set():
+                    raise _Stopped()
+        self.blocked += time.perf_counter() - start
+
+    def report(self, wall):
+        rate = f", {self.chunks / self.busy:.0f} chunks/s" if self.busy > 0 and self.chunks else ""
+        return (f"  {self.name:<6} {self.items:>4} {'files' if self.name == 'parse' else 'batches' if self.name == 'embed' else 'writes'}, "
+                f"{self.chunks:>5} chunks: busy {self.busy:.1f}s ({self.busy / wall:.0%} of wall{rate}), "
+                f"waiting {self.starved:.1f}s, blocked {self.blocked:.1f}s")
+
+def _run_stages(stop, stages, consume):
+    """Runs each (name, target) on its own thread and `consume` on this one; the first error stops all and is re-raised."""
+    errors = []
+
+    def run(target):
+        try:
+            target()
+        except _Stopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=run, args=(target,), daemon=True, name=f"ingest-{name}") for name, target in stages]
+    for thread in threads:
+        thread.start()
+    try:
+        consume()
+    except _Stopped:
+        raise errors[0]
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+def process_directory(directory, collection, is_npa=True, manifest=None, workers=INGEST_WORKERS, chunk_size=DOCX_CHUNK_SIZE,
+                      embedding_fn=None, batch_size=INGEST_BATCH_SIZE, dedupe=True, mask_dates=DEDUPE_MASK_DATES):
+    """
+    Brings `collection` in line with the .docx/.pdf files under `directory` (one subfolder per
+    category). Changed files stream through three concurrent stages joined by bounded queues:
+
+        parse  (process pool) -> embed (batches of `batch_size` new chunks, across files) -> write
+
+    so parsing, the embedding API and index writes overlap. A file's manifest entry is saved
+    once all of its chunks are written. Without `embedding_fn` the collection embeds on write.
+
+    Chunks are stored by content: text already in the collection (from any file, or with
+    `mask_dates` differing from it only in dates) is neither embedded nor written again, and
+    link_chunk_owners lists every file sharing it. dedupe=False gives each file its own ids.
+    """
+    if manifest is None:
+        manifest = IngestManifest()
+    entries = manifest.entries(collection.name)
+    if entries and collection.count() == 0:
+        # Index wiped or VECTOR_BACKEND switched: the manifest describes vectors that aren't there
+        print(f"{collection.name} is empty but the manifest lists {len(entries)} files, re-ingesting all of them.")
+        entries.clear()
+    seen_files = set()
+    pending = []
+    skipped = 0
 
-def process_directory(directory, collection, is_npa=True):
     for root, dirs, files in os.walk(directory):
+        dirs.sort()
         category = os.path.basename(root)
         if root == directory: # Skip root folder itself if it contains files (usually files are in subfolders)
             category = "General"
             
-        for file in files:
+        for file in sorted(files):
+            if not (file.endswith(".docx") or file.endswith(".pdf")):
+                continue
+
             file_path = os.path.join(root, file)
             filepath_abs = os.path.abspath(file_path)
-            
-            # Determine parser
-            chunks = []
-            if file.endswith(".docx"):
-                parser = DocxParser(filepath_abs)
-                chunks = parser.parse()
-            elif file.endswith(".pdf"):
-                parser = PdfParser(filepath_abs)
-                chunks = parser.parse()
-            else:
-                continue
-                
-            if not chunks:
+            rel_path = os.path.relpath(filepath_abs, directory)
+            seen_files.add(rel_path)
+
+            digest = file_hash(filepath_abs)
+            entry = entries.get(rel_path)
+            if entry and entry["hash"] == digest and entry["chunker_version"] == CHUNKER_VERSION:
+                skipped += 1
                 continue
-            
-            # Add to DB
-            ids = [f"{category}_{file}_{i}" for i in range(len(chunks))]
-            documents = [c["text"] for c in chunks]
-            metadatas = []
-            for c in chunks:
-                meta = c["metadata"]
-                meta["category"] = category
-                meta["type"] = "NPA" if is_npa else "Instruction"
-                metadatas.append(meta)
-            
-            # Batch add with larger batches for better performance
-            # OpenAI API can handle larger batches efficiently
-            batch_size = 500
-            total_chunks = len(documents)
-            print(f"Processing {file} ({total_chunks} chunks)...", end=" ", flush=True)
-            
-            for i in range(0, len(documents), batch_size):
-                end = min(i + batch_size, len(documents))
-                collection.add(
-                    ids=ids[i:end],
-                    documents=documents[i:end],
-                    metadatas=metadatas[i:end]
-                )
-                # Show progress
-                progress = min(end, total_chunks)
-                print(f"{progress}/{total_chunks}", end=" ", flush=True)
-            
-            print("✓ Done")
+            # None: not tracked yet
+            old_ids = set(entry["chunk_ids"]) if entry else None
+            pending.append((rel_path, category, file, filepath_abs, digest, old_ids))
+
+    # A NumPy collection rewrites a whole snapshot per write, so its writes are buffered and
+    # flushed every INGEST_FLUSH_SECONDS; Chroma persists each write. Either way the manifest is
+    # only saved once what it lists is in the index, so an interrupted run resumes cleanly.
+    buffered = hasattr(collection, "batch")
+    last_flush = time.monotonic()
+
+    def checkpoint(force=False):
+        nonlocal last_flush
+        if buffered:
+            if not force and time.monotonic() - last_flush < INGEST_FLUSH_SECONDS:
+                return
+            collection.flush()
+            last_flush = time.monotonic()
+        manifest.save()
+
+    with collection.batch() if buffered else contextlib.nullcontext():
+        try:
+            # Who references each chunk, and the variant keys new chunks are matched against.
+            # The parse stage keeps both current as it goes, file by file.
+            refs = collections.defaultdict(set)
+            variants = VariantIndex() if dedupe and mask_dates else None
+            for rel_path, entry in entries.items():
+                for chunk_id, key in zip(entry["chunk_ids"], entry.get("variants") or itertools.repeat(None)):
+                    refs[chunk_id].add(rel_path)
+                    if variants is not None:
+                        variants.add(chunk_id, key)
+
+            for rel_path, category, file, _, _, old_ids in pending:
+                if old_ids is None:
+                    # Not tracked yet: drop anything a pre-manifest ingestion left for this file
+                    res = collection.get(where={"$and": [{"source": file}, {"category": category}]}, include=[])
+                    leftover = [chunk_id for chunk_id in res["ids"] if chunk_id not in refs]
+                    if leftover:
+                        collection.delete(ids=leftover)
+
+            stop = threading.Event()
+            parse_stage = _Stage("parse", stop)
+            embed_stage = _Stage("embed", stop)
+            write_stage = _Stage("write", stop)
+
+            def parse():
+                parsed = parse_files([p[3] for p in pending], workers=workers, chunk_size=chunk_size)
+                start = time.perf_counter()
+                for (rel_path, category, file, filepath_abs, digest, old_ids), chunks in zip(pending, parsed):
+                    if dedupe:
+                        ids, keys = assign_chunk_ids(chunks, refs, variants, rel_path, old_ids or ())
+                    else:
+                        ids, keys = make_chunk_ids(category, file, chunks), [None] * len(chunks)
+                    # A passage repeated within the file is kept once, at its first position
+                    first = {}
+                    for i, chunk_id in enumerate(ids):
+                        first.setdefault(chunk_id, i)
+                    record = {
+                        "rel_path": rel_path, "category": category, "file": file, "digest": digest,
+                        "ids": list(first), "documents": [], "metadatas": [], "new": [], "kept": [], "shared": 0, "stale": [],
+                        "variants": [keys[i] for i in first.values()],
+                    }
+                    for n, (chunk_id, i) in enumerate(first.items()):
+                        meta = chunks[i]["metadata"]
+                        meta["category"] = category
+                        meta["type"] = "NPA" if is_npa else "Instruction"
+                        meta["categories"] = [category]
+                        meta["sources"] = [meta["source"]]
+                        record["documents"].append(chunks[i]["text"])
+                        record["metadatas"].append(meta)
+                        if rel_path in refs[chunk_id]:
+                            record["kept"].append(n)
+                        elif refs[chunk_id]:
+                            record["shared"] += 1 # Stored for another file (or an earlier one in this run)
+                        else:
+                            record["new"].append(n)
+                        refs[chunk_id].add(rel_path)
+                    for chunk_id in (old_ids or set()) - first.keys():
+                        refs[chunk_id].discard(rel_path)
+                        if not refs[chunk_id]:
+                            del refs[chunk_id]
+                            if variants is not None:
+                                variants.remove(chunk_id)
+                            record["stale"].append(chunk_id)
+                    record["remaining"] = len(record["new"])
+                    parse_stage.items += 1
+                    parse_stage.chunks += len(ids)
+                    parse_stage.busy += time.perf_counter() - start
+                    parse_stage.send(embed_stage, record)
+                    start = time.perf_counter()
+                parse_stage.send(embed_stage, None)
+
+            def embed():
+                batch = [] # (record, chunk index)
+
+                def flush():
+                    start = time.perf_counter()
+                    documents = [record["documents"][i] for record, i in batch]
+                    embeddings = embedding_fn(documents) if embedding_fn is not None else None
+                    done = []
+                    for record, _ in batch:
+                        record["remaining"] -= 1
+                        if record["remaining"] == 0:
+                            done.append(record)
+                    embed_stage.items += 1
+                    embed_stage.chunks += len(batch)
+                    embed_stage.busy += time.perf_counter() - start
+                    embed_stage.send(write_stage, ("batch", list(batch), embeddings, done))
+                    batch.clear()
+
+                while (record := embed_stage.get()) is not None:
+                    # The file's deletes/metadata updates reach the writer before any of its new chunks
+                    embed_stage.send(write_stage, ("file", record))
+                    for i in record["new"]:
+                        batch.append((record, i))
+                        if len(batch) >= batch_size:
+                            flush()
+                if batch:
+                    flush()
+                embed_stage.send(write_stage, None)
+
+            def finish(record):
+                entries[record["rel_path"]] = {
+                    "hash": record["digest"],
+                    "chunker_version": CHUNKER_VERSION,
+                    "category": record["category"],
+                    "chunk_ids": record["ids"],
+                    "variants": record["variants"],
+                }
+                manifest.bump_version()
+                checkpoint()
+                print(f"✓ {record['file']}")
+
+            def write():
+                written = 0
+                while (item := write_stage.get()) is not None:
+                    start = time.perf_counter()
+                    if item[0] == "file":
+                        record = item[1]
+                        print(f"Processing {record['file']} ({len(record['ids'])} chunks: {len(record['new'])} new, "
+                              f"{len(record['kept'])} unchanged, {record['shared']} shared, {len(record['stale'])} removed)")
+                        if record["stale"]:
+                            collection.delete(ids=record["stale"])
+                        # Unchanged text keeps its embedding; only refresh metadata (page numbers, etc.)
+                        if record["kept"]:
+                            collection.update(
+                                ids=[record["ids"][i] for i in record["kept"]],
+                                metadatas=[record["metadatas"][i] for i in record["kept"]]
+                            )
+                        if not record["new"]:
+                            finish(record)
+                    else:
+                        _, batch, embeddings, done = item
+                        collection.upsert(
+                            ids=[record["ids"][i] for record, i in batch],
+                            documents=[record["documents"][i] for record, i in batch],
+                            metadatas=[record["metadatas"][i] for record, i in batch],
+                            **({"embeddings": embeddings} if embeddings is not None else {})
+                        )
+                        written += len(batch)
+                        write_stage.items += 1
+                        write_stage.chunks += len(batch)
+                        print(f"  {written} chunks written")
+                        for record in done:
+                            finish(record)
+                    write_stage.busy += time.perf_counter() - start
+
+            if pending:
+                start = time.perf_counter()
+                _run_stages(stop, [("parse", parse), ("embed", embed)], write)
+                wall = time.perf_counter() - start
+                print(f"Pipeline: {len(pending)} files in {wall:.1f}s")
+                for stage in (parse_stage, embed_stage, write_stage):
+                    print(stage.report(wall))
+
+            # Files that disappeared from disk since the last run; chunks another file lists stay
+            for rel_path in [p for p in entries if p not in seen_files]:
+                stale_ids = []
+                for chunk_id in entries.pop(rel_path)["chunk_ids"]:
+                    refs[chunk_id].discard(rel_path)
+                    if not refs[chunk_id]:
+                        stale_ids.append(chunk_id)
+                print(f"Removing {rel_path} ({len(stale_ids)} chunks)")
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+                manifest.bump_version()
+                checkpoint()
+
+            link_chunk_owners(collection, entries)
+            checkpoint(force=True)
+        except BaseException:
+            # Files finished before the failure stay done, as they would with a write per file
+            checkpoint(force=True)
+            raise
+
+    if skipped:
+        print(f"Skipped {skipped} unchanged files.")
 
 if __name__ == "__main__":
     ingest_data()
@@ -0,0 +1,231 @@
+import os
+import json
+import time
+import numpy as np
+from src.config import INTENT_CENTROIDS_PATH, INTENT_MIN_MARGIN, INTENT_TARGET_ACCURACY, INTENT_CALIBRATION_DATASETS
+
+class CentroidIntentClassifier:
+    """
+    Zero-latency intent classifier: one normalized mean embedding per category,
+    built from the chunks already labelled by their folder at ingestion time.
+    A query is assigned to the category with the highest cosine similarity;
+    the margin to the runner-up is the confidence. The margin it takes to be trusted is
+    measured per embedding model (calibrate); without a measurement nothing is trusted.
+    """
+    def __init__(self, categories, centroids, model=None, min_margin=None):
+        self.categories = list(categories)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.model = model
+        self.min_margin = min_margin
+
+    @classmethod
+    def build(cls, collections, model=None, page_size=1000):
+        sums = {}
+        counts = {}
+        for collection in collections:
+            offset = 0
+            while True:
+                res = collection.get(include=["embeddings", "metadatas"], limit=page_size, offset=offset)
+                if not res["ids"]:
+                    break
+                for embedding, meta in zip(res["embeddings"], res["metadatas"]):
+                    # A chunk shared by several category folders counts towards each of them
+                    categories = [c for c in meta.get("categories") or [meta.get("category")] if c]
+                    if not categories:
+                        continue
+                    vec = np.asarray(embedding, dtype=np.float32)
+                    vec /= np.linalg.norm(vec) or 1.0
+                    for category in categories:
+                        if category in sums:
+                            sums[category] += vec
+                        else:
+                            sums[category] = vec.copy()
+                        counts[category] = counts.get(category, 0) + 1
+                offset += len(res["ids"])
+
+        categories = sorted(sums)
+        if not categories:
+            return None
+        centroids = np.stack([sums[c] / counts[c] for c in categories])
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        return cls(categories, centroids, model=model)
+
+    def save(self, path=INTENT_CENTROIDS_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path, categories=np.array(self.categories), centroids=self.centroids,
+            model=np.array(self.model or ""), min_margin=np.array(np.nan if self.min_margin is None else self.min_margin)
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INTENT_CENTROIDS_PATH):
+        if not os.path.exists(path):
+            return None
+        data = np.load(path)
+        # Files from before calibration have neither, and are never trusted
+        model = str(data["model"]) if "model" in data else None
+        min_margin = float(data["min_margin"]) if "min_margin" in data else np.nan
+        return cls(data["categories"].tolist(), data["centroids"], model=model or None,
+                   min_margin=None if np.isnan(min_margin) else min_margin)
+
+    def predict(self, query_embedding, allowed=None):
+        """Returns (category, margin). Restricts the choice to `allowed` categories if given."""
+        vec = np.asarray(query_embedding, dtype=np.float32)
+        if vec.shape[0] > self.centroids.shape[1]:
+            # Centroids from a store that keeps only the leading (Matryoshka) dimensions
+            vec = vec[:self.centroids.shape[1]]
+        if vec.shape[0] != self.centroids.shape[1]:
+            return None, 0.0 # Centroids built with a different embedding model/dimension
+        scores = self.centroids @ vec / (np.linalg.norm(vec) or 1.0)
+        ranked = [i for i in np.argsort(-scores) if allowed is None or self.categories[i] in allowed]
+        if not ranked:
+            return None, 0.0
+        best = ranked[0]
+        margin = float(scores[best] - scores[ranked[1]]) if len(ranked) > 1 else 1.0
+        return self.categories[best], margin
+
+    def is_confident(self, margin):
+        # Trigram hashes say little about topic (4 of 8 labelled questions right), so with the
+        # offline stand-in the LLM always decides
+        if not self.model or self.model.startswith("hashing"):
+            return False
+        min_margin = INTENT_MIN_MARGIN if INTENT_MIN_MARGIN is not None else self.min_margin
+        return min_margin is not None and margin >= min_margin
+
+    def evaluate(self, items, embeddings):
+        """(expected, predicted, margin) for each labelled item."""
+        from src.agent import CATEGORIES
+        results = []
+        for item, embedding in zip(items, embeddings):
+            category, margin = self.predict(embedding, allowed=CATEGORIES)
+            results.append((item["source_metadata"]["category"], category, margin))
+        return results
+
+def margin_sweep(results):
+    """For each observed margin as threshold: (threshold, coverage, accuracy above it), largest coverage first."""
+    rows = []
+    for threshold in sorted({margin for _, _, margin in results}):
+        kept = [(expected, predicted) for expected, predicted, margin in results if margin >= threshold]
+        rows.append((threshold, len(kept) / len(results), sum(e == p for e, p in kept) / len(kept)))
+    return rows
+
+def calibrated_margin(results, target_accuracy=INTENT_TARGET_ACCURACY):
+    """The smallest margin above which every threshold reaches target_accuracy, or None if none does."""
+    margin = None
+    for threshold, _, accuracy in reversed(margin_sweep(results)):
+        if accuracy < target_accuracy:
+            break
+        margin = threshold
+    return margin
+
+EVAL_DATASETS = "eval_dataset.json,eval_dataset_converted.json"
+
+def load_labelled(paths=INTENT_CALIBRATION_DATASETS, exclude=()):
+    """
+    Questions labelled with one of the agent's categories, from the comma-separated dataset
+    paths, leaving out the questions in `exclude`.
+    """
+    from src.agent import CATEGORIES
+    items = []
+    for path in paths.split(","):
+        if path.strip() and os.path.exists(path.strip()):
+            with open(path.strip(), "r", encoding="utf-8") as f:
+                items.extend(
+                    item for item in json.load(f)
+                    if item.get("source_metadata", {}).get("category") in CATEGORIES and item["question"] not in exclude
+                )
+    return items
+
+def calibrate(classifier, embedding_fn, items):
+    """Measures the margin to trust on `items` and stores it on the classifier; returns the sweep results."""
+    results = classifier.evaluate(items, embedding_fn([item["question"] for item in items]))
+    classifier.min_margin = calibrated_margin(results)
+    return results
+
+def build_intent_classifier(collections, path=INTENT_CENTROIDS_PATH, embedding_fn=None):
+    classifier = CentroidIntentClassifier.build(collections, model=embedding_fn.name() if embedding_fn else None)
+    if classifier is None:
+        print("Intent classifier: no labelled chunks, skipped.")
+        return None
+    items = load_labelled() if embedding_fn is not None and not classifier.model.startswith("hashing") else []
+    if items:
+        results = calibrate(classifier, embedding_fn, items)
+        if classifier.min_margin is None:
+            print(f"Intent classifier: no margin reaches {INTENT_TARGET_ACCURACY:.0%} on {len(items)} calibration questions, the LLM will classify")
+        else:
+            kept = [(e, p) for e, p, m in results if m >= classifier.min_margin]
+            print(f"Intent classifier: margin {classifier.min_margin:.3f} answers {len(kept)}/{len(items)} calibration questions "
+                  f"locally, {sum(e == p for e, p in kept)} of them right")
+    elif embedding_fn is not None and not classifier.model.startswith("hashing"):
+        print(f"Intent classifier: no calibration questions in {INTENT_CALIBRATION_DATASETS}, the LLM will classify "
+              f"(python -m src.generate_eval_data --calibration)")
+    classifier.save(path)
+    print(f"Intent classifier: {len(classifier.categories)} category centroids saved to {path}")
+    return classifier
+
+def main():
+    """
+    Calibrates the margin on the calibration questions, then reports accuracy, coverage and
+    latency on the eval datasets, without the questions calibration saw.
+    """
+    import argparse
+    from src.embeddings import get_embedding_function
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset", default=EVAL_DATASETS, help="Comma-separated evaluation dataset paths")
+    parser.add_argument("--calibration", default=INTENT_CALIBRATION_DATASETS, help="Comma-separated calibration dataset paths")
+    parser.add_argument("--save", action="store_true", help="Store the calibrated margin with the centroids")
+    args = parser.parse_args()
+
+    classifier = CentroidIntentClassifier.load()
+    if classifier is None:
+        print(f"No centroids at {INTENT_CENTROIDS_PATH}. Run ingestion first.")
+        return
+
+    calibration_items = load_labelled(args.calibration)
+    items = load_labelled(args.dataset, exclude={item["question"] for item in calibration_items})
+    if not items:
+        print("Dataset has no items labelled with a known category (outside the calibration set).")
+        return
+
+    embedding_fn = get_embedding_function()
+    if classifier.model and classifier.model != embedding_fn.name():
+        print(f"Warning: centroids were built with {classifier.model}, queries are embedded with {embedding_fn.name()}")
+    embeddings = embedding_fn([item["question"] for item in items])
+
+    start = time.perf_counter()
+    results = classifier.evaluate(items, embeddings)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(items)
+    for item, (expected, category, margin) in zip(items, results):
+        print(f"[{'+' if category == expected else '-'}] {category} (margin {margin:.3f}) | expected {expected} | {item['question'][:60]}")
+
+    print(f"\nItems: {len(items)}")
+    print(f"Accuracy (local only): {sum(e == p for e, p, _ in results) / len(items):.2%}")
+    print(f"Latency per query: {latency_ms:.3f} ms")
+    print(f"\n{'margin >=':>9} {'coverage':>8} {'accuracy':>8}")
+    for threshold, coverage, accuracy in margin_sweep(results):
+        print(f"{threshold:>9.3f} {coverage:>8.2%} {accuracy:>8.2%}")
+
+    if not calibration_items:
+        print(f"\nNo calibration questions in {args.calibration}; every query would go to the LLM.")
+        margin = None
+    else:
+        margin = calibrated_margin(classifier.evaluate(calibration_items, embedding_fn([item["question"] for item in calibration_items])))
+        if margin is None:
+            print(f"\nNo margin reaches {INTENT_TARGET_ACCURACY:.0%} on {len(calibration_items)} calibration questions; every query would go to the LLM.")
+        else:
+            kept = [(e, p) for e, p, m in results if m >= margin]
+            accuracy = f"{sum(e == p for e, p in kept) / len(kept):.2%} accurate" if kept else "none answered"
+            print(f"\nMargin calibrated on {len(calibration_items)} questions: {margin:.3f}. "
+                  f"On the {len(items)} held-out ones: {len(kept) / len(items):.2%} answered locally, {accuracy}")
+    if classifier.model is None or classifier.model.startswith("hashing"):
+        print(f"Centroids from {classifier.model or 'an unknown model'}: the agent always asks the LLM.")
+    if args.save:
+        classifier.min_margin = margin
+        classifier.save()
+        print(f"Saved to {INTENT_CENTROIDS_PATH}")
+
+if __name__ == "__main__":
+    main()
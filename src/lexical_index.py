@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import math
+import threading
+import numpy as np
+import snowballstemmer
+from src.config import LEXICAL_INDEX_PATH
+
+TOKEN_RE = re.compile(r"[0-9]+|[a-zа-яё]+")
+
+# Function words that only add noise to BM25 on legal text
+STOPWORDS = {
+    "и", "в", "во", "не", "на", "с", "со", "по", "к", "ко", "о", "об", "от", "до", "из", "за",
+    "для", "при", "или", "а", "но", "что", "как", "это", "его", "ее", "их", "то", "же", "ли",
+    "бы", "так", "также", "если", "у", "без", "над", "под", "между", "который", "которые",
+    "которая", "которого", "котором", "этом", "этого", "она", "он", "они", "оно", "мы", "вы", "я",
+}
+
+# Snowball stemmers keep per-word state, so each thread gets its own; the cache is safe to share
+_local = threading.local()
+_stem_cache = {}
+
+def _stem(word):
+    stemmer = getattr(_local, "stemmer", None)
+    if stemmer is None:
+        stemmer = _local.stemmer = snowballstemmer.stemmer("russian")
+    return stemmer.stemWord(word)
+
+def tokenize(text):
+    """Lowercased, stemmed word tokens (numbers are kept as-is, e.g. article numbers)."""
+    tokens = []
+    for word in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if word in STOPWORDS:
+            continue
+        stem = _stem_cache.get(word)
+        if stem is None:
+            stem = word if word.isdigit() else _stem(word)
+            _stem_cache[word] = stem
+        tokens.append(stem)
+    return tokens
+
+class LexicalIndex:
+    """
+    BM25 inverted index over all chunks of all collections.
+    Posting lists are stored on disk as flat numpy arrays (CSR layout: per-term offsets into
+    uint32 doc ids / uint16 term frequencies) and memory-mapped on load. Each chunk has one
+    category code; chunks that several categories share are also listed under the others.
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, vocab, offsets, postings_doc, postings_tf, doc_len, doc_collection, doc_category, doc_ids, collections, categories,
+                 shared_categories=None):
+        self.vocab = vocab # term -> term id
+        self.offsets = offsets
+        self.postings_doc = postings_doc
+        self.postings_tf = postings_tf
+        self.doc_len = doc_len
+        self.doc_collection = doc_collection
+        self.doc_category = doc_category
+        self.doc_ids = doc_ids
+        self.collections = collections
+        self.categories = categories
+        self.shared_categories = shared_categories or {} # category -> docs filed under another category
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        # Precomputed BM25 length normalisation per document
+        self.norm = (self.K1 * (1 - self.B + self.B * doc_len / (self.avg_len or 1.0))).astype(np.float32)
+
+    @classmethod
+    def build(cls, collections, page_size=1000):
+        postings = {} # term -> list of (doc, tf)
+        doc_len = []
+        doc_collection = []
+        doc_category = []
+        doc_ids = []
+        collection_names = [c.name for c in collections]
+        categories = []
+        category_idx = {}
+        shared_categories = {}
+
+        for c_idx, collection in enumerate(collections):
+            offset = 0
+            while True:
+                res = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+                if not res["ids"]:
+                    break
+                for chunk_id, text, meta in zip(res["ids"], res["documents"], res["metadatas"]):
+                    doc = len(doc_ids)
+                    counts = {}
+                    tokens = tokenize(text or "")
+                    for token in tokens:
+                        counts[token] = counts.get(token, 0) + 1
+                    for token, tf in counts.items():
+                        postings.setdefault(token, []).append((doc, tf))
+                    category = (meta or {}).get("category", "")
+                    if category not in category_idx:
+                        category_idx[category] = len(categories)
+                        categories.append(category)
+                    doc_ids.append(chunk_id)
+                    doc_len.append(len(tokens))
+                    doc_collection.append(c_idx)
+                    doc_category.append(category_idx[category])
+                    for other in (meta or {}).get("categories") or ():
+                        if other != category:
+                            shared_categories.setdefault(other, []).append(doc)
+                offset += len(res["ids"])
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            offsets[i + 1] = offsets[i] + len(postings[term])
+        postings_doc = np.empty(offsets[-1], dtype=np.uint32)
+        postings_tf = np.empty(offsets[-1], dtype=np.uint16)
+        for i, term in enumerate(terms):
+            docs, tfs = zip(*postings[term])
+            postings_doc[offsets[i]:offsets[i + 1]] = docs
+            postings_tf[offsets[i]:offsets[i + 1]] = np.minimum(tfs, 65535)
+
+        return cls(
+            {term: i for i, term in enumerate(terms)},
+            offsets,
+            postings_doc,
+            postings_tf,
+            np.asarray(doc_len, dtype=np.uint32),
+            np.asarray(doc_collection, dtype=np.uint8),
+            np.asarray(doc_category, dtype=np.uint16),
+            doc_ids,
+            collection_names,
+            categories,
+            shared_categories,
+        )
+
+    def save(self, path=LEXICAL_INDEX_PATH):
+        os.makedirs(path, exist_ok=True)
+        for name in ("offsets", "postings_doc", "postings_tf", "doc_len", "doc_collection", "doc_category"):
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "terms": sorted(self.vocab, key=self.vocab.get),
+            "doc_ids": self.doc_ids,
+            "collections": self.collections,
+            "categories": self.categories,
+            "shared_categories": self.shared_categories,
+        }
+        tmp_path = os.path.join(path, "meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(path, "meta.json"))
+
+    @classmethod
+    def load(cls, path=LEXICAL_INDEX_PATH):
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            return None
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in ("offsets", "postings_doc", "postings_tf", "doc_len", "doc_collection", "doc_category")
+        }
+        return cls(
+            {term: i for i, term in enumerate(meta["terms"])},
+            arrays["offsets"],
+            arrays["postings_doc"],
+            arrays["postings_tf"],
+            np.asarray(arrays["doc_len"]),
+            np.asarray(arrays["doc_collection"]),
+            np.asarray(arrays["doc_category"]),
+            meta["doc_ids"],
+            meta["collections"],
+            meta["categories"],
+            meta.get("shared_categories"),
+        )
+
+    def search(self, query, k=50, collection=None, category=None):
+        """Returns [(chunk_id, score)] for the top-k BM25 matches, optionally scoped to a collection/category."""
+        n_docs = len(self.doc_ids)
+        term_ids = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not term_ids or not n_docs:
+            return []
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for t in term_ids:
+            start, end = self.offsets[t], self.offsets[t + 1]
+            docs = self.postings_doc[start:end]
+            tf = self.postings_tf[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.K1 + 1) / (tf + self.norm[docs])
+
+        if collection is not None:
+            if collection not in self.collections:
+                return []
+            scores[self.doc_collection != self.collections.index(collection)] = 0
+        if category is not None:
+            shared = self.shared_categories.get(category)
+            if category not in self.categories and not shared:
+                return []
+            if category in self.categories:
+                outside = self.doc_category != self.categories.index(category)
+            else:
+                outside = np.ones(n_docs, dtype=bool)
+            if shared:
+                outside[shared] = False
+            scores[outside] = 0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates])]
+        return [(self.doc_ids[i], float(scores[i])) for i in candidates]
+
+def build_lexical_index(collections, path=LEXICAL_INDEX_PATH):
+    index = LexicalIndex.build(collections)
+    index.save(path)
+    print(f"Lexical index: {len(index.doc_ids)} chunks, {len(index.vocab)} terms saved to {path}")
+    return index
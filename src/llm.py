@@ -0,0 +1,394 @@
+"""
+Shared gateway for every call to the LLM and embedding APIs.
+
+One Upstream per provider (chat on Grok, embeddings on OpenAI) owns a pooled keep-alive
+HTTP client, a concurrency cap, a retry policy and a circuit breaker, so a slow or failing
+upstream costs each caller at most its deadline instead of an open-ended wait.
+
+    response = await llm.achat(model=GROK_MODEL, messages=[...], deadline=LLM_FAST_TIMEOUT)
+    async for chunk in llm.astream_chat(model=GROK_MODEL, messages=[...]): ...
+    response = llm.embed(model=EMBEDDING_MODEL_NAME, input=texts)
+
+openai and httpx are imported when the first client is built (about 1 s), not with this module.
+"""
+import time
+import random
+import asyncio
+import threading
+import contextlib
+import weakref
+from src.config import (
+    GROK_API_KEY,
+    GROK_BASE_URL,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    LLM_TIMEOUT,
+    LLM_CONNECT_TIMEOUT,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_POOL_SIZE,
+    EMBEDDING_TIMEOUT,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_MAX_RETRIES,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_SECONDS,
+)
+
+class UpstreamUnavailable(Exception):
+    """The gateway gave up on a call: circuit open, deadline exhausted or no timely answer."""
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+class UpstreamTimeout(DeadlineExceeded):
+    """The upstream itself didn't answer in time (as opposed to the call queueing for a slot)."""
+
+def retry_delay(error, attempt, base=1.0, cap=60.0):
+    """Seconds to wait before the next attempt: Retry-After if the server sent one, else jittered exponential backoff."""
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after_ms = response.headers.get("retry-after-ms")
+        retry_after = response.headers.get("retry-after")
+        try:
+            if retry_after_ms:
+                return float(retry_after_ms) / 1000 + random.uniform(0, 0.25)
+            if retry_after:
+                return float(retry_after) + random.uniform(0, 0.25)
+        except ValueError:
+            pass  # HTTP-date form; fall back to backoff
+    delay = min(cap, base * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+def is_retryable(error):
+    from openai import RateLimitError, APIStatusError, APIConnectionError, APITimeoutError
+    # TimeoutError is the gateway's own per-attempt timeout (asyncio.wait_for)
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError, TimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def is_upstream_failure(error):
+    from openai import RateLimitError
+    # Rate limits mean "slow down", not "broken": they are retried but don't trip the breaker
+    if isinstance(error, UpstreamTimeout):
+        return True
+    return is_retryable(error) and not isinstance(error, RateLimitError)
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls (after their retries); while
+    open, calls fail immediately. After `reset_seconds` one probe call is let through
+    (half-open): success closes the circuit, failure opens it again.
+    """
+    def __init__(self, name, failure_threshold=5, reset_seconds=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def guard(self):
+        """
+        Wraps one call: raises CircuitOpenError if the circuit is open, otherwise records the
+        outcome. Exceptions that say nothing about the upstream (bad request, cancellation,
+        queueing for a slot) leave the failure count alone.
+        """
+        self.before_call()
+        try:
+            yield
+        except BaseException as e:
+            self.record(True if isinstance(e, Exception) and is_upstream_failure(e) else None)
+            raise
+        self.record(False)
+
+    def before_call(self):
+        with self.lock:
+            if self.state == "closed":
+                return
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self.probing = False
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return
+            raise CircuitOpenError(f"{self.name} circuit is open after {self.failures} failures")
+
+    @property
+    def is_open(self):
+        return self.state == "open"
+
+    def record(self, failed):
+        """failed: True/False for a failed/successful call, None if the call proved nothing."""
+        with self.lock:
+            if failed is None:
+                self.probing = False # let another call probe
+                return
+            if not failed:
+                if self.state != "closed":
+                    print(f"{self.name}: upstream recovered, closing circuit")
+                self.state = "closed"
+                self.failures = 0
+                self.probing = False
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"{self.name}: {self.failures} consecutive failures, opening circuit for {self.reset_seconds}s")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+class Upstream:
+    """
+    One API provider. Sync calls share a thread-safe pooled client; async calls get a client
+    per event loop (httpx connections can't cross loops). `timeout` bounds each attempt,
+    `deadline` (if set) bounds the whole call including queueing for a slot and retries.
+    """
+    def __init__(self, name, api_key, base_url, timeout, deadline=None, max_concurrency=16,
+                 max_retries=2, pool_size=32, breaker=None):
+        self.name = name
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker(name)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self._client = None
+        self._async = weakref.WeakKeyDictionary() # event loop -> (AsyncOpenAI, asyncio.Semaphore)
+        self._lock = threading.Lock()
+
+    def _http_options(self):
+        import httpx
+        return {
+            "limits": httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size, keepalive_expiry=60),
+            "timeout": httpx.Timeout(self.timeout, connect=LLM_CONNECT_TIMEOUT),
+        }
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import httpx
+                from openai import OpenAI
+                self._client = OpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0, # Retries happen here so they count against the deadline
+                    http_client=httpx.Client(**self._http_options()),
+                )
+            return self._client
+
+    def _async_state(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._async.get(loop)
+            if state is None:
+                import httpx
+                from openai import AsyncOpenAI
+                client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.base_url,
+                    max_retries=0,
+                    http_client=httpx.AsyncClient(**self._http_options()),
+                )
+                state = self._async[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+            return state
+
+    def _end(self, deadline):
+        deadline = self.deadline if deadline is None else deadline
+        return None if deadline is None else time.monotonic() + deadline
+
+    def _attempt_timeout(self, end):
+        remaining = None if end is None else end - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"{self.name}: deadline exceeded")
+        return self.timeout if remaining is None else min(self.timeout, remaining)
+
+    def _retry_delay(self, error, attempt, end, timeout):
+        """Backoff before the next attempt; re-raises `error` if it shouldn't be retried."""
+        delay = None
+        if is_retryable(error) and attempt < self.max_retries and not self.breaker.is_open:
+            delay = retry_delay(error, attempt)
+            if end is not None and time.monotonic() + delay >= end:
+                delay = None
+        if delay is None:
+            from openai import APITimeoutError
+            if isinstance(error, (TimeoutError, APITimeoutError)):
+                raise UpstreamTimeout(f"{self.name}: no response within {timeout:.1f}s") from error
+            raise error
+        print(f"{self.name} request failed ({error.__class__.__name__}), retrying in {delay:.1f}s...")
+        return delay
+
+    def call(self, request, deadline=None):
+        """Runs request(client, timeout) with the slot, retry policy and circuit breaker applied."""
+        end = self._end(deadline)
+        with self.breaker.guard():
+            attempt = 0
+            while True:
+                if not self.slots.acquire(timeout=self._attempt_timeout(end)):
+                    raise DeadlineExceeded(f"{self.name}: no free slot within the deadline")
+                try:
+                    timeout = self._attempt_timeout(end)
+                    return request(self.client, timeout)
+                except UpstreamUnavailable:
+                    raise
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, end, timeout)
+                finally:
+                    self.slots.release()
+                time.sleep(delay)
+                attempt += 1
+
+    async def _acquire(self, slots, end):
+        try:
+            await asyncio.wait_for(slots.acquire(), timeout=self._attempt_timeout(end))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{self.name}: no free slot within the deadline")
+
+    async def acall(self, request, deadline=None):
+        """Async variant of call(); request(client, timeout) returns an awaitable."""
+        client, slots = self._async_state()
+        end = self._end(deadline)
+        with self.breaker.guard():
+            attempt = 0
+            while True:
+                await self._acquire(slots, end)
+                try:
+                    timeout = self._attempt_timeout(end)
+                    return await asyncio.wait_for(request(client, timeout), timeout=timeout)
+                except UpstreamUnavailable:
+                    raise
+                except Exception as e:
+                    delay = self._retry_delay(e, attempt, end, timeout)
+                finally:
+                    slots.release()
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _aopen_stream(self, request, client, slots, end):
+        """Opens a stream and reads its first chunk, retrying like acall. Returns (stream, iterator, first) holding a slot."""
+        attempt = 0
+        while True:
+            await self._acquire(slots, end)
+            stream = None
+            try:
+                timeout = self._attempt_timeout(end)
+                stream = await asyncio.wait_for(request(client, timeout), timeout=timeout)
+                iterator = stream.__aiter__()
+                try:
+                    first = await asyncio.wait_for(iterator.__anext__(), timeout=self._attempt_timeout(end))
+                except StopAsyncIteration:
+                    first = None
+                return stream, iterator, first
+            except BaseException as e:
+                slots.release()
+                if stream is not None:
+                    await stream.close()
+                if isinstance(e, UpstreamUnavailable) or not isinstance(e, Exception):
+                    raise
+                delay = self._retry_delay(e, attempt, end, timeout)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def astream(self, request, deadline=None):
+        """
+        Streams with acall's policy, where the deadline covers the time to the first chunk.
+        Nothing is retried once output has been yielded; each further read is bounded by the
+        HTTP read timeout. The concurrency slot is held until the stream is consumed.
+        """
+        client, slots = self._async_state()
+        with self.breaker.guard():
+            stream, iterator, first = await self._aopen_stream(request, client, slots, self._end(deadline))
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in iterator:
+                yield chunk
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.breaker.record(True)
+            raise
+        finally:
+            slots.release()
+            await stream.close()
+
+    def stats(self):
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "max_concurrency": self.max_concurrency,
+        }
+
+_chat_upstream = None
+_embedding_upstream = None
+_init_lock = threading.Lock()
+
+def get_chat_upstream():
+    global _chat_upstream
+    with _init_lock:
+        if _chat_upstream is None:
+            _chat_upstream = Upstream(
+                "chat",
+                GROK_API_KEY,
+                GROK_BASE_URL,
+                timeout=LLM_TIMEOUT,
+                deadline=LLM_TIMEOUT,
+                max_concurrency=LLM_MAX_CONCURRENCY,
+                max_retries=LLM_MAX_RETRIES,
+                pool_size=LLM_POOL_SIZE,
+                breaker=CircuitBreaker("chat", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS),
+            )
+        return _chat_upstream
+
+def get_embedding_upstream():
+    global _embedding_upstream
+    with _init_lock:
+        if _embedding_upstream is None:
+            # Bulk ingestion batches may legitimately wait out long Retry-Afters, so embeddings
+            # bound each attempt and the retry count rather than the total time
+            _embedding_upstream = Upstream(
+                "embeddings",
+                OPENAI_API_KEY,
+                OPENAI_BASE_URL,
+                timeout=EMBEDDING_TIMEOUT,
+                max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+                max_retries=EMBEDDING_MAX_RETRIES,
+                pool_size=LLM_POOL_SIZE,
+                breaker=CircuitBreaker("embeddings", CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS),
+            )
+        return _embedding_upstream
+
+def chat(deadline=None, **kwargs):
+    """chat.completions.create through the gateway (blocking)."""
+    return get_chat_upstream().call(
+        lambda client, timeout: client.chat.completions.create(timeout=timeout, **kwargs), deadline
+    )
+
+async def achat(deadline=None, **kwargs):
+    """chat.completions.create through the gateway."""
+    return await get_chat_upstream().acall(
+        lambda client, timeout: client.chat.completions.create(timeout=timeout, **kwargs), deadline
+    )
+
+async def astream_chat(deadline=None, **kwargs):
+    """Streaming chat.completions.create through the gateway; yields chunks."""
+    async for chunk in get_chat_upstream().astream(
+        lambda client, timeout: client.chat.completions.create(timeout=timeout, stream=True, **kwargs), deadline
+    ):
+        yield chunk
+
+def embed(deadline=None, **kwargs):
+    """embeddings.create through the gateway (blocking)."""
+    return get_embedding_upstream().call(
+        lambda client, timeout: client.embeddings.create(timeout=timeout, **kwargs), deadline
+    )
@@ -0,0 +1,76 @@
+"""
+Concurrent load test for src.server, reporting time-to-first-token and total latency.
+
+    python -m src.loadtest --url http://127.0.0.1:8000 --concurrency 32 --requests 200
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+from src.stats import latency_summary
+
+async def one_request(client, url, query, stream):
+    start = time.perf_counter()
+    ttft = None
+    if not stream:
+        res = await client.post(f"{url}/v1/answer", json={"query": query})
+        res.raise_for_status()
+        return time.perf_counter() - start, time.perf_counter() - start
+
+    async with client.stream("POST", f"{url}/v1/answer/stream", json={"query": query}) as res:
+        res.raise_for_status()
+        event = None
+        async for line in res.aiter_lines():
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - start
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[6:])["error"])
+    return ttft or time.perf_counter() - start, time.perf_counter() - start
+
+async def run(url, queries, concurrency, total, stream):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    ttfts, totals, errors = [], [], []
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker():
+            for _ in counter:
+                try:
+                    ttft, elapsed = await one_request(client, url, random.choice(queries), stream)
+                    ttfts.append(ttft)
+                    totals.append(elapsed)
+                except Exception as e:
+                    errors.append(str(e))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - start
+
+    print(f"Requests: {total}, concurrency: {concurrency}, errors: {len(errors)}")
+    print(f"Throughput: {len(totals) / wall:.2f} req/s over {wall:.1f}s")
+    for name, values in (("TTFT", ttfts), ("Total", totals)):
+        summary = latency_summary(values)
+        print(f"{name}: p50 {summary['p50']:.3f}s  p95 {summary['p95']:.3f}s  p99 {summary['p99']:.3f}s  max {summary['max']:.3f}s")
+    if errors:
+        print(f"First error: {errors[0]}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--dataset", default="eval_dataset.json", help="Questions are sampled from this dataset")
+    parser.add_argument("--no-stream", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.dataset, "r", encoding="utf-8") as f:
+        queries = [item["question"] for item in json.load(f)]
+    asyncio.run(run(args.url, queries, args.concurrency, args.requests, not args.no_stream))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from src.lexical_index import tokenize
+
+class Scorer:
+    """
+    Re-ranking scorer interface.
+    score(query, passages) returns one relevance score per passage (higher is better).
+    Implementations should score a whole batch at once.
+    """
+    name = "base"
+
+    def score(self, query, passages):
+        raise NotImplementedError
+
+    def warm_up(self):
+        """Pays one-off costs (model load, first inference) ahead of the first query."""
+        self.score("warm up", ["warm up"])
+
+class LexicalOverlapScorer(Scorer):
+    """
+    Cheap CPU scorer: share of the query's stems found in the passage, plus a bonus
+    for query stem bigrams that appear verbatim (e.g. "коммунальн собствен").
+    Microseconds per passage, so it always fits the budget.
+    """
+    name = "lexical"
+
+    def score(self, query, passages):
+        q_tokens = tokenize(query)
+        q_terms = set(q_tokens)
+        q_bigrams = set(zip(q_tokens, q_tokens[1:]))
+        if not q_terms:
+            return [0.0] * len(passages)
+        scores = []
+        for passage in passages:
+            p_tokens = tokenize(passage)
+            p_terms = set(p_tokens)
+            coverage = len(q_terms & p_terms) / len(q_terms)
+            bigrams = len(q_bigrams & set(zip(p_tokens, p_tokens[1:]))) / len(q_bigrams) if q_bigrams else 0.0
+            scores.append(coverage + 0.5 * bigrams)
+        return scores
+
+class CrossEncoderScorer(Scorer):
+    """
+    sentence-transformers cross-encoder; loaded lazily since torch is heavy. The load happens
+    on the first score() (inside the re-ranker's budget) unless warm_up() ran first.
+    """
+    name = "cross-encoder"
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.model = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        with self.lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                from src.utils import get_compute_device
+                self.model = CrossEncoder(self.model_name, device=get_compute_device(), max_length=512)
+        return self.model
+
+    def score(self, query, passages):
+        return [float(s) for s in self.load().predict([(query, p) for p in passages], batch_size=len(passages))]
+
+class Reranker:
+    """
+    Re-scores the head of the candidate list with a Scorer under a hard time budget.
+    Only the first `shortlist` candidates (already pruned by fusion) are scored, in batches on
+    a worker thread; if they are not all scored within `budget_ms` the original order is kept,
+    and the worker stops after the batch in progress. So it is if the scorer fails (e.g. the
+    cross-encoder cannot be loaded): re-ranking is an improvement, never a requirement.
+    """
+    def __init__(self, scorer, shortlist=30, budget_ms=150, batch_size=16):
+        self.scorer = scorer
+        self.shortlist = shortlist
+        self.budget_ms = budget_ms
+        self.batch_size = batch_size
+        # One scoring job at a time: a second one would only slow the first down. Time spent
+        # queued behind another request counts against the budget.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def warm_up(self):
+        try:
+            self.scorer.warm_up()
+        except Exception as e:
+            print(f"Could not warm up the {self.scorer.name} re-ranker, queries keep retrieval order while it fails: {e}")
+
+    def rerank(self, query, candidates, top_n=15):
+        """Returns (candidates, info) where info has elapsed_ms, scored, timed_out and error (the scorer's, if any)."""
+        start = time.perf_counter()
+        deadline = start + self.budget_ms / 1000
+        head = candidates[:self.shortlist]
+        scores = []
+
+        def score_head():
+            for i in range(0, len(head), self.batch_size):
+                if time.perf_counter() > deadline:
+                    return # The caller has already fallen back
+                scores.extend(self.scorer.score(query, [c['content'] for c in head[i:i + self.batch_size]]))
+
+        future = self.executor.submit(score_head)
+        error = None
+        try:
+            future.result(timeout=None if self.budget_ms == float("inf") else max(deadline - time.perf_counter(), 0))
+        except FutureTimeout:
+            future.cancel()
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        scored = len(scores)
+        if error is not None or scored < len(head):
+            return candidates[:top_n], {"elapsed_ms": elapsed_ms, "scored": scored, "timed_out": error is None, "error": error}
+
+        order = sorted(range(len(head)), key=lambda i: -scores[i]) # stable: ties keep retrieval order
+        reranked = [head[i] for i in order] + candidates[self.shortlist:]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return reranked[:top_n], {"elapsed_ms": elapsed_ms, "scored": scored, "timed_out": False, "error": None}
+
+def get_reranker(kind, model_name=None, shortlist=30, budget_ms=150):
+    if kind == "none":
+        return None
+    if kind == "cross-encoder":
+        scorer = CrossEncoderScorer(model_name)
+    elif kind == "lexical":
+        scorer = LexicalOverlapScorer()
+    else:
+        raise ValueError(f"Unknown reranker: {kind}")
+    return Reranker(scorer, shortlist=shortlist, budget_ms=budget_ms)
@@ -0,0 +1,197 @@
+"""
+HTTP service around one shared Agent per worker process.
+
+    python -m src.server --workers 4 --port 8000
+
+Endpoints:
+    GET  /health             liveness, always 200 while the process is up
+    GET  /ready              200 once the index is loaded (with its state), 503 before or on failure
+    POST /v1/answer          {"query", "history"?, "use_hyde"?, "use_self_correction"?} -> JSON answer
+    POST /v1/answer/stream   same body; server-sent events: meta, token*, done (or error)
+"""
+import json
+import asyncio
+import argparse
+import contextlib
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from src.llm import UpstreamUnavailable
+from src.config import SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_MAX_CONCURRENCY, SERVER_QUEUE_TIMEOUT
+
+class AgentHolder:
+    """Loads the Agent in the background so the worker accepts health checks immediately."""
+    def __init__(self):
+        self.agent = None
+        self.error = None
+        self.task = None
+
+    async def load(self):
+        from src.agent import Agent
+        try:
+            agent = Agent()
+            timings = await asyncio.to_thread(agent.warm_up)
+            self.agent = agent
+            print("Agent ready (" + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()) + ").")
+        except Exception as e:
+            self.error = f"{e.__class__.__name__}: {e}"
+            print(f"Agent failed to load: {self.error}")
+
+class Busy(Exception):
+    pass
+
+class Slots:
+    """Bounds in-flight pipelines per worker; excess requests queue, then get 503."""
+    def __init__(self, limit, timeout):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.timeout = timeout
+        self.in_flight = 0
+
+    async def acquire(self):
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            raise Busy()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+
+holder = AgentHolder()
+slots = Slots(SERVER_MAX_CONCURRENCY, SERVER_QUEUE_TIMEOUT)
+
+def _context_json(context):
+    return [
+        {"content": c["content"], "metadata": c["metadata"], "distance": c.get("distance"), "score": c.get("score")}
+        for c in context
+    ]
+
+async def _parse_request(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None, JSONResponse({"error": "Body must be JSON"}, status_code=400)
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        return None, JSONResponse({"error": "'query' must be a non-empty string"}, status_code=400)
+    history = body.get("history") or []
+    if not isinstance(history, list) or not all(
+        isinstance(msg, dict) and isinstance(msg.get("role"), str) and isinstance(msg.get("content"), str) for msg in history
+    ):
+        return None, JSONResponse({"error": "'history' must be a list of {\"role\", \"content\"} strings"}, status_code=400)
+    if holder.agent is None:
+        return None, JSONResponse({"error": "Index is not loaded yet", "detail": holder.error}, status_code=503)
+    return {
+        "query": query,
+        "history": [{"role": msg["role"], "content": msg["content"]} for msg in history],
+        "use_hyde": bool(body.get("use_hyde", False)),
+        "use_self_correction": bool(body.get("use_self_correction", True)),
+    }, None
+
+async def health(request: Request):
+    return JSONResponse({"status": "ok"})
+
+async def ready(request: Request):
+    if holder.agent is None:
+        return JSONResponse({"ready": False, "loading": holder.error is None, "error": holder.error}, status_code=503)
+    status = await asyncio.to_thread(holder.agent.status)
+    return JSONResponse({"ready": True, "index": status, "in_flight": slots.in_flight})
+
+async def answer(request: Request):
+    params, error = await _parse_request(request)
+    if error:
+        return error
+    try:
+        await slots.acquire()
+    except Busy:
+        return JSONResponse({"error": "Server busy"}, status_code=503)
+    try:
+        result = await holder.agent.arun(stream=False, **params)
+    except UpstreamUnavailable as e:
+        print(f"Request failed: {e}")
+        return JSONResponse({"error": "LLM upstream unavailable"}, status_code=503)
+    except Exception as e:
+        print(f"Request failed: {e}")
+        return JSONResponse({"error": "Internal error"}, status_code=500)
+    finally:
+        slots.release()
+    return JSONResponse({
+        "response": result["response"],
+        "category": result["category"],
+        "context": _context_json(result["context"]),
+    })
+
+class SlotResponse(StreamingResponse):
+    """
+    Streaming response that holds a slot until it is over, however it ends: finished, failed,
+    or the client gone (also before the first event, when the body generator never starts).
+    """
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            slots.release()
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def answer_stream(request: Request):
+    params, error = await _parse_request(request)
+    if error:
+        return error
+    try:
+        await slots.acquire()
+    except Busy:
+        return JSONResponse({"error": "Server busy"}, status_code=503)
+
+    async def events():
+        try:
+            result = await holder.agent.arun(stream=True, **params)
+            yield _sse("meta", {"category": result["category"], "context": _context_json(result["context"])})
+            response = result["response"]
+            if isinstance(response, str):
+                yield _sse("token", {"text": response})
+            else:
+                async for part in response:
+                    yield _sse("token", {"text": part})
+            yield _sse("done", {})
+        except UpstreamUnavailable as e:
+            print(f"Stream failed: {e}")
+            yield _sse("error", {"error": "LLM upstream unavailable"})
+        except Exception as e:
+            print(f"Stream failed: {e}")
+            yield _sse("error", {"error": "Internal error"})
+
+    return SlotResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    holder.task = asyncio.create_task(holder.load())
+    yield
+    holder.task.cancel()
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/ready", ready),
+        Route("/v1/answer", answer, methods=["POST"]),
+        Route("/v1/answer/stream", answer_stream, methods=["POST"]),
+    ],
+    lifespan=lifespan,
+)
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    args = parser.parse_args()
+    # Each worker process imports the app and loads its own Agent
+    uvicorn.run("src.server:app", host=args.host, port=args.port, workers=args.workers, log_level="warning")
+
+if __name__ == "__main__":
+    main()
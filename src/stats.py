@@ -0,0 +1,15 @@
+def percentile(values, p):
+    """Nearest-rank percentile (p in 0..100) of a list of numbers; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def latency_summary(values):
+    """p50/p95/p99/max of latencies in seconds."""
+    return {
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values, default=0.0),
+    }
@@ -0,0 +1,122 @@
+"""
+Local stand-in for the Grok chat and OpenAI embeddings APIs, for offline and load testing.
+Speaks the OpenAI wire format (including SSE streaming), answers with canned text after a
+configurable delay, and embeds with the deterministic hash_embedding.
+
+    python -m src.stub_upstream --port 9100 --latency-ms 300
+    GROK_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_BASE_URL=http://127.0.0.1:9100/v1 python -m src.server
+"""
+import os
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+from src.embeddings import hash_embedding
+
+LATENCY = float(os.getenv("STUB_LATENCY_MS", "300")) / 1000
+TOKEN_DELAY = float(os.getenv("STUB_TOKEN_DELAY_MS", "5")) / 1000
+# Share of chat requests answered with 503, and of those answered after STUB_STALL_MS instead,
+# to exercise the gateway's retries, deadlines and circuit breaker
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STALL_RATE = float(os.getenv("STUB_STALL_RATE", "0"))
+STALL = float(os.getenv("STUB_STALL_MS", "120000")) / 1000
+
+ANSWER = (
+    "**Порядок действий**\n"
+    "- Заявление подается через веб-портал реестра государственного имущества (п. 6 Правил).\n"
+    "- К заявлению прилагаются документы, предусмотренные Правилами (п. 7 Правил).\n"
+    "- Решение принимается в течение 10 рабочих дней (п. 8 Правил).\n"
+)
+
+def _answer(prompt):
+    # Recognise the agent's prompts by their wording
+    if "маршрутизатор" in prompt:
+        query = prompt.split("Последний запрос:")[-1].split("\n")[0].strip()
+        return json.dumps({"needs_clarification": False, "clarification_question": None, "rewritten_query": query}, ensure_ascii=False)
+    if "Определи наиболее подходящую категорию" in prompt:
+        return "Аренда"
+    if "ГИПОТЕТИЧЕСКИЙ" in prompt:
+        return "Передача имущества осуществляется на основании решения уполномоченного органа по заявлению балансодержателя."
+    if "Auditor" in prompt:
+        return "OK"
+    if "impartial judge" in prompt:
+        cases = prompt.count("### Case ")
+        if cases:
+            return json.dumps({"verdicts": [{"case": i, "score": 4, "explanation": "stub"} for i in range(cases)]})
+        return json.dumps({"score": 4, "explanation": "stub"})
+    return ANSWER
+
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = body["messages"][-1]["content"]
+    text = _answer(prompt)
+    created = int(time.time())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    await asyncio.sleep(STALL if random.random() < STALL_RATE else LATENCY)
+    if random.random() < ERROR_RATE:
+        return JSONResponse({"error": {"message": "stub overloaded", "type": "server_error"}}, status_code=503)
+
+    if not body.get("stream"):
+        return JSONResponse({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4, "total_tokens": (len(prompt) + len(text)) // 4},
+        })
+
+    async def events():
+        for word in text.split(" "):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            await asyncio.sleep(TOKEN_DELAY)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or 1536
+    await asyncio.sleep(LATENCY / 3)
+    vectors = await asyncio.to_thread(lambda: [hash_embedding(text, dimensions) for text in inputs])
+    return JSONResponse({
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "model": body.get("model", "stub"),
+        "usage": {"prompt_tokens": sum(len(t) for t in inputs) // 4, "total_tokens": sum(len(t) for t in inputs) // 4},
+    })
+
+app = Starlette(routes=[
+    Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+    Route("/v1/embeddings", embeddings, methods=["POST"]),
+])
+
+def main():
+    import uvicorn
+    global LATENCY
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY * 1000)
+    args = parser.parse_args()
+    LATENCY = args.latency_ms / 1000
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
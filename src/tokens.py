@@ -0,0 +1,8 @@
+def estimate_tokens(text):
+    """
+    Cheap token estimate without a tokenizer.
+    cl100k-style tokenizers average ~4 bytes per token for Latin text and ~2 Cyrillic
+    characters (also ~4 UTF-8 bytes) per token, so UTF-8 length / 4 is a fair upper-ish bound
+    for our Russian corpus.
+    """
+    return len(text.encode("utf-8")) // 4 + 1
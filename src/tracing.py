@@ -0,0 +1,212 @@
+"""
+Per-request latency tracing.
+
+Agent.arun starts a trace; every stage it runs (router, embedding, classification, HyDE,
+each Chroma query, BM25, fusion, re-ranking, generation, self-correction) records a span
+into it, and the finished trace is appended as one JSON line to TRACE_PATH by a background
+thread. Spans are plain tuples appended to a list, so tracing can stay on in production.
+
+    python -m src.tracing                        # p50/p95/p99 per stage over the whole log
+    python -m src.tracing --last 500 --kind run  # only the most recent 500 requests
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import argparse
+import threading
+import contextlib
+import contextvars
+from src.config import TRACE_PATH, TRACE_SAMPLE_RATE
+from src.stats import latency_summary
+
+_current = contextvars.ContextVar("trace", default=None)
+
+class Trace:
+    def __init__(self, kind, **attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.attrs = attrs
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        self.spans = [] # (name, start, end, attrs); list.append is atomic, so worker threads can add to it
+        self.first_output = None
+        self.finished = False
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Times the block; the yielded dict can be filled with attributes (e.g. a verdict)."""
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs["error"] = e.__class__.__name__
+            raise
+        finally:
+            self.spans.append((name, start, time.perf_counter(), attrs))
+
+    def add_span(self, name, start, end=None, **attrs):
+        self.spans.append((name, start, end or time.perf_counter(), attrs))
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def mark_first_output(self):
+        if self.first_output is None:
+            self.first_output = time.perf_counter()
+
+    def finish(self, **attrs):
+        if self.finished:
+            return
+        self.finished = True
+        end = time.perf_counter()
+        self.attrs.update(attrs)
+        if _current.get() is self:
+            _current.set(None)
+        _writer.write({
+            "trace_id": self.id,
+            "ts": round(self.timestamp, 3),
+            "kind": self.kind,
+            "total_ms": _ms(end - self.start),
+            "ttft_ms": _ms((self.first_output or end) - self.start),
+            "attrs": self.attrs,
+            "spans": [
+                {"name": name, "start_ms": _ms(s - self.start), "ms": _ms(e - s), **span_attrs}
+                for name, s, e, span_attrs in self.spans
+            ],
+        })
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+def start(kind, **attrs):
+    """Starts a trace for the current task/thread, or returns None if tracing is off or the request isn't sampled."""
+    if not TRACE_PATH or (TRACE_SAMPLE_RATE < 1.0 and random.random() >= TRACE_SAMPLE_RATE):
+        _current.set(None)
+        return None
+    trace = Trace(kind, **attrs)
+    _current.set(trace)
+    return trace
+
+def current():
+    return _current.get()
+
+def activate(trace):
+    """Makes `trace` current, e.g. when a stream is resumed from a different task."""
+    _current.set(trace)
+
+def span(name, trace=None, **attrs):
+    """Span on `trace` or the current trace; a no-op context (yielding a scratch dict) when there is none."""
+    trace = trace or _current.get()
+    if trace is None:
+        return contextlib.nullcontext(attrs)
+    return trace.span(name, **attrs)
+
+def annotate(**attrs):
+    trace = _current.get()
+    if trace is not None:
+        trace.set(**attrs)
+
+class TraceWriter:
+    """Appends records from a background thread, one write() per batch so concurrent worker processes don't interleave lines."""
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True, name="trace-writer")
+                    self.thread.start()
+        self.queue.put(record)
+
+    def _run(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while True:
+                records = [self.queue.get()]
+                while True:
+                    try:
+                        records.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = None in records
+                lines = [json.dumps(r, ensure_ascii=False) + "\n" for r in records if r is not None]
+                if lines:
+                    os.write(fd, "".join(lines).encode("utf-8"))
+                if stop:
+                    return
+        finally:
+            os.close(fd)
+
+    def close(self, timeout=2.0):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+_writer = TraceWriter(TRACE_PATH)
+atexit.register(_writer.close)
+
+def load_traces(path, kind=None, last=None):
+    traces = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if kind is None or record.get("kind") == kind:
+                traces.append(record)
+    return traces[-last:] if last else traces
+
+def summarize(traces):
+    """{stage: {"count", "p50", "p95", "p99", "max"}} in ms, plus the end-to-end "total" and "ttft"."""
+    durations = {"total": [t["total_ms"] for t in traces], "ttft": [t["ttft_ms"] for t in traces]}
+    for t in traces:
+        for s in t["spans"]:
+            durations.setdefault(s["name"], []).append(s["ms"])
+    return {name: {"count": len(values), **latency_summary(values)} for name, values in durations.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency percentiles from the trace log")
+    parser.add_argument("--path", default=TRACE_PATH)
+    parser.add_argument("--kind", default=None, help="Only traces of this kind (e.g. run)")
+    parser.add_argument("--last", type=int, default=None, help="Only the most recent N traces")
+    args = parser.parse_args()
+
+    if not args.path or not os.path.exists(args.path):
+        print(f"No trace log at {args.path!r}")
+        return
+    traces = load_traces(args.path, args.kind, args.last)
+    print(f"{len(traces)} traces from {args.path}")
+    if not traces:
+        return
+
+    rows = summarize(traces)
+    # Stages in the order they first appear in a request
+    order = {}
+    for t in traces:
+        for s in t["spans"]:
+            order.setdefault(s["name"], s["start_ms"])
+    names = ["total", "ttft"] + sorted((n for n in rows if n not in ("total", "ttft")), key=lambda n: order.get(n, 0))
+
+    width = max(len(n) for n in names)
+    print(f"{'stage':<{width}}  {'count':>6}  {'p50 ms':>9}  {'p95 ms':>9}  {'p99 ms':>9}  {'max ms':>9}")
+    for name in names:
+        r = rows[name]
+        print(f"{name:<{width}}  {r['count']:>6}  {r['p50']:>9.1f}  {r['p95']:>9.1f}  {r['p99']:>9.1f}  {r['max']:>9.1f}")
+
+    plans = [t["attrs"]["retrieval_plan"] for t in traces if "retrieval_plan" in t["attrs"]]
+    if plans:
+        mix = ", ".join(f"{plan} {plans.count(plan) / len(plans):.0%}" for plan in sorted(set(plans)))
+        print(f"\nRetrieval plans: {mix}")
+
+if __name__ == "__main__":
+    main()
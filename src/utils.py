@@ -1,6 +1,7 @@
-import torch
 import os
 
+# torch is imported inside the functions: it takes seconds to load and only the cross-encoder needs it
+
 def get_compute_device():
     """
     Returns the best available compute device.
@@ -11,6 +12,7 @@ def get_compute_device():
         print("FORCE_CPU enabled, using CPU")
         return "cpu"
     
+    import torch
     if torch.cuda.is_available():
         try:
             # Try to perform a simple operation to verify CUDA actually works
@@ -31,6 +33,7 @@ def print_device_info():
     """
     Prints detailed information about the available hardware.
     """
+    import torch
     device = get_compute_device()
     print(f"Selected Compute Device: {device.upper()}")
     
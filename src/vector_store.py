@@ -0,0 +1,650 @@
+"""
+Exact vector search over memory-mapped NumPy arrays (VECTOR_BACKEND=numpy).
+
+Implements the part of the chromadb client/collection API this project uses, so VectorDB,
+ingestion, the agent and the index builders work unchanged on either backend. Per collection,
+every write produces a new immutable snapshot directory:
+
+    <path>/<collection>/CURRENT            name of the live snapshot, swapped with os.replace
+    <path>/<collection>/v000042/
+        embeddings.npy   float32 [rows, dims], rows grouped by category
+        sq_norms.npy     float32 [rows], squared L2 norms
+        search*.npy      compact first-pass copy, when VECTOR_QUANTIZATION / VECTOR_SEARCH_DIMENSIONS are set
+        category.npy     uint16 [rows], index into meta.json "categories"
+        source.npy       uint32 [rows], index into meta.json "columns"["source"] (likewise any FILTER_COLUMNS)
+        documents.bin / documents.idx.npy   UTF-8 texts, CSR offsets
+        metadatas.bin / metadatas.idx.npy   one JSON object per row, CSR offsets
+        meta.json        ids, categories, each category's [start, end) row range and the rows
+                         outside it whose "categories" list includes it (chunks shared across categories)
+
+Queries are exact: one BLAS matrix-vector product over the matching row range plus argpartition.
+With a compact first pass (float16/int8 codes and/or the leading Matryoshka dimensions), the
+top n_results * VECTOR_RESCORE_FACTOR rows are re-scored against the float32 matrix, which is
+only paged in for those rows; VECTOR_RESCORE_FACTOR=0 doesn't store it at all.
+
+Arrays are opened with mmap, so worker processes share one copy through the OS page cache,
+and readers pick up a new snapshot on their next call. A write rewrites the collection, which
+is fine for a few thousand chunks and a single ingestion process at a time; inside batch(),
+writes are applied in memory and only flush() (and the end of the batch) writes a snapshot.
+Superseded snapshots are removed once a newer one has been live for SNAPSHOT_GRACE_SECONDS,
+so a reader still on one can finish with it.
+
+    python -m src.vector_store              # rows and bytes per collection
+    python -m src.vector_store --reencode   # rewrite with the current storage settings, no re-embedding
+"""
+import os
+import json
+import mmap
+import time
+import shutil
+import contextlib
+import argparse
+import threading
+import numpy as np
+from src.config import CHROMA_PATH, VECTOR_QUANTIZATION, VECTOR_SEARCH_DIMENSIONS, VECTOR_RESCORE_FACTOR
+
+QUANTIZATIONS = ("none", "float16", "int8")
+
+# Rows converted to float32 at a time when scoring float16/int8 codes
+_SCORE_BLOCK = 8192
+
+# How long a superseded snapshot is kept after the next one went live
+SNAPSHOT_GRACE_SECONDS = 60
+
+# Metadata keys stored as coded columns besides category, so filters on them don't decode the
+# JSON of every row (ingestion looks a file's chunks up by source and category)
+FILTER_COLUMNS = ("source",)
+
+def truncate(vectors, dims):
+    """Matryoshka truncation: the leading `dims` components, renormalized. Unchanged if dims is 0 or not smaller."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dims or vectors.shape[-1] <= dims:
+        return vectors
+    prefix = vectors[..., :dims]
+    norms = np.linalg.norm(prefix, axis=-1, keepdims=True)
+    return prefix / np.where(norms == 0, 1.0, norms)
+
+def quantize(vectors, quantization):
+    """(codes, per-row scales or None); int8 is symmetric per row, so code * scale ~ value."""
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127 if len(vectors) else np.zeros(0, dtype=np.float32)
+        scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales
+    return vectors.astype(np.float32), None
+
+def _top_k(distances, k):
+    k = min(k, len(distances))
+    top = np.argpartition(distances, k - 1)[:k] if 0 < k < len(distances) else np.arange(k)
+    return top[np.argsort(distances[top], kind="stable")]
+
+def _matches(meta, where):
+    """Chroma-style metadata filter: {"key": value}, {"key": {"$eq"|"$ne"|"$in"|"$nin"|"$contains": ...}}, "$and", "$or"."""
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(_matches(meta, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(_matches(meta, c) for c in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = meta.get(key)
+            for op, operand in cond.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+                # List metadata: membership (Chroma's array $contains)
+                if op == "$contains" and not (operand in value if isinstance(value, list) else value == operand):
+                    return False
+                if op not in ("$eq", "$ne", "$in", "$nin", "$contains"):
+                    raise ValueError(f"Unsupported where operator: {op}")
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+def _category_filter(where):
+    """
+    (category, include shared rows) from a plain {"category": c} or {"categories": {"$contains": c}}
+    filter, or None if the filter is anything else.
+    """
+    if where and len(where) == 1 and "category" in where:
+        cond = where["category"]
+        if isinstance(cond, dict):
+            return (cond["$eq"], False) if list(cond) == ["$eq"] else None
+        return cond, False
+    if where and len(where) == 1 and isinstance(where.get("categories"), dict) and list(where["categories"]) == ["$contains"]:
+        return where["categories"]["$contains"], True
+    return None
+
+class _Blob:
+    """Variable-length strings stored back to back, addressed through an offsets array."""
+    def __init__(self, path):
+        self.offsets = np.load(path + ".idx.npy", mmap_mode="r")
+        self.file = open(path + ".bin", "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __getitem__(self, i):
+        return self.data[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    @staticmethod
+    def write(path, strings):
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(b) for b in encoded])
+        with open(path + ".bin", "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(path + ".idx.npy", offsets)
+
+class _Snapshot:
+    """One immutable, memory-mapped version of a collection."""
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.categories = meta["categories"]
+        self.ranges = meta["ranges"]
+        self.shared = meta.get("shared", {})
+        self.dimensions = meta.get("dimensions")
+        self.quantization = meta.get("quantization", "none")
+        self.search_dimensions = meta.get("search_dimensions", 0)
+        load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") if os.path.exists(os.path.join(path, f"{name}.npy")) else None
+        # Full-precision rows; absent when a compact store was written without rescoring
+        self.embeddings = load("embeddings")
+        self.sq_norms = load("sq_norms")
+        self.search = load("search")
+        if self.search is None:
+            self.search, self.search_scale, self.search_sq_norms = self.embeddings, None, self.sq_norms
+        else:
+            self.search_scale = load("search_scale")
+            self.search_sq_norms = load("search_sq_norms")
+        self.category = load("category")
+        # key -> (codes, values); snapshots from before a column was added don't have it
+        self.columns = {"category": (self.category, self.categories)}
+        for key, values in meta.get("columns", {}).items():
+            self.columns[key] = (load(key), values)
+        self.documents = _Blob(os.path.join(path, "documents"))
+        self.metadatas = _Blob(os.path.join(path, "metadatas"))
+        self._rows_by_id = None
+
+    @property
+    def compact(self):
+        return self.search is not self.embeddings
+
+    def search_dots(self, rows, queries):
+        """First-pass dot products of the selected rows with each (search-space) query: [rows, queries]."""
+        block = self.search[rows]
+        if block.dtype == np.float32:
+            dots = block @ queries.T
+        else:
+            dots = np.empty((len(block), len(queries)), dtype=np.float32)
+            for i in range(0, len(block), _SCORE_BLOCK):
+                dots[i:i + _SCORE_BLOCK] = block[i:i + _SCORE_BLOCK].astype(np.float32) @ queries.T
+        if self.search_scale is not None:
+            dots *= self.search_scale[rows][:, None]
+        return dots
+
+    def vectors(self, rows):
+        """Stored vectors as float32: full precision when kept, else decoded from the first-pass codes."""
+        if self.embeddings is not None:
+            return np.array(self.embeddings[rows], dtype=np.float32)
+        vectors = np.asarray(self.search[rows], dtype=np.float32)
+        if self.search_scale is not None:
+            vectors = vectors * self.search_scale[rows][:, None]
+        return vectors
+
+    def nbytes(self):
+        search = self.search.nbytes + (self.search_scale.nbytes if self.search_scale is not None else 0)
+        full = self.embeddings.nbytes if self.compact and self.embeddings is not None else 0
+        return search, full
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, chunk_id):
+        if self._rows_by_id is None:
+            self._rows_by_id = {chunk_id: i for i, chunk_id in enumerate(self.ids)}
+        return self._rows_by_id.get(chunk_id)
+
+    def metadata(self, row):
+        return json.loads(self.metadatas[row])
+
+    def rows(self, where):
+        """Matching rows as a contiguous slice when possible (no filter, or a category filter), else an index array."""
+        if not where:
+            return slice(0, len(self))
+        match = _category_filter(where)
+        if match is not None:
+            category, shared = match
+            start, end = self.ranges.get(category, (0, 0))
+            if shared and self.shared.get(category):
+                return np.union1d(np.arange(start, end), self.shared[category])
+            return slice(start, end)
+        mask = self._mask(where)
+        if mask is not None:
+            return np.flatnonzero(mask)
+        return np.flatnonzero([_matches(self.metadata(i), where) for i in range(len(self))])
+
+    def _mask(self, where):
+        """Rows matching `where` as a boolean array, from the columns alone; None if it needs any other key."""
+        mask = np.ones(len(self), dtype=bool)
+        for key, cond in where.items():
+            if key in ("$and", "$or"):
+                masks = [self._mask(c) for c in cond]
+                if any(m is None for m in masks):
+                    return None
+                if key == "$and":
+                    for m in masks:
+                        mask &= m
+                else:
+                    mask &= np.logical_or.reduce(masks) if masks else False
+            elif key == "categories" and isinstance(cond, dict) and list(cond) == ["$contains"]:
+                start, end = self.ranges.get(cond["$contains"], (0, 0))
+                rows = np.zeros(len(self), dtype=bool)
+                rows[start:end] = True
+                rows[self.shared.get(cond["$contains"], [])] = True
+                mask &= rows
+            elif key in self.columns and self.columns[key][0] is not None:
+                codes, values = self.columns[key]
+                for op, operand in (cond.items() if isinstance(cond, dict) else [("$eq", cond)]):
+                    if op not in ("$eq", "$ne", "$in", "$nin", "$contains"):
+                        return None
+                    # A scalar value "contains" only itself
+                    wanted = operand if op in ("$in", "$nin") else [operand]
+                    hit = np.isin(codes, [i for i, value in enumerate(values) if value in wanted])
+                    mask &= ~hit if op in ("$ne", "$nin") else hit
+            else:
+                return None
+        return mask
+
+class NumpyCollection:
+    def __init__(self, path, name, embedding_function=None, quantization="none", search_dimensions=0, rescore_factor=4):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown vector quantization: {quantization}")
+        self.path = path
+        self.name = name
+        self.embedding_function = embedding_function
+        # Storage settings apply to the next write; readers follow whatever the snapshot was written with
+        self.quantization = quantization
+        self.search_dimensions = search_dimensions
+        self.rescore_factor = rescore_factor
+        self._snapshot = None
+        self._snapshot_key = None
+        self._lock = threading.Lock()
+        # Inside batch(): {id: (document, metadata, embedding)} with the buffered writes applied
+        self._write_lock = threading.RLock()
+        self._batching = False
+        self._pending = None
+        self._dirty = False
+
+    # Reading
+
+    def _current(self):
+        """The live snapshot, reopened whenever another process (or this one) has written a new one."""
+        pointer = os.path.join(self.path, "CURRENT")
+        try:
+            st = os.stat(pointer)
+        except FileNotFoundError:
+            return None
+        key = (st.st_ino, st.st_mtime_ns)
+        if key != self._snapshot_key:
+            with self._lock:
+                if key != self._snapshot_key:
+                    with open(pointer, "r", encoding="utf-8") as f:
+                        version = f.read().strip()
+                    self._snapshot = _Snapshot(os.path.join(self.path, version))
+                    self._snapshot_key = key
+        return self._snapshot
+
+    def count(self):
+        with self._write_lock:
+            if self._pending is not None:
+                return len(self._pending)
+        snapshot = self._current()
+        return len(snapshot) if snapshot is not None else 0
+
+    def query(self, query_embeddings=None, n_results=10, where=None, query_texts=None, include=("documents", "metadatas", "distances")):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        snapshot = self._current()
+        if snapshot is None:
+            for key in result:
+                result[key] = [[] for _ in queries]
+            return result
+        rows = snapshot.rows(where)
+        expected = snapshot.dimensions or queries.shape[1]
+        if queries.shape[1] != expected and not (snapshot.search_dimensions and queries.shape[1] > snapshot.search_dimensions):
+            raise ValueError(f"Query embedding has dimension {queries.shape[1]}, collection {self.name} has {expected}")
+        searched = truncate(queries, snapshot.search_dimensions)
+        rescore = bool(self.rescore_factor) and snapshot.compact and snapshot.embeddings is not None
+
+        # Squared L2 distance, as Chroma's default space: |x|^2 + |q|^2 - 2 x.q
+        n_rows = len(snapshot.search_sq_norms[rows])
+        dots = snapshot.search_dots(rows, searched) if n_rows else np.zeros((0, len(queries)), dtype=np.float32)
+        sq_norms = snapshot.search_sq_norms[rows]
+        for j, q in enumerate(queries):
+            distances = sq_norms + float(searched[j] @ searched[j]) - 2 * dots[:, j]
+            if rescore:
+                # Shortlist on the compact codes, then exact distances from the float32 rows
+                top = _top_k(distances, n_results * self.rescore_factor)
+                found = top + rows.start if isinstance(rows, slice) else rows[top]
+                exact = snapshot.sq_norms[found] + float(q @ q) - 2 * (snapshot.embeddings[found] @ q)
+                order = _top_k(exact, n_results)
+                found, top_distances = found[order], exact[order]
+            else:
+                top = _top_k(distances, n_results)
+                found = top + rows.start if isinstance(rows, slice) else rows[top]
+                top_distances = distances[top]
+            result["ids"].append([snapshot.ids[i] for i in found])
+            result["distances"].append([float(d) for d in top_distances])
+            result["documents"].append([snapshot.documents[i] for i in found] if "documents" in include else None)
+            result["metadatas"].append([snapshot.metadata(i) for i in found] if "metadatas" in include else None)
+        return result
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=("documents", "metadatas")):
+        with self._write_lock:
+            if self._pending is not None:
+                return self._get_pending(ids, where, limit, offset, include)
+        snapshot = self._current()
+        if snapshot is None:
+            found = []
+        elif ids is not None:
+            found = [row for row in (snapshot.row_of(chunk_id) for chunk_id in ids) if row is not None]
+            if where:
+                found = [row for row in found if _matches(snapshot.metadata(row), where)]
+        else:
+            rows = snapshot.rows(where)
+            found = range(rows.start, rows.stop) if isinstance(rows, slice) else rows.tolist()
+        found = list(found)[offset or 0:]
+        if limit is not None:
+            found = found[:limit]
+        return {
+            "ids": [snapshot.ids[i] for i in found],
+            "documents": [snapshot.documents[i] for i in found] if "documents" in include else None,
+            "metadatas": [snapshot.metadata(i) for i in found] if "metadatas" in include else None,
+            "embeddings": (
+                snapshot.vectors(found) if found else np.zeros((0, 0), dtype=np.float32)
+            ) if "embeddings" in include else None,
+        }
+
+    def _get_pending(self, ids, where, limit, offset, include):
+        """get() over the buffered rows of a batch, so ingestion reads back what it has written."""
+        rows = self._pending
+        found = [chunk_id for chunk_id in (ids if ids is not None else rows) if chunk_id in rows]
+        if where:
+            found = [chunk_id for chunk_id in found if _matches(rows[chunk_id][1], where)]
+        found = found[offset or 0:]
+        if limit is not None:
+            found = found[:limit]
+        return {
+            "ids": found,
+            "documents": [rows[chunk_id][0] for chunk_id in found] if "documents" in include else None,
+            "metadatas": [dict(rows[chunk_id][1]) for chunk_id in found] if "metadatas" in include else None,
+            "embeddings": (
+                np.stack([rows[chunk_id][2] for chunk_id in found]) if found else np.zeros((0, 0), dtype=np.float32)
+            ) if "embeddings" in include else None,
+        }
+
+    def storage_stats(self):
+        """Rows and bytes of the live snapshot: the matrix every query scans vs. float32 at full dimension."""
+        snapshot = self._current()
+        if snapshot is None or not len(snapshot):
+            return {"rows": 0, "search_bytes": 0, "rescore_bytes": 0, "float32_bytes": 0}
+        search, full = snapshot.nbytes()
+        return {
+            "rows": len(snapshot),
+            "quantization": snapshot.quantization,
+            "search_dimensions": snapshot.search_dimensions or snapshot.dimensions,
+            "search_bytes": search,
+            "rescore_bytes": full,
+            "float32_bytes": len(snapshot) * snapshot.dimensions * 4,
+        }
+
+    def peek(self, limit=10):
+        return self.get(limit=limit, include=("documents", "metadatas", "embeddings"))
+
+    # Writing
+
+    def _load_all(self):
+        snapshot = self._current()
+        if snapshot is None:
+            return {}
+        vectors = snapshot.vectors(slice(0, len(snapshot)))
+        return {
+            chunk_id: (snapshot.documents[i], snapshot.metadata(i), vectors[i])
+            for i, chunk_id in enumerate(snapshot.ids)
+        }
+
+    def reencode(self):
+        """Rewrites the collection with the current storage settings (vectors are not re-embedded)."""
+        self._write(self._load_all())
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Buffers writes until flush() or the end of the block, instead of a snapshot per call.
+        get() and count() see the buffered writes; query() sees the last flushed snapshot.
+        If the block raises, writes since the last flush are dropped.
+        """
+        with self._write_lock:
+            self._batching = True
+        try:
+            yield self
+            self.flush()
+        finally:
+            with self._write_lock:
+                self._batching = False
+                self._pending = None
+                self._dirty = False
+
+    def flush(self):
+        """Writes the batch's buffered changes as one snapshot; a no-op if there are none."""
+        with self._write_lock:
+            if self._dirty:
+                self._write(self._pending)
+                self._dirty = False
+
+    @contextlib.contextmanager
+    def _mutate(self):
+        """Yields the rows to change in place, and writes them now unless a batch is open."""
+        with self._write_lock:
+            if self._batching:
+                if self._pending is None:
+                    self._pending = self._load_all()
+                yield self._pending
+                self._dirty = True
+            else:
+                rows = self._load_all()
+                yield rows
+                self._write(rows)
+
+    def upsert(self, ids, documents=None, metadatas=None, embeddings=None):
+        if embeddings is None:
+            embeddings = self.embedding_function(list(documents))
+        with self._mutate() as rows:
+            for i, chunk_id in enumerate(ids):
+                rows[chunk_id] = (
+                    documents[i] if documents is not None else "",
+                    metadatas[i] if metadatas is not None else {},
+                    np.asarray(embeddings[i], dtype=np.float32),
+                )
+
+    add = upsert
+
+    def update(self, ids, documents=None, metadatas=None, embeddings=None):
+        if documents is not None and embeddings is None:
+            embeddings = self.embedding_function(list(documents))
+        with self._mutate() as rows:
+            for i, chunk_id in enumerate(ids):
+                if chunk_id not in rows:
+                    continue # Chroma ignores ids it doesn't have
+                document, metadata, embedding = rows[chunk_id]
+                rows[chunk_id] = (
+                    documents[i] if documents is not None else document,
+                    metadatas[i] if metadatas is not None else metadata,
+                    np.asarray(embeddings[i], dtype=np.float32) if embeddings is not None else embedding,
+                )
+
+    def delete(self, ids=None, where=None):
+        with self._write_lock:
+            if self._batching and self._pending is None:
+                self._pending = self._load_all()
+            rows = self._pending if self._batching else self._load_all()
+            doomed = set(ids or ()) if ids is not None else set(rows)
+            doomed &= rows.keys()
+            if where:
+                doomed = {chunk_id for chunk_id in doomed if _matches(rows[chunk_id][1], where)}
+            if not doomed:
+                return
+            for chunk_id in doomed:
+                del rows[chunk_id]
+            if self._batching:
+                self._dirty = True
+            else:
+                self._write(rows)
+
+    @staticmethod
+    def _save_full(directory, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        np.save(os.path.join(directory, "embeddings.npy"), vectors)
+        np.save(os.path.join(directory, "sq_norms.npy"), np.einsum("ij,ij->i", vectors, vectors).astype(np.float32))
+
+    def _write(self, rows):
+        os.makedirs(self.path, exist_ok=True)
+        versions = sorted(v for v in os.listdir(self.path) if v.startswith("v") and not v.endswith(".tmp"))
+        version = f"v{int(versions[-1][1:]) + 1 if versions else 1:06d}"
+        tmp_dir = os.path.join(self.path, version + ".tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # Group rows by category (stable), so a category filter is a contiguous slice
+        items = list(rows.items())
+        categories = sorted({meta.get("category", "") for _, meta, _ in rows.values()})
+        code = {c: i for i, c in enumerate(categories)}
+        items.sort(key=lambda item: code[item[1][1].get("category", "")])
+        ranges = {}
+        shared = {}
+        for i, (_, (_, meta, _)) in enumerate(items):
+            start, _ = ranges.get(meta.get("category", ""), (i, i))
+            ranges[meta.get("category", "")] = (start, i + 1)
+            for category in meta.get("categories") or ():
+                if category != meta.get("category", ""):
+                    shared.setdefault(category, []).append(i)
+
+        vectors = [embedding for _, (_, _, embedding) in items]
+        # Rows kept only as first-pass codes come back truncated; new rows are cut to match
+        searched = [truncate(v, self.search_dimensions) for v in vectors]
+        if len({len(v) for v in searched}) > 1:
+            raise ValueError(f"Collection {self.name} would mix embedding dimensions {sorted({len(v) for v in vectors})}")
+        search = np.stack(searched) if items else np.zeros((0, 0), dtype=np.float32)
+        full_dims = {len(v) for v in vectors}
+        previous = self._current()
+        # Query vectors keep the model's full dimension even when only a prefix is stored
+        dimensions = max(full_dims | {previous.dimensions if previous is not None and previous.dimensions else 0})
+        info = {
+            "dimensions": dimensions,
+            "quantization": self.quantization,
+            "search_dimensions": search.shape[1] if items and search.shape[1] < dimensions else 0,
+        }
+        if self.quantization == "none" and not info["search_dimensions"]:
+            # Plain float32: one matrix serves as both first pass and rescoring source
+            self._save_full(tmp_dir, search)
+        else:
+            codes, scales = quantize(search, self.quantization)
+            np.save(os.path.join(tmp_dir, "search.npy"), codes)
+            if scales is not None:
+                np.save(os.path.join(tmp_dir, "search_scale.npy"), scales)
+            decoded = codes.astype(np.float32) * (scales[:, None] if scales is not None else 1.0)
+            np.save(os.path.join(tmp_dir, "search_sq_norms.npy"), np.einsum("ij,ij->i", decoded, decoded).astype(np.float32))
+            if self.rescore_factor and full_dims == {dimensions}:
+                self._save_full(tmp_dir, np.stack(vectors))
+            elif self.rescore_factor and items:
+                print(f"{self.name}: some rows are only stored as first-pass codes, so rescoring is off until re-ingestion")
+
+        np.save(os.path.join(tmp_dir, "category.npy"), np.array([code[meta.get("category", "")] for _, (_, meta, _) in items], dtype=np.uint16))
+        columns = {}
+        for key in FILTER_COLUMNS:
+            column = [meta.get(key) for _, (_, meta, _) in items]
+            values = list(dict.fromkeys(column))
+            value_code = {value: i for i, value in enumerate(values)}
+            np.save(os.path.join(tmp_dir, f"{key}.npy"), np.array([value_code[value] for value in column], dtype=np.uint32))
+            columns[key] = values
+        _Blob.write(os.path.join(tmp_dir, "documents"), [document or "" for _, (document, _, _) in items])
+        _Blob.write(os.path.join(tmp_dir, "metadatas"), [json.dumps(meta, ensure_ascii=False) for _, (_, meta, _) in items])
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": [chunk_id for chunk_id, _ in items], "categories": categories, "ranges": ranges, "shared": shared, "columns": columns, **info}, f, ensure_ascii=False)
+        os.rename(tmp_dir, os.path.join(self.path, version))
+
+        pointer = os.path.join(self.path, "CURRENT")
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+
+        # Readers switch on their next call, so a superseded snapshot is only still in use by
+        # calls already under way. Keep the previous one, and any other that was live recently.
+        now = time.time()
+        for old, newer in zip(versions[:-1], versions[1:]):
+            try:
+                superseded = os.stat(os.path.join(self.path, newer)).st_mtime
+            except FileNotFoundError:
+                continue
+            if now - superseded > SNAPSHOT_GRACE_SECONDS:
+                shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
+
+class NumpyVectorStore:
+    """Stands in for chromadb.PersistentClient: one NumpyCollection per subdirectory of `path`."""
+    def __init__(self, path, quantization=VECTOR_QUANTIZATION, search_dimensions=VECTOR_SEARCH_DIMENSIONS, rescore_factor=VECTOR_RESCORE_FACTOR):
+        self.path = path
+        self.quantization = quantization
+        self.search_dimensions = search_dimensions
+        self.rescore_factor = rescore_factor
+        self.collections = {}
+
+    def get_or_create_collection(self, name, embedding_function=None):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = NumpyCollection(
+                os.path.join(self.path, name), name, embedding_function,
+                quantization=self.quantization, search_dimensions=self.search_dimensions, rescore_factor=self.rescore_factor
+            )
+        return collection
+
+    def list_collections(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(name for name in os.listdir(self.path) if os.path.exists(os.path.join(self.path, name, "CURRENT")))
+
+    def reset(self):
+        self.collections = {}
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or re-encode the NumPy vector store")
+    parser.add_argument("--path", default=os.path.join(CHROMA_PATH, "vectors"))
+    parser.add_argument("--reencode", action="store_true",
+                        help="Rewrite every collection with VECTOR_QUANTIZATION / VECTOR_SEARCH_DIMENSIONS / VECTOR_RESCORE_FACTOR")
+    args = parser.parse_args()
+
+    store = NumpyVectorStore(args.path)
+    names = store.list_collections()
+    if not names:
+        print(f"No collections under {args.path}")
+        return
+    for name in names:
+        collection = store.get_or_create_collection(name)
+        if args.reencode:
+            collection.reencode()
+        stats = collection.storage_stats()
+        print(f"{name}: {stats['rows']} rows, {stats.get('quantization')} x {stats.get('search_dimensions')} dims, "
+              f"first pass {stats['search_bytes'] / 2**20:.1f} MiB, rescoring {stats['rescore_bytes'] / 2**20:.1f} MiB "
+              f"(float32: {stats['float32_bytes'] / 2**20:.1f} MiB)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import collections
+import docx
+from src.database import VectorDB
+from src.dedupe import VariantIndex
+from src.embeddings import HashingEmbeddingFunction
+from src.ingestion import IngestManifest, assign_chunk_ids, process_directory
+
+# Long enough to fingerprint: the two deadlines below are 2 SimHash bits apart
+RULE = (
+    "Статья 5. Порядок рассмотрения заявления. 1. Заявление о передаче государственного имущества из республиканской "
+    "собственности в коммунальную собственность рассматривается уполномоченным органом по государственному имуществу "
+    "в течение {} рабочих дней со дня его поступления. 2. К заявлению прилагаются копия решения местного исполнительного "
+    "органа о согласии на принятие имущества, перечень передаваемого имущества с указанием его балансовой стоимости, а также "
+    "заключение балансодержателя о техническом состоянии объектов. 3. По результатам рассмотрения уполномоченный орган "
+    "направляет заявителю решение о передаче имущества либо мотивированный отказ в письменной форме с указанием оснований "
+    "отказа. 4. Основаниями для отказа являются представление неполного пакета документов, недостоверность сведений, "
+    "содержащихся в документах, а также наличие обременений передаваемого имущества, препятствующих его передаче. "
+    "5. Передача имущества оформляется актом приема-передачи, который подписывается представителями передающей и "
+    "принимающей сторон и утверждается руководителями соответствующих органов."
+)
+
+def write_docx(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(path)
+
+def ingest(directory, index_dir):
+    embedding_fn = HashingEmbeddingFunction()
+    db = VectorDB(path=index_dir, embedding_fn=embedding_fn, backend="numpy")
+    collection = db.get_or_create_collection("npa_collection")
+    manifest = IngestManifest(os.path.join(index_dir, "ingest_manifest.json"))
+    process_directory(directory, collection, manifest=manifest, workers=1, embedding_fn=embedding_fn)
+    return collection, manifest.entries("npa_collection")
+
+def test_number_change_stays_apart():
+    """Two chunks that differ only in a number are two rules, and both are stored."""
+    root = tempfile.mkdtemp()
+    try:
+        write_docx(os.path.join(root, "data", "Аренда", "a.docx"), RULE.format(10))
+        write_docx(os.path.join(root, "data", "Передача", "b.docx"), RULE.format(30))
+        collection, entries = ingest(os.path.join(root, "data"), os.path.join(root, "index"))
+        a, b = entries[os.path.join("Аренда", "a.docx")]["chunk_ids"], entries[os.path.join("Передача", "b.docx")]["chunk_ids"]
+        assert not set(a) & set(b)
+        documents = collection.get(ids=a + b)["documents"]
+        assert any("10 рабочих дней" in d for d in documents) and any("30 рабочих дней" in d for d in documents)
+        print(f"stored {collection.count()} chunks, both deadlines kept")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_amended_copy_keeps_its_edit():
+    """A file shared with another one is edited: the edit is stored, the other file keeps its text."""
+    root = tempfile.mkdtemp()
+    try:
+        data, index = os.path.join(root, "data"), os.path.join(root, "index")
+        write_docx(os.path.join(data, "Аренда", "a.docx"), RULE.format(10))
+        write_docx(os.path.join(data, "Передача", "a.docx"), RULE.format(10))
+        _, entries = ingest(data, index)
+        assert entries[os.path.join("Аренда", "a.docx")]["chunk_ids"] == entries[os.path.join("Передача", "a.docx")]["chunk_ids"]
+
+        write_docx(os.path.join(data, "Передача", "a.docx"), RULE.format(15))
+        collection, entries = ingest(data, index)
+        old, new = entries[os.path.join("Аренда", "a.docx")]["chunk_ids"], entries[os.path.join("Передача", "a.docx")]["chunk_ids"]
+        assert "10 рабочих дней" in collection.get(ids=old)["documents"][0]
+        assert "15 рабочих дней" in collection.get(ids=new)["documents"][0]
+        print("amended copy stored with its edit")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+def test_variant_keys_mask_only_dates():
+    """With date masking, a re-stamped copy reuses the id; a changed number still does not."""
+    chunk = lambda text: {"text": text, "metadata": {}}
+    stamp = "Приказ от {} № 12. " + RULE.format(10)
+    refs, variants = collections.defaultdict(set), VariantIndex()
+    (first,), (key,) = assign_chunk_ids([chunk(stamp.format("02.10.2025"))], refs, variants, "a.docx")
+    refs[first].add("a.docx")
+    (restamped,), _ = assign_chunk_ids([chunk(stamp.format("14.11.2026"))], refs, variants, "b.docx")
+    (renumbered,), _ = assign_chunk_ids([chunk(stamp.format("02.10.2025").replace("№ 12", "№ 13"))], refs, variants, "c.docx")
+    assert key is not None and restamped == first and renumbered != first
+    (unmasked,), _ = assign_chunk_ids([chunk(stamp.format("14.11.2026"))], refs, None, "b.docx")
+    assert unmasked != first
+
+    # Years are masked in a date context only; a four-digit amount is kept
+    fee = "Приказ от 17 марта {} года. Плата составляет {} МРП. " + RULE.format(10)
+    (year,), _ = assign_chunk_ids([chunk(fee.format(2015, 1950))], refs, variants, "d.docx")
+    refs[year].add("d.docx")
+    (next_year,), _ = assign_chunk_ids([chunk(fee.format(2016, 1950))], refs, variants, "e.docx")
+    (amount,), _ = assign_chunk_ids([chunk(fee.format(2015, 2050))], refs, variants, "f.docx")
+    assert next_year == year and amount != year
+    print("dates masked, numbers kept")
+
+if __name__ == "__main__":
+    test_number_change_stays_apart()
+    test_amended_copy_keeps_its_edit()
+    test_variant_keys_mask_only_dates()
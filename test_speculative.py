@@ -0,0 +1,42 @@
+import asyncio
+from src.agent import Agent
+
+def make_agent(retrieved):
+    """Agent whose router paraphrases the query and whose classifier is slower than the router."""
+    agent = Agent()
+    agent.answer_cache = None
+
+    async def acheck_need_clarification(query, history):
+        return {"needs_clarification": False, "rewritten_query": query + " (перефразировано)"}
+
+    async def aclassify_intent(query, embedding=None):
+        await asyncio.sleep(0.2) # e.g. the LLM fallback
+        return "Аренда"
+
+    async def agenerate_hyde_doc(query):
+        await asyncio.sleep(0.2)
+        return "Гипотетический документ"
+
+    async def aretrieve(query, category, use_hyde=False, hyde_doc=None, query_embedding=None, **kwargs):
+        retrieved.append((query, category, hyde_doc))
+        return []
+
+    agent.acheck_need_clarification = acheck_need_clarification
+    agent.aclassify_intent = aclassify_intent
+    agent.agenerate_hyde_doc = agenerate_hyde_doc
+    agent.aretrieve = aretrieve
+    agent.embed_query = lambda text: [0.0]
+    return agent
+
+def test_rewritten_query_keeps_shared_stages():
+    """Dropping the speculative retrieval must not cancel the classification and HyDE it waits on."""
+    for use_hyde in (False, True):
+        retrieved = []
+        agent = make_agent(retrieved)
+        result = asyncio.run(agent._arun("Как продать квартиру?", [], use_hyde, False, False))
+        assert result["category"] == "Аренда"
+        assert retrieved == [("Как продать квартиру? (перефразировано)", "Аренда", "Гипотетический документ" if use_hyde else None)]
+        print(f"use_hyde={use_hyde}: retrieved on the rewritten query as {result['category']}")
+
+if __name__ == "__main__":
+    test_rewritten_query_keeps_shared_stages()